@@ -1,8 +1,10 @@
 import streamlit as st
-from travel_planner_chatbot import chatbot, retrieve_all_threads, submit_async_task
+from travel_planner_chatbot import chatbot, retrieve_all_threads, submit_async_task, job_queue
+from streaming import pump_chat_stream
+from jobs import DONE, FAILED
 import queue
 from uuid import uuid4
-from langchain_core.messages import ToolMessage, HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage
 
 def generate_thread_id():
     return str(uuid4())
@@ -21,6 +23,48 @@ def load_conversation(thread_id):
     state = chatbot.get_state(config={"configurable": {"thread_id": thread_id}}).values
     return state.get("messages", [])
 
+# Background jobs: the job id lives in the URL, so a reloaded tab picks its job up again
+JOB_KINDS = {"Itinerary": "itinerary", "Trip cost": "cost", "Packing list": "packing"}
+STEP_ICONS = {"queued": "⏳", "running": "🔄", "done": "✅", "failed": "⚠️"}
+
+def job_params(kind, destination, days, budget, origin, checkin, trip_type):
+    """Parameters as the matching chat tool sends them, so the form and the chat share jobs."""
+    if kind == "itinerary":
+        return {"destination": destination, "days": days, "budget": budget, "hotel_nightly": 0.0,
+                "daily_expenses": 0.0, "origin": origin or None, "checkin_date": checkin}
+    if kind == "cost":
+        return {"destination": destination, "days": days, "flight_cost": 500.0, "hotel_budget": 100.0,
+                "daily_expenses": 50.0, "origin": origin or None, "checkin_date": checkin, "adults": 1}
+    return {"destination": destination, "days": days, "trip_type": trip_type or "general"}
+
+def render_job(record):
+    state = {DONE: "complete", FAILED: "error"}.get(record["status"], "running")
+    label = f"{record['kind'].title()} for {record['params']['destination']}: {record['status']}"
+    with st.status(label, state=state, expanded=record["status"] != DONE):
+        for step in job_queue.kinds[record["kind"]]:
+            info = record["steps"].get(step.name, {"status": "queued"})
+            line = f"{STEP_ICONS.get(info['status'], '')} {step.name}"
+            if "seconds" in info:
+                line += f" ({info['seconds']}s)"
+            if info.get("error"):
+                line += f" — {info['error']}"
+            st.write(line)
+            
+    if record["status"] == DONE:
+        st.json(record["result"], expanded=False)
+    elif record["status"] == FAILED:
+        st.error(record["error"])
+
+@st.fragment(run_every=1)
+def job_progress(job_id):
+    """Poll a running job; once it settles, rerun the page to show the final state without polling."""
+    record = job_queue.get(job_id)
+    if record is None:
+        return
+    render_job(record)
+    if record["status"] in (DONE, FAILED):
+        st.rerun()
+
 # Initialize session state
 if "message_history" not in st.session_state:
     st.session_state["message_history"] = []
@@ -41,6 +85,24 @@ st.title("✈️ Your AI Travel Companion")
 if st.sidebar.button("New Chat"):
     reset_chat()
     
+st.sidebar.header("Plan in the background")
+
+with st.sidebar.form("job_form"):
+    job_label = st.selectbox("Request", list(JOB_KINDS))
+    job_destination = st.text_input("Destination")
+    job_days = st.number_input("Days", min_value=1, max_value=30, value=5)
+    job_budget = st.number_input("Budget (USD)", min_value=0.0, value=1000.0, step=100.0)
+    job_origin = st.text_input("Flying from (optional)")
+    job_checkin = st.date_input("Arrival date (optional)", value=None)
+    job_trip_type = st.text_input("Trip type (packing)", value="general")
+    start_job = st.form_submit_button("Start")
+
+if start_job and job_destination.strip():
+    kind = JOB_KINDS[job_label]
+    params = job_params(kind, job_destination.strip(), int(job_days), float(job_budget), job_origin.strip(),
+                        job_checkin.isoformat() if job_checkin else None, job_trip_type.strip())
+    st.query_params["job"] = job_queue.submit(kind, params)
+    
 st.sidebar.header("Conversations")
 
 # List existing chat threads
@@ -56,6 +118,32 @@ for thread_id in st.session_state["chat_threads"][::-1]:
             
         st.session_state["message_history"] = temporary_messages
 
+# Show the background job of this tab, if any
+if "job" in st.query_params:
+    job_id = st.query_params["job"]
+    record = job_queue.get(job_id)
+    
+    if record is None:
+        st.info("That background job has expired; start it again from the sidebar.")
+    else:
+        # A job left "running" by a restarted server is resumed from its completed steps
+        if record["status"] not in (DONE, FAILED) and not job_queue.active(job_id):
+            job_queue.submit(record["kind"], record["params"])
+            record = job_queue.get(job_id)
+            
+        if record["status"] in (DONE, FAILED):
+            render_job(record)
+        else:
+            job_progress(job_id)
+            
+        col_resume, col_close = st.columns(2)
+        if record["status"] == FAILED and col_resume.button("Resume job"):
+            job_queue.submit(record["kind"], record["params"])
+            st.rerun()
+        if col_close.button("Close job"):
+            del st.query_params["job"]
+            st.rerun()
+
 # Display chat messages from history
 for message in st.session_state["message_history"]:
     with st.chat_message(message["role"]):
@@ -87,12 +175,14 @@ if user_input:
 
             async def run_stream():
                 try:
-                    async for message_chunk, metadata in chatbot.astream(
-                        {"messages": [HumanMessage(content=user_input)]},
-                        config=chat_config,
-                        stream_mode="messages"
-                    ):
-                        event_queue.put((message_chunk, metadata))
+                    await pump_chat_stream(
+                        chatbot.astream(
+                            {"messages": [HumanMessage(content=user_input)]},
+                            config=chat_config,
+                            stream_mode=["messages", "updates"]
+                        ),
+                        event_queue.put
+                    )
                 except Exception as e:
                     event_queue.put(("error", e))
                 finally:
@@ -100,38 +190,35 @@ if user_input:
 
             submit_async_task(run_stream()) # submit the backend coroutine
             
-            # Stream AI messages
+            # Stream coalesced frames; tool status only changes on start/finish transitions
             while True:
                 item = event_queue.get()
                 if item is None:
                     break
 
-                message_chunk, metadata = item
+                kind, payload = item
 
-                if message_chunk == "error":
-                    raise metadata
+                if kind == "error":
+                    raise payload
 
-                # Update tool status if applicable
-                if isinstance(message_chunk, ToolMessage):
-                    tool_name = getattr(message_chunk, "name", None) or getattr(metadata, "tool_name", None) or "tool"
-                    
-                    # Add tool name to list of used tools
-                    if tool_name not in status_holder["used_tools"]:
-                        status_holder["used_tools"].append(tool_name)
-                        
-                    # Update tool status
+                if kind == "tools_started":
+                    for tool_name in payload:
+                        if tool_name not in status_holder["used_tools"]:
+                            status_holder["used_tools"].append(tool_name)
+
+                    label = f"🛠️ Running tool: {', '.join(payload)}..."
                     if status_holder["box"] is None:
-                        status_holder["box"] = st.status(
-                            f"🛠️ Running tool: {tool_name}...", expanded=True
-                        )
+                        status_holder["box"] = st.status(label, expanded=True)
                     else:
-                        status_holder["box"].update(
-                            label=f"🛠️ Running tool: {tool_name}...", state="running", expanded=True
-                        )
-                
-                # Stream only AI messages to the chat
-                if isinstance(message_chunk, AIMessage):
-                    yield message_chunk.content
+                        status_holder["box"].update(label=label, state="running", expanded=True)
+
+                elif kind == "tools_finished" and status_holder["box"] is not None:
+                    status_holder["box"].update(
+                        label=f"🛠️ Finished tool: {', '.join(payload)}", state="running", expanded=False
+                    )
+
+                elif kind == "text":
+                    yield payload
         
         ai_message = st.write_stream(ai_only_stream())
           
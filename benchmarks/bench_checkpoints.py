@@ -0,0 +1,133 @@
+""" Checkpoint storage formats: LangGraph's plain serializer vs the deduplicating, compressed one.
+
+Simulated conversations run through a graph shaped like the chatbot's (chat -> tools -> chat), so each
+turn writes several checkpoints and pending writes. For each format: write throughput, latency of
+loading a thread's latest checkpoint, payload bytes per turn and the bytes the last turn added
+(which grows with conversation length under the plain format). Finally the plain database is
+migrated in place with checkpoint_store.py.
+
+Run with:  python benchmarks/bench_checkpoints.py [--threads 4] [--turns 30]
+"""
+import argparse, asyncio, json, os, random, shutil, sys, tempfile, time
+from typing import Annotated, TypedDict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import aiosqlite
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+
+import checkpoint_store
+
+WORDS = ("museum hotel river walk tram breakfast rooftop gallery market station ticket evening rain sunny "
+         "bridge castle cathedral harbour park opera bistro metro airport budget nightly rating review").split()
+
+def text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+class State(TypedDict):
+    messages: Annotated[list, add_messages]
+
+def build_graph(checkpointer, seed: int):
+    rng = random.Random(seed)
+
+    def chat(state):
+        if isinstance(state["messages"][-1], ToolMessage):
+            return {"messages": [AIMessage(content=text(rng, 180))]}
+        call_id = f"call_{len(state['messages'])}"
+        return {"messages": [AIMessage(content="", tool_calls=[{"name": "search_hotels", "id": call_id,
+                                                                "args": {"location": text(rng, 2)}}])]}
+
+    def tools(state):
+        call = state["messages"][-1].tool_calls[0]
+        # A compacted tool result (digest plus handle) is a few hundred tokens
+        return {"messages": [ToolMessage(content=text(rng, 220), tool_call_id=call["id"], name=call["name"])]}
+
+    def route(state):
+        return "tools" if getattr(state["messages"][-1], "tool_calls", None) else END
+
+    graph = StateGraph(State)
+    graph.add_node("chat", chat)
+    graph.add_node("tools", tools)
+    graph.add_edge(START, "chat")
+    graph.add_conditional_edges("chat", route)
+    graph.add_edge("tools", "chat")
+    return graph.compile(checkpointer=checkpointer)
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000, 3)
+
+async def run_format(path: str, serde, args) -> dict:
+    conn = await aiosqlite.connect(path)
+    saver = AsyncSqliteSaver(conn=conn, serde=serde) if serde else AsyncSqliteSaver(conn=conn)
+    app = build_graph(saver, seed=7)
+
+    rng = random.Random(11)
+    started = time.perf_counter()
+    for turn in range(args.turns):
+        if turn == args.turns - 1:
+            before_last = checkpoint_store.storage_stats(path)["payload_bytes"]
+        for thread in range(args.threads):
+            config = {"configurable": {"thread_id": f"bench-{thread}"}}
+            await app.ainvoke({"messages": [HumanMessage(content=text(rng, 25))]}, config)
+    elapsed = time.perf_counter() - started
+    last_turn_bytes = (checkpoint_store.storage_stats(path)["payload_bytes"] - before_last) // args.threads
+
+    reads = []
+    for _ in range(args.reads):
+        for thread in range(args.threads):
+            config = {"configurable": {"thread_id": f"bench-{thread}", "checkpoint_ns": ""}}
+            read_started = time.perf_counter()
+            await saver.aget_tuple(config)
+            reads.append(time.perf_counter() - read_started)
+    await conn.close()
+
+    stats = checkpoint_store.storage_stats(path)
+    turns = args.threads * args.turns
+    return {
+        "turns_per_s": round(turns / elapsed, 2),
+        "checkpoints_per_s": round(stats["checkpoints"]["rows"] / elapsed, 2),
+        "read_p50_ms": percentile(reads, 0.5),
+        "read_p95_ms": percentile(reads, 0.95),
+        "payload_bytes": stats["payload_bytes"],
+        "bytes_per_turn": stats["payload_bytes"] // turns,
+        "last_turn_bytes": last_turn_bytes,
+        "file_bytes": stats["file_bytes"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=30, help="turns per thread")
+    parser.add_argument("--reads", type=int, default=20, help="latest-checkpoint loads per thread")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="travel-checkpoints-")
+    formats = {"plain": None, "dedup": "none", "dedup_zlib": "zlib"}
+    if checkpoint_store._zstd() is not None:
+        formats["dedup_zstd"] = "zstd"
+
+    results = {"threads": args.threads, "turns_per_thread": args.turns}
+    try:
+        for name, compression in formats.items():
+            path = os.path.join(workdir, f"{name}.db")
+            serde = checkpoint_store.DedupSerializer(path, compression=compression) if compression else None
+            results[name] = asyncio.run(run_format(path, serde, args))
+
+        # Migrate a copy of the plain database in place, as an existing deployment would
+        migrated = os.path.join(workdir, "migrated.db")
+        for suffix in ("", "-wal"):
+            if os.path.exists(os.path.join(workdir, "plain.db" + suffix)):
+                shutil.copy(os.path.join(workdir, "plain.db" + suffix), migrated + suffix)
+        results["migration"] = checkpoint_store.migrate(migrated)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+""" Microbenchmark: itinerary planner latency for growing candidate POI counts.
+
+Run with:  python benchmarks/bench_itinerary_planner.py
+"""
+import json, os, random, statistics, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from itinerary_planner import plan_itinerary
+
+CATEGORIES = [["Art Museum"], ["Park"], ["Monument"], ["Church"], ["Plaza"], ["Garden"], ["Opera House"]]
+
+def random_pois(n: int, seed: int = 7) -> list:
+    rnd = random.Random(seed)
+    return [{"id": i, "name": f"Place {i}", "lat": 48.80 + rnd.random() * 0.12, "lon": 2.25 + rnd.random() * 0.15,
+             "rating": round(6 + rnd.random() * 4, 1), "categories": rnd.choice(CATEGORIES)} for i in range(n)]
+
+def main():
+    weather = [{"date": f"2026-12-{d + 1:02d}", "condition": "Rain" if d % 3 == 1 else "Clear"} for d in range(7)]
+    results = {}
+
+    for n in (25, 100, 250, 500):
+        pois = random_pois(n)
+        samples = []
+        for _ in range(10):
+            started = time.perf_counter()
+            plan_itinerary(pois, 7, weather, budget=2000, hotel_nightly=120, daily_expenses=60, places_per_day=6)
+            samples.append((time.perf_counter() - started) * 1000)
+        results[f"{n}_pois"] = {"p50_ms": round(statistics.median(samples), 3), "max_ms": round(max(samples), 3)}
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
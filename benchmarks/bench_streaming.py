@@ -0,0 +1,104 @@
+""" Microbenchmark: per-token queue handoff vs. coalesced frames for the Streamlit chat stream.
+
+Run with:  python benchmarks/bench_streaming.py [--tokens 2000] [--responses 20]
+"""
+import argparse, asyncio, json, os, queue, sys, threading, time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streaming import pump_chat_stream
+
+def fake_stream(num_tokens: int, tool_every: int = 500):
+    """ Build a synthetic ["messages", "updates"] stream with nested tool LLM tokens mixed in. """
+    events = []
+    chat_meta = {"langgraph_node": "chat_node"}
+    tool_meta = {"langgraph_node": "tools"}
+
+    for i in range(num_tokens):
+        events.append(("messages", (SimpleNamespace(type="AIMessageChunk", content="tok "), chat_meta)))
+
+        if i and i % tool_every == 0:
+            call = SimpleNamespace(tool_calls=[{"name": "get_weather_forecast"}])
+            events.append(("updates", {"chat_node": {"messages": [call]}}))
+            for _ in range(50):
+                events.append(("messages", (SimpleNamespace(type="AIMessageChunk", content="nested "), tool_meta)))
+            events.append(("messages", (SimpleNamespace(type="tool", content="result"), tool_meta)))
+            events.append(("updates", {"tools": {"messages": []}}))
+    return events
+
+async def _aiter(events):
+    for event in events:
+        yield event
+
+def ui_work():
+    """ Stand-in for a Streamlit repaint (write_stream append / st.status update). """
+    sum(range(200))
+
+def run_naive(events):
+    """ Baseline: one cross-thread handoff and one repaint per chunk, status repaint per ToolMessage. """
+    q = queue.Queue()
+
+    def producer():
+        for mode, payload in events:
+            if mode == "messages":
+                q.put(payload)
+        q.put(None)
+
+    threading.Thread(target=producer).start()
+    handoffs = 0
+    while True:
+        item = q.get()
+        if item is None:
+            break
+        handoffs += 1
+        chunk, _ = item
+        if chunk.type in ("AIMessageChunk", "tool"):
+            ui_work()
+    return handoffs
+
+def run_coalesced(events):
+    """ Coalesced frames from chat_node only, status repaints on transitions only. """
+    q = queue.Queue()
+
+    def producer():
+        asyncio.run(pump_chat_stream(_aiter(events), q.put))
+        q.put(None)
+
+    threading.Thread(target=producer).start()
+    handoffs = 0
+    while True:
+        item = q.get()
+        if item is None:
+            break
+        handoffs += 1
+        ui_work()
+    return handoffs
+
+def measure(fn, events, responses: int):
+    wall, cpu, handoffs = time.perf_counter(), time.process_time(), 0
+    for _ in range(responses):
+        handoffs += fn(events)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    chunks = sum(1 for mode, _ in events if mode == "messages") * responses
+    return {
+        "chunks_per_sec": round(chunks / wall),
+        "cpu_ms_per_response": round(cpu / responses * 1000, 3),
+        "handoffs_per_response": handoffs // responses,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--responses", type=int, default=20)
+    args = parser.parse_args()
+
+    events = fake_stream(args.tokens)
+    results = {
+        "naive": measure(run_naive, events, args.responses),
+        "coalesced": measure(run_coalesced, events, args.responses),
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+""" Tail latency of upstream GETs against a degraded provider: plain vs hedged requests, and an outage.
+
+The stub delays a share of requests by --slow-ms (a heavy tail). Plain GETs inherit that tail.
+Hedged GETs send a backup request once the first is slower than the provider's recent p95.
+In the outage phase the provider stops answering. The circuit breaker then fails calls immediately
+instead of letting each one wait for its timeout.
+
+Run with:  python benchmarks/bench_upstream_resilience.py [--requests 200] [--slow-share 0.05]
+"""
+import argparse, json, os, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_server import StubServer
+
+URL = "https://api.openweathermap.org/data/2.5/forecast"
+
+def summarize(samples: list) -> dict:
+    ms = sorted(s * 1000 for s in samples)
+    pick = lambda q: round(ms[min(len(ms) - 1, int(round(q * (len(ms) - 1))))], 1)
+    return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(ms[-1], 1), "n": len(ms)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--slow-share", type=float, default=0.05)
+    parser.add_argument("--slow-ms", type=float, default=1500.0)
+    args = parser.parse_args()
+
+    stub = StubServer(latency=args.latency_ms / 1000, slow_share=args.slow_share, slow_latency=args.slow_ms / 1000)
+    os.environ["UPSTREAM_STUB_URL"] = stub.start()
+    os.environ["TRAVEL_CACHE_DB"] = os.path.join(tempfile.mkdtemp(prefix="travel-resilience-"), "cache.db")
+
+    import upstream
+
+    # Lift the provider's real rate limit so the run measures latency, not token-bucket queueing
+    limits = {"openweather": {"rate": 1000.0, "burst": 1000, "monthly": None}}
+    results = {}
+    try:
+        for hedge in (False, True):
+            upstream.scheduler = upstream.UpstreamScheduler(limits)
+            samples = []
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                upstream.get(URL, hedge=hedge, params={"lat": 48.85, "lon": 2.35})
+                samples.append(time.perf_counter() - started)
+            results["hedged" if hedge else "plain"] = {**summarize(samples),
+                                                       **dict(upstream.scheduler.stats["openweather"])}
+
+        # Outage: nothing listens on the provider address any more
+        stub.stop()
+        upstream.scheduler = upstream.UpstreamScheduler(limits)
+        outcomes, samples = {}, []
+        for _ in range(20):
+            started = time.perf_counter()
+            try:
+                upstream.get(URL, params={"lat": 48.85, "lon": 2.35})
+                outcome = "ok"
+            except upstream.UpstreamUnavailable as e:
+                outcome = type(e).__name__
+            samples.append(time.perf_counter() - started)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        results["outage"] = {**summarize(samples), "outcomes": outcomes,
+                             "circuit": upstream.scheduler.breakers["openweather"].state}
+    finally:
+        stub.stop()
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+""" Simulated load against the local stub: upstream calls with and without the rate-limit-aware scheduler.
+
+Interactive and prefetch workers hammer the Booking.com hotel search route, and the stub answers 429
+above the provider's per-second limit. Without the scheduler, every excess request reaches the
+provider and fails. With it, requests queue per provider, interactive calls go ahead of prefetch
+calls, and calls that cannot be admitted are refused locally (callers then serve cached data).
+The scheduler also refuses calls once the monthly quota is spent, and that count persists across restarts.
+
+Run with:  python benchmarks/bench_upstream_scheduler.py [--duration 5] [--provider-rate 5]
+"""
+import argparse, json, logging, os, sys, tempfile, threading, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_server import StubServer
+
+HOST = "booking-com.p.rapidapi.com"
+URL = f"https://{HOST}/v1/hotels/search"
+
+def percentile(samples: list, q: float) -> float:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000, 1)
+
+def run_load(get, level: int, workers: int, duration: float, think: float) -> dict:
+    """ Run `workers` threads issuing GETs at `level` priority for `duration` seconds. """
+    import requests, upstream
+
+    outcomes = {"ok": 0, "http_429": 0, "refused": 0}
+    latencies = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker():
+        with upstream.priority(level):
+            while time.monotonic() < stop_at:
+                started = time.perf_counter()
+                try:
+                    response = get(URL, params={"dest_id": "-1456928"}, timeout=10)
+                    outcome = "http_429" if response.status_code == 429 else "ok"
+                except upstream.QuotaExceeded as e:
+                    outcome = "http_429" if e.reason == "HTTP 429" else "refused"
+                except requests.RequestException:
+                    outcome = "refused"
+                with lock:
+                    outcomes[outcome] += 1
+                    if outcome == "ok":
+                        latencies.append(time.perf_counter() - started)
+                time.sleep(think)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    return {"threads": threads, "outcomes": outcomes, "latencies": latencies}
+
+def scenario(name: str, get, args) -> dict:
+    import upstream
+
+    interactive = run_load(get, upstream.INTERACTIVE, args.interactive_workers, args.duration, args.think)
+    prefetch = run_load(get, upstream.PREFETCH, args.prefetch_workers, args.duration, args.think)
+    for thread in interactive["threads"] + prefetch["threads"]:
+        thread.join()
+
+    def summary(run):
+        return {**run["outcomes"], "p50_ms": percentile(run["latencies"], 0.5),
+                "p95_ms": percentile(run["latencies"], 0.95)}
+
+    return {"scenario": name, "interactive": summary(interactive), "prefetch": summary(prefetch)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--interactive-workers", type=int, default=4)
+    parser.add_argument("--prefetch-workers", type=int, default=8)
+    parser.add_argument("--think", type=float, default=0.05, help="pause between requests per worker (s)")
+    parser.add_argument("--provider-rate", type=float, default=5.0, help="provider limit in requests/s")
+    parser.add_argument("--monthly", type=int, default=20, help="monthly quota for the quota-exhaustion run")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    stub = StubServer(latency=args.latency_ms / 1000, rate_limits={HOST: args.provider_rate})
+    workdir = tempfile.mkdtemp(prefix="travel-sched-")
+    os.environ["UPSTREAM_STUB_URL"] = stub.start()
+    os.environ["TRAVEL_CACHE_DB"] = os.path.join(workdir, "cache.db")
+
+    import requests, upstream
+    from kv_cache import KVCache
+    logging.getLogger("upstream").setLevel(logging.ERROR)
+
+    def unscheduled_get(url, **kwargs):
+        return requests.get(upstream.resolve_url(url), **kwargs)
+
+    limits = {"booking": {"rate": args.provider_rate, "burst": int(args.provider_rate), "monthly": None}}
+    results = {"provider_rate_per_s": args.provider_rate, "duration_s": args.duration}
+    try:
+        results["unscheduled"] = scenario("unscheduled", unscheduled_get, args)
+        throttled_before = stub.throttled[HOST]
+
+        time.sleep(1.5)
+        upstream.scheduler = upstream.UpstreamScheduler(limits, KVCache("bench.quota"))
+        results["scheduled"] = scenario("scheduled", upstream.get, args)
+        results["scheduled"]["scheduler"] = upstream.scheduler.report()
+        results["stub_429s"] = {"unscheduled": throttled_before, "scheduled": stub.throttled[HOST] - throttled_before}
+
+        # Quota exhaustion, then a "restart": a new scheduler on the same cache file sees the spent quota
+        time.sleep(1.5)
+        quota_limits = {"booking": {**limits["booking"], "monthly": args.monthly}}
+        upstream.scheduler = upstream.UpstreamScheduler(quota_limits, KVCache("bench.monthly"))
+        results["quota"] = scenario("quota", upstream.get, args)
+        restarted = upstream.UpstreamScheduler(quota_limits, KVCache("bench.monthly"))
+        results["quota"]["used_after_restart"] = restarted.used("booking")
+        results["quota"]["remaining_after_restart"] = restarted.remaining("booking")
+    finally:
+        stub.stop()
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
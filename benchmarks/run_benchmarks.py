@@ -0,0 +1,274 @@
+""" Offline benchmark suite: recorded upstream fixtures + deterministic fake chat model.
+
+Measures cold start, per-tool latency, end-to-end turn latency, memory and throughput under
+concurrency, and writes machine-readable JSON. With --baseline, exits non-zero on regressions.
+
+Run with:  python benchmarks/run_benchmarks.py --output bench.json [--baseline previous.json]
+"""
+import argparse, asyncio, json, os, resource, statistics, subprocess, sys, tempfile, time, tracemalloc
+from uuid import uuid4
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_server import StubServer
+
+# Dummy credentials: every provider is served by the stub and every model call by the fake backend
+OFFLINE_ENV = {
+    "LLM_BACKEND": "fake",
+    "OPENAI_API_KEY": "offline",
+    "RAPID_API_KEY": "offline",
+    "AMADEUS_API_KEY": "offline",
+    "AMADEUS_API_SECRET": "offline",
+    "OPENWEATHER_API_KEY": "offline",
+    "FOURSQUARE_API_KEY": "offline",
+}
+
+SERVER_MODULES = ["weather_mcp", "places_mcp", "hotels_mcp", "flights_mcp", "math_mcp"]
+
+TOOL_CASES = [
+    ("weather_mcp", "get_weather_forecast", {"location": "Paris"}),
+    ("weather_mcp", "get_weather_forecast_batch", {"locations": ["Paris", "Lyon", "Nice", "Bordeaux",
+                                                                 "Marseille", "Lille"]}),
+    ("places_mcp", "search_tourism_destinations", {"location": "Paris"}),
+    ("places_mcp", "find_nearby_attractions", {"location": "Paris", "radius_km": 2.0}),
+    ("places_mcp", "plan_walkable_days", {"location": "Paris", "days": 3}),
+    ("hotels_mcp", "search_hotels", {"num_adults": 2, "num_children": 0, "checkin_date": "2026-12-01",
+                                     "checkout_date": "2026-12-04", "location": "Paris"}),
+    ("hotels_mcp", "search_hotels_filtered", {"num_adults": 2, "num_children": 0, "checkin_date": "2026-12-01",
+                                              "checkout_date": "2026-12-04", "location": "Paris",
+                                              "max_price": 150, "min_rating": 8, "sort_by": "rating"}),
+    ("flights_mcp", "search_flights", {"origin": "New York", "destination": "Paris",
+                                       "departure_date": "2026-12-01", "num_adults": 1}),
+    ("flights_mcp", "get_cheapest_flight", {"origin": "New York", "destination": "Paris"}),
+]
+
+# Summarization prompts and the recorded upstream route whose body the prompt replaces: the tools keep only
+# parsed data (forecast columns, indexed POIs), so the raw payload is measured from the fixture itself
+PROMPT_CASES = [
+    ("weather_overview", "GET /data/2.5/forecast", "weather_mcp", "get_weather_forecast",
+     {"location": "Paris", "narrate": True}),
+    ("tourism_recommendation", "GET /places/search", "places_mcp", "search_tourism_destinations", {"location": "Paris"}),
+    ("hotel_recommendation", "GET /v1/hotels/search", "hotels_mcp", "search_hotels",
+     {"num_adults": 2, "num_children": 0, "checkin_date": "2026-12-01", "checkout_date": "2026-12-04",
+      "location": "Paris"}),
+]
+
+TURN_PROMPTS = [
+    "What is the weather forecast in Paris?",
+    "Find hotels in Paris for two adults",
+    "Which tourism destinations should I visit in Paris?",
+    "Hello, how are you?",
+]
+
+def summarize(samples: list) -> dict:
+    """ Latency summary in milliseconds. """
+    ms = sorted(s * 1000 for s in samples)
+    p95 = ms[min(len(ms) - 1, int(round(0.95 * (len(ms) - 1))))]
+    return {"first_ms": round(samples[0] * 1000, 3), "p50_ms": round(statistics.median(ms), 3),
+            "p95_ms": round(p95, 3), "mean_ms": round(statistics.fmean(ms), 3), "n": len(ms)}
+
+def measure_cold_start(env: dict) -> dict:
+    """ Import time of each module in a fresh interpreter. """
+    results = {}
+    for module in SERVER_MODULES + ["travel_planner_chatbot"]:
+        code = (f"import sys, time; sys.path.insert(0, {ROOT!r}); t = time.perf_counter(); "
+                f"import {module}; print(time.perf_counter() - t)")
+        proc = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, timeout=300)
+        if proc.returncode != 0:
+            results[module] = {"error": proc.stderr.strip().splitlines()[-1:] or ["failed"]}
+            continue
+        results[module] = {"import_s": round(float(proc.stdout.strip().splitlines()[-1]), 4)}
+    return results
+
+def tool_function(module_name: str, tool_name: str):
+    """ Return the plain callable behind an @mcp.tool() (FastMCP 2 wraps it in a FunctionTool). """
+    module = __import__(module_name)
+    tool = getattr(module, tool_name)
+    return getattr(tool, "fn", tool)
+
+def measure_tools(iterations: int) -> dict:
+    results = {}
+    for module_name, tool_name, kwargs in TOOL_CASES:
+        fn = tool_function(module_name, tool_name)
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            fn(**kwargs)
+            samples.append(time.perf_counter() - started)
+        results[f"{module_name}.{tool_name}"] = summarize(samples)
+    return results
+
+def measure_compaction() -> dict:
+    """ Tokens each tool result costs in the message list, verbatim vs after the post-tool compaction stage. """
+    from prompt_builder import count_tokens
+    from tool_results import compact
+
+    results = {}
+    for module_name, tool_name, kwargs in TOOL_CASES:
+        result = tool_function(module_name, tool_name)(**kwargs)
+        text = result if isinstance(result, str) else json.dumps(result, ensure_ascii=False)
+        compacted, handle = compact(tool_name, text)
+        results[f"{module_name}.{tool_name}"] = {"tokens_before": count_tokens(text),
+                                                 "tokens_after": count_tokens(compacted),
+                                                 "compacted": handle is not None}
+    return results
+
+def measure_prompt_savings(fixtures: dict) -> dict:
+    """ Tokens of each summarization prompt vs the raw upstream response body (as recorded) it summarizes. """
+    from prompt_builder import count_tokens, prompt_stats
+
+    results = {}
+    for name, route, module_name, tool_name, kwargs in PROMPT_CASES:
+        before = prompt_stats().get(name, {"calls": 0, "tokens_after": 0})
+        tool_function(module_name, tool_name)(**kwargs)
+        after = prompt_stats().get(name, {"calls": 0, "tokens_after": 0})
+        if after["calls"] == before["calls"]:
+            results[name] = {"error": "tool did not render the prompt"}
+            continue
+
+        raw = count_tokens(json.dumps(fixtures[route]["body"], ensure_ascii=False))
+        prompt = (after["tokens_after"] - before["tokens_after"]) / (after["calls"] - before["calls"])
+        results[name] = {"raw_tokens": raw, "prompt_tokens": round(prompt),
+                         "saved_pct": round(100 * (1 - prompt / raw), 1)}
+    return results
+
+async def run_turn(chatbot, prompt: str) -> tuple:
+    """ Drive one chat turn through chatbot.astream; return (total seconds, time to first token). """
+    from langchain_core.messages import HumanMessage
+
+    config = {"configurable": {"thread_id": f"bench-{uuid4()}"}}
+    started, first_token = time.perf_counter(), None
+
+    async for chunk, metadata in chatbot.astream({"messages": [HumanMessage(content=prompt)]},
+                                                 config=config, stream_mode="messages"):
+        if first_token is None and metadata.get("langgraph_node") == "chat_node" and getattr(chunk, "content", ""):
+            first_token = time.perf_counter() - started
+
+    total = time.perf_counter() - started
+    return total, first_token if first_token is not None else total
+
+def measure_turns(iterations: int, concurrency: int) -> dict:
+    import travel_planner_chatbot as bot
+
+    results = {}
+    for prompt in TURN_PROMPTS:
+        totals, firsts = [], []
+        for _ in range(iterations):
+            total, first = bot.run_async(run_turn(bot.chatbot, prompt))
+            totals.append(total)
+            firsts.append(first)
+        results[prompt] = {"turn": summarize(totals), "first_token": summarize(firsts)}
+
+    async def burst():
+        prompts = [TURN_PROMPTS[i % len(TURN_PROMPTS)] for i in range(concurrency * iterations)]
+        return await asyncio.gather(*(run_turn(bot.chatbot, p) for p in prompts))
+
+    started = time.perf_counter()
+    burst_results = bot.run_async(burst())
+    elapsed = time.perf_counter() - started
+
+    throughput = {
+        "concurrency": concurrency,
+        "turns": len(burst_results),
+        "turns_per_s": round(len(burst_results) / elapsed, 3),
+        "turn_under_load": summarize([total for total, _ in burst_results]),
+    }
+    return {"turns": results, "throughput": throughput}
+
+def measure_memory(iterations: int) -> dict:
+    import travel_planner_chatbot as bot
+
+    tracemalloc.start()
+    for prompt in TURN_PROMPTS * iterations:
+        bot.run_async(run_turn(bot.chatbot, prompt))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"python_heap_peak_mb": round(peak / 2**20, 3),
+            "rss_peak_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 3)}
+
+def flatten(data, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """ Return regressions: latencies/memory that grew, or throughput that fell, beyond tolerance. """
+    regressions = []
+    base = flatten(baseline)
+
+    for name, value in flatten(current).items():
+        old = base.get(name)
+        if not old:
+            continue
+        if name.endswith(("_ms", "_s", "_mb")) and not name.endswith("per_s") and value > old * (1 + tolerance):
+            regressions.append(f"{name}: {old} -> {value}")
+        elif name.endswith("per_s") and value < old * (1 - tolerance):
+            regressions.append(f"{name}: {old} -> {value}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated upstream round-trip time")
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--baseline", help="previous JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--skip-cold-start", action="store_true")
+    parser.add_argument("--skip-e2e", action="store_true")
+    args = parser.parse_args()
+
+    stub = StubServer(latency=args.latency_ms / 1000)
+    workdir = tempfile.mkdtemp(prefix="travel-bench-")
+    os.environ.update(OFFLINE_ENV)
+    os.environ["UPSTREAM_STUB_URL"] = stub.start()
+    os.environ["CHECKPOINT_DB_PATH"] = os.path.join(workdir, "bench_checkpoints.db")
+    os.environ["TRAVEL_CACHE_DB"] = os.path.join(workdir, "bench_cache.db")
+
+    results = {"meta": {"python": sys.version.split()[0], "iterations": args.iterations,
+                        "upstream_latency_ms": args.latency_ms, "started": time.strftime("%Y-%m-%dT%H:%M:%S")}}
+    try:
+        if not args.skip_cold_start:
+            results["cold_start"] = measure_cold_start(dict(os.environ))
+        results["tools"] = measure_tools(args.iterations)
+        results["tool_result_compaction"] = measure_compaction()
+        results["prompt_savings"] = measure_prompt_savings(stub.fixtures)
+        if not args.skip_e2e:
+            results.update(measure_turns(args.iterations, args.concurrency))
+            results["memory"] = measure_memory(args.iterations)
+
+        from model_router import usage_report
+        from singleflight import metrics
+        from prompt_builder import prompt_stats
+        from tool_results import stats as tool_result_stats
+        results["model_usage"] = usage_report()
+        results["prompts"] = prompt_stats()
+        results["tool_results"] = tool_result_stats()
+        results["singleflight"] = metrics()
+        results["upstream_hits"] = stub.stats()
+    finally:
+        stub.stop()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+""" Local stub for every upstream HTTP provider, replaying recorded fixtures.
+
+Requests arrive as /<provider-host>/<path> (see upstream.resolve_url) or as a bare /<path> from SDKs
+that take a host (Amadeus, Nominatim). Responses are looked up by "METHOD /path"; the query string
+is ignored. With --record, unknown host-prefixed routes are fetched from the real provider and saved.
+rate_limits ({host: requests per second}) makes the stub answer 429 like a provider over its quota;
+slow_share/slow_latency delay a random share of requests to emulate a degraded provider's tail.
+
+Run with:  python benchmarks/stub_server.py --port 8765 --latency-ms 40
+"""
+import argparse, json, os, random, threading, time
+from collections import Counter, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "upstream.json")
+
+def split_route(raw_path: str):
+    """ Return (provider host or None, path) for a stub request path. """
+    path = urlsplit(raw_path).path
+    first, _, rest = path.lstrip("/").partition("/")
+
+    if "." in first and not first.replace(".", "").isdigit():
+        return first, "/" + rest
+    return None, path
+
+class StubServer:
+    """ Threaded HTTP stub; start() returns the base URL to put in UPSTREAM_STUB_URL. """
+
+    def __init__(self, fixtures_path: str = DEFAULT_FIXTURES, latency: float = 0.0, port: int = 0, record: bool = False,
+                 rate_limits: dict = None, slow_share: float = 0.0, slow_latency: float = 0.0):
+        self.fixtures_path = fixtures_path
+        self.latency = latency
+        self.port = port
+        self.record = record
+        self.rate_limits = rate_limits or {}
+        self.slow_share = slow_share
+        self.slow_latency = slow_latency
+        self.hits = Counter()
+        self.throttled = Counter()
+        self._recent = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._server = None
+
+        with open(fixtures_path, encoding="utf-8") as f:
+            self.fixtures = json.load(f)
+
+    def set_response(self, method: str, path: str, body, status: int = 200):
+        """ Override (or add) the response for a route, e.g. to simulate 429s or outages. """
+        self.fixtures[f"{method} {path}"] = {"status": status, "body": body}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.hits)
+
+    def _over_limit(self, host: str) -> bool:
+        """ Sliding one-second window per provider host. """
+        limit = self.rate_limits.get(host)
+        if not limit:
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            recent = self._recent[host]
+            while recent and recent[0] <= now - 1.0:
+                recent.popleft()
+            if len(recent) >= limit:
+                self.throttled[host] += 1
+                return True
+            recent.append(now)
+        return False
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str):
+        host, path = split_route(handler.path)
+        route = f"{method} {path}"
+
+        length = int(handler.headers.get("Content-Length") or 0)
+        payload = handler.rfile.read(length) if length else None
+
+        with self._lock:
+            self.hits[route] += 1
+
+        if path == "/__stats":
+            return self._reply(handler, 200, self.stats())
+
+        if self.latency:
+            time.sleep(self.latency)
+        if self.slow_share and random.random() < self.slow_share:
+            time.sleep(self.slow_latency)
+
+        if host and self._over_limit(host):
+            return self._reply(handler, 429, {"message": "Too many requests"}, {"Retry-After": "1"})
+
+        fixture = self.fixtures.get(route)
+        if fixture is None and self.record and host:
+            fixture = self._record(handler, method, host, payload)
+
+        if fixture is None:
+            return self._reply(handler, 404, {"error": f"no fixture for {route}"})
+
+        self._reply(handler, fixture.get("status", 200), fixture.get("body"))
+
+    def _record(self, handler, method: str, host: str, payload):
+        import requests
+
+        query = urlsplit(handler.path).query
+        _, path = split_route(handler.path)
+        headers = {k: v for k, v in handler.headers.items() if k.lower() not in ("host", "content-length")}
+        response = requests.request(method, f"https://{host}{path}" + (f"?{query}" if query else ""),
+                                    headers=headers, data=payload, timeout=30)
+        fixture = {"status": response.status_code, "body": response.json()}
+
+        with self._lock:
+            self.fixtures[f"{method} {path}"] = fixture
+        return fixture
+
+    @staticmethod
+    def _reply(handler, status: int, body, headers: dict = None):
+        data = json.dumps(body).encode()
+        handler.send_response(status)
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def start(self) -> str:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub._handle(self, "GET")
+
+            def do_POST(self):
+                stub._handle(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.port}"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+        if self.record:
+            with open(self.fixtures_path, "w", encoding="utf-8") as f:
+                json.dump(self.fixtures, f, indent=1, ensure_ascii=False)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    parser.add_argument("--record", action="store_true")
+    args = parser.parse_args()
+
+    stub = StubServer(args.fixtures, latency=args.latency_ms / 1000, port=args.port, record=args.record)
+    print(f"stub serving on {stub.start()} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+""" Compact checkpoint storage: messages stored once by content hash, checkpoints as compressed references.
+
+Run with:  python checkpoint_store.py {stats,migrate,prune} [--db travel_planner_chatbot.db] [--revert] [--vacuum] [--grace 3600]
+"""
+import argparse, asyncio, hashlib, json, logging, os, sqlite3, threading, time, zlib
+from collections import OrderedDict
+from langchain_core.messages import BaseMessage
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+logger = logging.getLogger("travel_planner_chatbot")
+
+# Codec for checkpoint and message payloads: "zlib", "zstd" (needs the zstandard package) or "none"
+CHECKPOINT_COMPRESSION = os.getenv("CHECKPOINT_COMPRESSION", "zlib")
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Smaller payloads are stored as-is; the codec header would eat the gain
+COMPRESS_MIN_BYTES = 256
+
+# Truncated sha256 per message; 16 bytes keeps a reference list tiny with no practical collision risk
+DIGEST_BYTES = 16
+
+# Message payloads kept in memory by digest (they never change once written)
+BLOB_CACHE_SIZE = 4096
+
+# prune keeps messages stored more recently than this (seconds), so it cannot delete the messages of a
+# checkpoint that is being written right now and has no row referring to them yet
+PRUNE_GRACE = 3600
+
+# Messages staged off the event loop right before their checkpoint is saved; dumps_typed trusts them
+# to be stored for this long (well inside PRUNE_GRACE) instead of asking the table again
+STAGED_TTL = 60.0
+
+# Markers that replace messages inside a serialized checkpoint or write
+REFS_KEY = "__message_refs__"
+REF_KEY = "__message_ref__"
+
+# Type tag suffix: "msgpack+dedup" or "msgpack+dedup-zlib"; rows without it were written by the plain serializer
+FORMAT_TAG = "dedup"
+
+def _zstd():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+def resolve_codec(name: str) -> str:
+    """ Codec actually used for a setting: zstd falls back to zlib when zstandard is not installed. """
+    name = (name or "none").lower()
+    if name == "zstd" and _zstd() is None:
+        logger.warning("CHECKPOINT_COMPRESSION=zstd but zstandard is not installed; using zlib")
+        return "zlib"
+    if name not in ("zlib", "zstd"):
+        return ""
+    return name
+
+def compress(data: bytes, codec: str) -> tuple:
+    """ Return (codec, payload); small payloads stay uncompressed (codec ""). """
+    if not codec or len(data) < COMPRESS_MIN_BYTES:
+        return "", data
+    if codec == "zstd":
+        return codec, _zstd().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return codec, zlib.compress(data, ZLIB_LEVEL)
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if not codec:
+        return data
+    if codec == "zstd":
+        zstandard = _zstd()
+        if zstandard is None:
+            raise RuntimeError("checkpoint was written with zstd; install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown checkpoint codec: {codec}")
+
+def is_dedup_type(type_: str) -> bool:
+    return bool(type_) and type_.rpartition("+")[2].split("-")[0] == FORMAT_TAG
+
+def _is_message_list(value) -> bool:
+    return isinstance(value, list) and bool(value) and all(isinstance(item, BaseMessage) for item in value)
+
+class MessageStore:
+    """ Content-addressed message payloads in a table next to the saver's checkpoints and writes. """
+
+    def __init__(self, path: str, codec: str = "zlib"):
+        self.codec = codec
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoint_messages ("
+            "digest BLOB PRIMARY KEY, type TEXT NOT NULL, codec TEXT NOT NULL, data BLOB NOT NULL, stored_at REAL)"
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(checkpoint_messages)")}
+        if "stored_at" not in columns:
+            self.conn.execute("ALTER TABLE checkpoint_messages ADD COLUMN stored_at REAL")
+        self.conn.commit()
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+
+    def _remember(self, digest: bytes, entry: tuple):
+        self._cache[digest] = entry
+        self._cache.move_to_end(digest)
+        while len(self._cache) > BLOB_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def put_many(self, entries: list):
+        """ Store (digest, type, payload) entries; digests already stored are skipped. """
+        entries = {digest: (type_, data) for digest, type_, data in entries}
+        with self._lock:
+            # Ask the table rather than the cache: prune may have deleted rows this process still caches
+            stored = set()
+            digests = list(entries)
+            for start in range(0, len(digests), 500):
+                chunk = digests[start:start + 500]
+                stored.update(row[0] for row in self.conn.execute(
+                    f"SELECT digest FROM checkpoint_messages WHERE digest IN ({','.join('?' * len(chunk))})", chunk
+                ))
+
+            new = {digest: entry for digest, entry in entries.items() if digest not in stored}
+            if new:
+                now = time.time()
+                rows = [(digest, type_, *compress(data, self.codec), now) for digest, (type_, data) in new.items()]
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO checkpoint_messages (digest, type, codec, data, stored_at) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                self.conn.commit()
+            for digest, entry in new.items():
+                self._remember(digest, entry)
+
+    def get_many(self, digests: list) -> dict:
+        """ Return {digest: (type, payload)}; raises KeyError if a referenced message is missing. """
+        with self._lock:
+            found = {digest: self._cache[digest] for digest in digests if digest in self._cache}
+            missing = [digest for digest in dict.fromkeys(digests) if digest not in found]
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT digest, type, codec, data FROM checkpoint_messages WHERE digest IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for digest, type_, codec, data in rows:
+                    found[digest] = (type_, decompress(codec, data))
+                    self._remember(digest, found[digest])
+
+        absent = [digest.hex() for digest in digests if digest not in found]
+        if absent:
+            raise KeyError(f"checkpoint references {len(absent)} missing message(s), e.g. {absent[0]}")
+        return found
+
+class DedupSerializer(SerializerProtocol):
+    """
+    Checkpoint serializer for AsyncSqliteSaver that stores every message once.
+
+    Consecutive checkpoints of a thread repeat the whole message list, so with the plain serializer
+    storage grows quadratically with conversation length. Here message lists in checkpoints and
+    pending writes are replaced by their content hashes (16 bytes per message), the messages go
+    to a content-addressed table in the same database, and the remaining payload is compressed.
+    Rows written by the plain serializer still load, so existing databases keep working; the
+    migration command rewrites them.
+    """
+
+    def __init__(self, path: str, serde: SerializerProtocol = None, compression: str = CHECKPOINT_COMPRESSION):
+        self.serde = serde or JsonPlusSerializer()
+        self.codec = resolve_codec(compression)
+        self.store = MessageStore(path, self.codec)
+        self._staged = {}
+        self._staged_lock = threading.Lock()
+
+    def _digest(self, message: BaseMessage, pending: list) -> bytes:
+        type_, data = self.serde.dumps_typed(message)
+        digest = hashlib.sha256(type_.encode() + b"\0" + data).digest()[:DIGEST_BYTES]
+        pending.append((digest, type_, data))
+        return digest
+
+    def _strip(self, value, pending: list):
+        """ Replace message lists (and single messages) by their digests. """
+        if isinstance(value, BaseMessage):
+            return {REF_KEY: self._digest(value, pending)}
+        if _is_message_list(value):
+            return {REFS_KEY: b"".join(self._digest(message, pending) for message in value)}
+        if isinstance(value, dict) and isinstance(value.get("channel_values"), dict):
+            return {**value, "channel_values": {k: self._strip(v, pending) for k, v in value["channel_values"].items()}}
+        return value
+
+    def _restore(self, value):
+        if isinstance(value, dict) and len(value) == 1 and (REFS_KEY in value or REF_KEY in value):
+            refs = value.get(REFS_KEY) or value[REF_KEY]
+            digests = [refs[i:i + DIGEST_BYTES] for i in range(0, len(refs), DIGEST_BYTES)]
+            payloads = self.store.get_many(digests)
+            messages = [self.serde.loads_typed(payloads[digest]) for digest in digests]
+            return messages[0] if REF_KEY in value else messages
+        if isinstance(value, dict) and isinstance(value.get("channel_values"), dict):
+            return {**value, "channel_values": {k: self._restore(v) for k, v in value["channel_values"].items()}}
+        return value
+
+    def stage(self, values: list):
+        """ Store the messages of checkpoints or writes about to be saved. Blocking: DedupSqliteSaver runs it in a thread. """
+        pending = []
+        for value in values:
+            self._strip(value, pending)
+        if not pending:
+            return
+
+        self.store.put_many(pending)
+        now = time.monotonic()
+        with self._staged_lock:
+            self._staged = {digest: at for digest, at in self._staged.items() if now - at < STAGED_TTL}
+            self._staged.update((digest, now) for digest, _, _ in pending)
+
+    def _unstaged(self, pending: list) -> list:
+        """ Entries stage() has not stored within the last STAGED_TTL seconds. """
+        now = time.monotonic()
+        with self._staged_lock:
+            fresh = {digest for digest, at in self._staged.items() if now - at < STAGED_TTL}
+        return [entry for entry in pending if entry[0] not in fresh]
+
+    def dumps_typed(self, obj) -> tuple:
+        pending = []
+        type_, data = self.serde.dumps_typed(self._strip(obj, pending))
+        # Messages are written before the row that references them; staged ones already are
+        pending = self._unstaged(pending)
+        if pending:
+            self.store.put_many(pending)
+        codec, data = compress(data, self.codec)
+        return f"{type_}+{FORMAT_TAG}" + (f"-{codec}" if codec else ""), data
+
+    def loads_typed(self, data: tuple):
+        type_, payload = data
+        if not is_dedup_type(type_):
+            return self.serde.loads_typed(data)
+
+        base, _, tag = type_.rpartition("+")
+        codec = tag[len(FORMAT_TAG) + 1:]
+        return self._restore(self.serde.loads_typed((base, decompress(codec, payload))))
+
+    def references(self, data: tuple) -> set:
+        """ Message digests a stored row refers to, without loading the messages. """
+        type_, payload = data
+        if not is_dedup_type(type_):
+            return set()
+
+        base, _, tag = type_.rpartition("+")
+        value = self.serde.loads_typed((base, decompress(tag[len(FORMAT_TAG) + 1:], payload)))
+        values = value["channel_values"].values() if isinstance(value, dict) and isinstance(value.get("channel_values"), dict) else [value]
+
+        digests = set()
+        for item in values:
+            if isinstance(item, dict) and len(item) == 1 and (REFS_KEY in item or REF_KEY in item):
+                refs = item.get(REFS_KEY) or item[REF_KEY]
+                digests.update(refs[i:i + DIGEST_BYTES] for i in range(0, len(refs), DIGEST_BYTES))
+        return digests
+
+class DedupSqliteSaver(AsyncSqliteSaver):
+    """
+    AsyncSqliteSaver for a DedupSerializer. The saver serializes on the event loop, where the
+    serializer's blocking message writes would stall every other turn; this saver stores the
+    messages from a worker thread first, so dumps_typed only has to encode the references.
+    """
+
+    async def _stage(self, values: list):
+        if isinstance(self.serde, DedupSerializer):
+            await asyncio.to_thread(self.serde.stage, values)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        await self._stage([checkpoint])
+        return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path: str = ""):
+        await self._stage([value for _, value in writes])
+        return await super().aput_writes(config, writes, task_id, task_path)
+
+# Serialized rows of the AsyncSqliteSaver schema: (table, type column, payload column)
+SAVER_TABLES = [("checkpoints", "type", "checkpoint"), ("writes", "type", "value")]
+
+def _tables(conn) -> set:
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+def storage_stats(path: str) -> dict:
+    """ Rows and payload bytes per table, split by format, plus the file sizes. """
+    conn = sqlite3.connect(path)
+    tables = _tables(conn)
+    stats = {}
+    for table, type_column, data_column in SAVER_TABLES:
+        if table not in tables:
+            continue
+        rows = conn.execute(f"SELECT {type_column}, length({data_column}) FROM {table}").fetchall()
+        dedup = [size or 0 for type_, size in rows if is_dedup_type(type_)]
+        plain = [size or 0 for type_, size in rows if not is_dedup_type(type_)]
+        stats[table] = {"rows": len(rows), "plain_rows": len(plain), "dedup_rows": len(dedup),
+                        "bytes": sum(dedup) + sum(plain)}
+    if "checkpoint_messages" in tables:
+        count, size = conn.execute("SELECT count(*), coalesce(sum(length(data)), 0) FROM checkpoint_messages").fetchone()
+        stats["checkpoint_messages"] = {"rows": count, "bytes": size}
+    conn.close()
+
+    stats["payload_bytes"] = sum(table.get("bytes", 0) for table in stats.values() if isinstance(table, dict))
+    stats["file_bytes"] = sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+    return stats
+
+def migrate(path: str, revert: bool = False, compression: str = CHECKPOINT_COMPRESSION, batch: int = 200) -> dict:
+    """
+    Rewrite every plain checkpoint and write row in the dedup format (or back, with revert).
+    Run it while the app is stopped; rows already in the target format are left alone.
+    """
+    serde = DedupSerializer(path, compression=compression)
+    # Share the message store's connection: a second writer would wait on our own open transaction
+    conn = serde.store.conn
+    tables = _tables(conn)
+    before = storage_stats(path)
+    started = time.perf_counter()
+
+    rewritten = 0
+    for table, type_column, data_column in SAVER_TABLES:
+        if table not in tables:
+            continue
+        rowids = [rowid for rowid, type_ in conn.execute(f"SELECT rowid, {type_column} FROM {table}")
+                  if type_ is not None and is_dedup_type(type_) == revert]
+        for start in range(0, len(rowids), batch):
+            for rowid in rowids[start:start + batch]:
+                type_, data = conn.execute(f"SELECT {type_column}, {data_column} FROM {table} WHERE rowid = ?",
+                                           (rowid,)).fetchone()
+                obj = serde.loads_typed((type_, data))
+                new_type, new_data = serde.serde.dumps_typed(obj) if revert else serde.dumps_typed(obj)
+                conn.execute(f"UPDATE {table} SET {type_column} = ?, {data_column} = ? WHERE rowid = ?",
+                             (new_type, new_data, rowid))
+                rewritten += 1
+            conn.commit()
+            logger.info("migrated %d/%d %s rows", min(start + batch, len(rowids)), len(rowids), table)
+
+    if revert:
+        # Migration runs with the app stopped, so every unreferenced message can go
+        prune(path, grace=0)
+    return {"rows_rewritten": rewritten, "seconds": round(time.perf_counter() - started, 3),
+            "payload_bytes_before": before["payload_bytes"], "payload_bytes_after": storage_stats(path)["payload_bytes"]}
+
+def prune(path: str, grace: float = PRUNE_GRACE) -> int:
+    """
+    Delete stored messages no checkpoint or write refers to any more (e.g. after deleting threads).
+    Messages stored within the last `grace` seconds are kept; still, run it with the app stopped.
+    """
+    serde = DedupSerializer(path)
+    conn = serde.store.conn
+    tables = _tables(conn)
+
+    # Candidates first: a message stored after this point may belong to a checkpoint not yet written
+    cutoff = time.time() - grace
+    stored = [row[0] for row in conn.execute(
+        "SELECT digest FROM checkpoint_messages WHERE stored_at IS NULL OR stored_at < ?", (cutoff,)
+    )]
+
+    referenced = set()
+    for table, type_column, data_column in SAVER_TABLES:
+        if table in tables:
+            for type_, data in conn.execute(f"SELECT {type_column}, {data_column} FROM {table}"):
+                referenced |= serde.references((type_, data))
+
+    orphans = [(digest,) for digest in stored if digest not in referenced]
+    conn.executemany("DELETE FROM checkpoint_messages WHERE digest = ?", orphans)
+    conn.commit()
+    return len(orphans)
+
+def vacuum(path: str):
+    """ Fold the WAL into the database and return freed pages to the filesystem. """
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect, migrate or prune a checkpoint database.")
+    parser.add_argument("command", choices=["stats", "migrate", "prune"])
+    parser.add_argument("--db", default=os.getenv("CHECKPOINT_DB_PATH", "travel_planner_chatbot.db"))
+    parser.add_argument("--revert", action="store_true", help="migrate back to the plain serializer format")
+    parser.add_argument("--compression", default=CHECKPOINT_COMPRESSION, choices=["zlib", "zstd", "none"])
+    parser.add_argument("--vacuum", action="store_true", help="compact the database file afterwards")
+    parser.add_argument("--grace", type=float, default=PRUNE_GRACE,
+                        help="prune: keep messages stored within this many seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist")
+
+    if args.command == "migrate":
+        result = migrate(args.db, revert=args.revert, compression=args.compression)
+    elif args.command == "prune":
+        result = {"messages_deleted": prune(args.db, grace=args.grace)}
+    else:
+        result = storage_stats(args.db)
+
+    if args.vacuum:
+        vacuum(args.db)
+        result["file_bytes_after_vacuum"] = storage_stats(args.db)["file_bytes"]
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import os, upstream
+from langchain_core.tools import tool, ToolException
+from kv_cache import KVCache
+from singleflight import coalesce
+
+# Last known rate per currency pair; used when the conversion API is out of budget
+exchange_rates = KVCache("currency.rates")
+EXCHANGE_RATE_TTL = 3600
+
+@coalesce("chatbot.exchange_rate")
+def fetch_currency_conversion(from_currency: str, to_currency: str, amount: float):
+    """Call the currency conversion API; identical concurrent conversions share one request."""
+    url = "https://currency-conversion-and-exchange-rates.p.rapidapi.com/convert"
+    
+    query_params = {
+        "from": from_currency,
+        "to": to_currency,
+        "amount": amount
+    }
+    
+    headers = {
+        "x-rapidapi-host": "currency-conversion-and-exchange-rates.p.rapidapi.com",
+        "x-rapidapi-key": os.getenv("RAPID_API_KEY")
+    }
+    
+    pair = f"{from_currency.upper()}:{to_currency.upper()}"
+    try:
+        response = upstream.get(url, headers=headers, params=query_params)
+        data = upstream.json_body(response, require="result")
+    except upstream.UpstreamUnavailable:
+        rate = exchange_rates.get(pair, allow_stale=True)
+        if rate is None:
+            raise
+        return round(rate * amount, 2)
+    
+    if amount:
+        exchange_rates.set(pair, data['result'] / amount, ttl=EXCHANGE_RATE_TTL)
+    return data['result']
+
+@tool
+def exchange_currency(from_currency: str, to_currency: str, amount: float):
+    """Converts an amount from one currency to another."""
+    try:
+        return fetch_currency_conversion(from_currency, to_currency, amount)
+    except upstream.UpstreamUnavailable as e:
+        # An error result: reported to the model but never memoized as the conversion
+        raise ToolException(f"Currency conversion is temporarily unavailable ({e}).")
+
+exchange_currency.handle_tool_error = True
@@ -1,8 +1,11 @@
 from amadeus import Client, ResponseError
+from urllib.request import urlopen
 from fastmcp import FastMCP
 from dotenv import load_dotenv
-import os, requests
+import os, json, upstream
 import streamlit as st
+from singleflight import coalesce
+from kv_cache import KVCache
 
 load_dotenv()
 
@@ -21,13 +24,35 @@ if not AMADEUS_API_SECRET:
 
 mcp = FastMCP("flight")
 
+# Route the Amadeus SDK to the local stub when running offline benchmarks
+stub = upstream.stub_endpoint()
+amadeus_options = {"host": stub[0], "port": stub[1], "ssl": stub[2] == "https"} if stub else {}
+
+def amadeus_http(request):
+    """ The SDK's HTTP hook: urlopen with a timeout bounded by the active deadline (the default has none). """
+    return urlopen(request, timeout=upstream.request_timeout(upstream.DEFAULT_TIMEOUT[1]))
+
 amadeus = Client(
     client_id=AMADEUS_API_KEY,
-    client_secret=AMADEUS_API_SECRET
+    client_secret=AMADEUS_API_SECRET,
+    http=amadeus_http,
+    **amadeus_options
 )
 
+# Airport codes rarely change; offers are short-lived and only served stale when Amadeus is unavailable
+airport_codes = KVCache("flights.airport_code")
+flight_offers = KVCache("flights.offers")
+AIRPORT_CODE_TTL = 30 * 24 * 3600
+FLIGHT_OFFERS_TTL = 10 * 60
+
+@coalesce("flights.get_airport_code")
 def get_airport_code(location: str):
     """ Returns the most relevant airport code for a given location. Performs a ranking of the most relevant airports. """
+    key = " ".join(location.split()).casefold()
+    cached = airport_codes.get(key)
+    if cached:
+        return cached
+    
     url = "https://sky-scrapper.p.rapidapi.com/api/v1/flights/searchAirport"
 
     headers = {
@@ -39,15 +64,21 @@ def get_airport_code(location: str):
         "query": location
     }
     
-    response = requests.get(url, headers=headers, params=params)
+    try:
+        response = upstream.get(url, headers=headers, params=params)
+    except upstream.UpstreamUnavailable:
+        stale = airport_codes.get(key, allow_stale=True)
+        if stale:
+            return stale
+        raise
     
     try:
         data = response.json().get("data", [])
     except Exception:
-        return None
+        raise ValueError(f"Airport lookup failed for {location} (HTTP {response.status_code})")
 
     if not data:
-        return None
+        raise ValueError(f"No airport found for {location}")
     
     query = location.lower().strip()
     
@@ -70,22 +101,44 @@ def get_airport_code(location: str):
     
     best_airport = sorted(data, key=airport_score, reverse=True)[0]
     sky_id = best_airport.get("skyId")
+    if not sky_id:
+        raise ValueError(f"No airport found for {location}")
+    
+    airport_codes.set(key, sky_id, ttl=AIRPORT_CODE_TTL)
     return sky_id
 
+def search_offers(**params) -> list:
+    """ Amadeus flight offers search under the scheduler; stale offers are returned only when Amadeus is unavailable. """
+    key = json.dumps(params, sort_keys=True, default=str)
+    cached = flight_offers.get(key)
+    if cached is not None:
+        return cached
+    
+    try:
+        offers = upstream.call("amadeus", amadeus.shopping.flight_offers_search.get, **params).data
+    except upstream.UpstreamUnavailable:
+        stale = flight_offers.get(key, allow_stale=True)
+        if stale is not None:
+            return stale
+        raise
+    
+    flight_offers.set(key, offers, ttl=FLIGHT_OFFERS_TTL)
+    return offers
+
 @mcp.tool()
+@upstream.with_budget
+@coalesce("flights.search_flights")
 def search_flights(origin: str, destination: str, departure_date: str, num_adults: int):
     """ Search for flights using the Amadeus Flight Offers API. """
-    origin, destination = get_airport_code(origin), get_airport_code(destination)
-    
     try:
-        response = amadeus.shopping.flight_offers_search.get(
+        origin, destination = get_airport_code(origin), get_airport_code(destination)
+        offers = search_offers(
             originLocationCode=origin,
             destinationLocationCode=destination,
             departureDate=departure_date,
             adults=num_adults,
             max=5
-        ) 
-        offers = response.data
+        )
         
         # Summarize flight offers
         summarized_offers = []
@@ -123,21 +176,22 @@ def search_flights(origin: str, destination: str, departure_date: str, num_adult
             "num_results": len(summarized_offers),
             "flights": summarized_offers
         }
-    except ResponseError as error:
+    except (ResponseError, ValueError, upstream.UpstreamUnavailable) as error:
         return {"error": str(error)}
     
 @mcp.tool()
+@upstream.with_budget
+@coalesce("flights.get_cheapest_flight")
 def get_cheapest_flight(origin: str, destination: str):
     """ Get the cheapest flight between two locations using the Amadeus Cheapest Flight API. """
-    origin, destination = get_airport_code(origin), get_airport_code(destination)
     try:
-        response = amadeus.shopping.flight_offers_search.get(
+        origin, destination = get_airport_code(origin), get_airport_code(destination)
+        offers = search_offers(
             originLocationCode=origin,
             destinationLocationCode=destination,
             max=1,
             sort="price"
         )
-        offers = response.data
         
         if not offers:
             return {"message": "No flights found."}
@@ -166,7 +220,7 @@ def get_cheapest_flight(origin: str, destination: str):
             "total_price": price,
             "currency_code": currency
         }
-    except ResponseError as error:
+    except (ResponseError, ValueError, upstream.UpstreamUnavailable) as error:
         return {"error": str(error)}
     
 if __name__ == "__main__":
@@ -0,0 +1,110 @@
+from datetime import datetime, timezone
+import numpy as np
+
+# Condition groups from OpenWeather's "main" field, least to most severe.
+CONDITIONS = ("Clear", "Clouds", "Mist", "Drizzle", "Rain", "Snow", "Thunderstorm")
+_CONDITION_CODES = {name: code for code, name in enumerate(CONDITIONS)}
+_CONDITION_CODES.update({"Fog": 2, "Haze": 2, "Smoke": 2, "Dust": 2, "Sand": 2, "Ash": 2, "Squall": 6, "Tornado": 6})
+
+# A condition must cover this share of a day's samples to represent the day.
+DOMINANT_SHARE = 0.25
+
+COLUMNS = ("time", "temp", "temp_min", "temp_max", "humidity", "wind", "precipitation", "pop", "condition")
+
+class ForecastSeries:
+    """ A 3-hourly forecast held as parallel NumPy columns (metric units, UTC epoch seconds). """
+
+    def __init__(self, columns: dict, utc_offset: int = 0, issued_at: int = 0):
+        self.time = np.asarray(columns["time"], dtype=np.int64)
+        self.temp = np.asarray(columns["temp"], dtype=np.float32)
+        self.temp_min = np.asarray(columns["temp_min"], dtype=np.float32)
+        self.temp_max = np.asarray(columns["temp_max"], dtype=np.float32)
+        self.humidity = np.asarray(columns["humidity"], dtype=np.float32)
+        self.wind = np.asarray(columns["wind"], dtype=np.float32)
+        self.precipitation = np.asarray(columns["precipitation"], dtype=np.float32)
+        self.pop = np.asarray(columns["pop"], dtype=np.float32)
+        self.condition = np.asarray(columns["condition"], dtype=np.int8)
+        self.utc_offset = int(utc_offset)
+        self.issued_at = int(issued_at)
+
+    def __len__(self):
+        return len(self.time)
+
+    @classmethod
+    def from_openweather(cls, payload: dict) -> "ForecastSeries":
+        """ Parse an OpenWeather /data/2.5/forecast response requested with units=metric. """
+        entries = payload.get("list", [])
+
+        def precipitation(entry):
+            return (entry.get("rain") or {}).get("3h", 0.0) + (entry.get("snow") or {}).get("3h", 0.0)
+
+        columns = {
+            "time": [e["dt"] for e in entries],
+            "temp": [e["main"]["temp"] for e in entries],
+            "temp_min": [e["main"].get("temp_min", e["main"]["temp"]) for e in entries],
+            "temp_max": [e["main"].get("temp_max", e["main"]["temp"]) for e in entries],
+            "humidity": [e["main"].get("humidity", np.nan) for e in entries],
+            "wind": [(e.get("wind") or {}).get("speed", np.nan) for e in entries],
+            "precipitation": [precipitation(e) for e in entries],
+            "pop": [e.get("pop", 0.0) for e in entries],
+            "condition": [_CONDITION_CODES.get((e.get("weather") or [{}])[0].get("main"), 1) for e in entries],
+        }
+        utc_offset = (payload.get("city") or {}).get("timezone", 0)
+        return cls(columns, utc_offset=utc_offset, issued_at=columns["time"][0] if entries else 0)
+
+    def to_dict(self) -> dict:
+        """ Compact, JSON-serializable form for caching. """
+        columns = {name: getattr(self, name).tolist() for name in COLUMNS}
+        return {"columns": columns, "utc_offset": self.utc_offset, "issued_at": self.issued_at}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ForecastSeries":
+        return cls(data["columns"], utc_offset=data["utc_offset"], issued_at=data["issued_at"])
+
+    def daily(self, num_days: int = None, start_date: str = None, end_date: str = None) -> list:
+        """ Aggregate to local calendar days: min/max temperature, precipitation, wind, humidity, condition. """
+        if not len(self):
+            return []
+
+        local_day = (self.time + self.utc_offset) // 86400
+        days, starts = np.unique(local_day, return_index=True)
+        counts = np.diff(np.append(starts, len(local_day)))
+
+        temp_min = np.minimum.reduceat(np.fmin(self.temp_min, self.temp), starts)
+        temp_max = np.maximum.reduceat(np.fmax(self.temp_max, self.temp), starts)
+        precipitation = np.add.reduceat(self.precipitation, starts)
+        pop = np.maximum.reduceat(self.pop, starts)
+        wind = np.fmax.reduceat(self.wind, starts)
+        humidity = np.add.reduceat(np.nan_to_num(self.humidity), starts) / counts
+
+        summary = []
+        for i, day in enumerate(days):
+            date = datetime.fromtimestamp(int(day) * 86400, tz=timezone.utc).strftime("%Y-%m-%d")
+            if (start_date and date < start_date) or (end_date and date > end_date):
+                continue
+
+            codes = np.bincount(self.condition[starts[i]:starts[i] + counts[i]], minlength=len(CONDITIONS))
+            frequent = np.flatnonzero(codes >= max(1, DOMINANT_SHARE * counts[i]))
+
+            summary.append({
+                "date": date,
+                "condition": CONDITIONS[int(frequent.max()) if len(frequent) else int(codes.argmax())],
+                "temp_min": round(float(temp_min[i]), 1),
+                "temp_max": round(float(temp_max[i]), 1),
+                "precipitation_mm": round(float(precipitation[i]), 1),
+                "precipitation_probability": round(float(pop[i]), 2),
+                "wind_max_ms": round(float(wind[i]), 1),
+                "humidity": round(float(humidity[i])),
+                "samples": int(counts[i])
+            })
+
+        return summary[:num_days] if num_days else summary
+
+    def entries(self, dates=None) -> list:
+        """ The 3-hourly rows the daily summary is built from, optionally only those on the given local dates. """
+        rows = []
+        for i in range(len(self)):
+            date = datetime.fromtimestamp(int(self.time[i]) + self.utc_offset, tz=timezone.utc).strftime("%Y-%m-%d")
+            if dates is None or date in dates:
+                rows.append({name: getattr(self, name)[i].item() for name in COLUMNS})
+        return rows
@@ -0,0 +1,212 @@
+import math, time
+import numpy as np
+from collections import defaultdict
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Grid cell size in degrees of latitude (~1.1 km); longitude cells shrink with latitude.
+CELL_DEG = 0.01
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """ Great-circle distance between two points in kilometers. """
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+def _cell(lat: float, lon: float) -> tuple:
+    return int(math.floor(lat / CELL_DEG)), int(math.floor(lon / CELL_DEG))
+
+class GeoIndex:
+    """ In-memory uniform-grid index of POIs with radius, nearest-N and coverage queries. """
+
+    def __init__(self):
+        self.pois = {}
+        self._cells = defaultdict(set)
+        self._areas = []
+
+    def __len__(self):
+        return len(self.pois)
+
+    def add(self, poi: dict):
+        """ Insert or replace a POI; it must carry "id", "lat" and "lon". """
+        if poi.get("lat") is None or poi.get("lon") is None:
+            return
+
+        old = self.pois.get(poi["id"])
+        if old is not None:
+            self._cells[_cell(old["lat"], old["lon"])].discard(poi["id"])
+
+        self.pois[poi["id"]] = poi
+        self._cells[_cell(poi["lat"], poi["lon"])].add(poi["id"])
+
+    def mark_covered(self, lat: float, lon: float, radius_km: float, expires_at: float = None):
+        """ Record that an upstream search populated this circle (until expires_at, epoch seconds, if given). """
+        self._areas.append((lat, lon, radius_km, expires_at))
+
+    def covers(self, lat: float, lon: float, radius_km: float) -> bool:
+        """ True if the circle lies inside an unexpired area that was already fetched upstream. """
+        now = time.time()
+        return any(haversine_km(lat, lon, a_lat, a_lon) + radius_km <= a_radius
+                   for a_lat, a_lon, a_radius, expires_at in self._areas if expires_at is None or expires_at > now)
+
+    def _candidates(self, lat: float, lon: float, radius_km: float):
+        dlat = radius_km / 111.32
+        dlon = radius_km / max(1e-6, 111.32 * math.cos(math.radians(lat)))
+        lat_lo, lon_lo = _cell(lat - dlat, lon - dlon)
+        lat_hi, lon_hi = _cell(lat + dlat, lon + dlon)
+
+        for i in range(lat_lo, lat_hi + 1):
+            for j in range(lon_lo, lon_hi + 1):
+                for poi_id in self._cells.get((i, j), ()):
+                    yield self.pois[poi_id]
+
+    def within(self, lat: float, lon: float, radius_km: float, category: str = None) -> list:
+        """ Return (distance_km, poi) pairs inside the radius, nearest first. """
+        found = []
+        for poi in self._candidates(lat, lon, radius_km):
+            if category and not matches_category(poi, category):
+                continue
+            distance = haversine_km(lat, lon, poi["lat"], poi["lon"])
+            if distance <= radius_km:
+                found.append((distance, poi))
+        return sorted(found, key=lambda pair: pair[0])
+
+    def nearest(self, lat: float, lon: float, n: int, category: str = None, max_km: float = 50.0) -> list:
+        """ Return the n nearest (distance_km, poi) pairs, growing the search ring until enough are found. """
+        radius = CELL_DEG * 111.32
+        while True:
+            found = self.within(lat, lon, radius, category)
+            if len(found) >= n or radius >= max_km:
+                return found[:n]
+            radius = min(max_km, radius * 2)
+
+    def top_rated(self, lat: float, lon: float, radius_km: float, k: int, category: str = None) -> list:
+        """ Best-rated POIs within the radius; ties broken by distance. """
+        found = self.within(lat, lon, radius_km, category)
+        found.sort(key=lambda pair: (-(pair[1].get("rating") or 0), pair[0]))
+        return found[:k]
+
+def matches_category(poi: dict, category: str) -> bool:
+    wanted = category.casefold()
+    return any(wanted in (name or "").casefold() for name in poi.get("categories", []))
+
+def _project(lat: float, lon: float, lat0: float) -> tuple:
+    """ Equirectangular projection to km; accurate enough within a city. """
+    return math.radians(lon) * math.cos(math.radians(lat0)) * EARTH_RADIUS_KM, math.radians(lat) * EARTH_RADIUS_KM
+
+def order_by_nearest_neighbour(pois: list, start: int = 0) -> list:
+    """ Greedy nearest-neighbour walking order starting from pois[start]. """
+    if not pois:
+        return []
+
+    remaining = list(pois)
+    route = [remaining.pop(start)]
+    while remaining:
+        last = route[-1]
+        nxt = min(range(len(remaining)),
+                  key=lambda i: haversine_km(last["lat"], last["lon"], remaining[i]["lat"], remaining[i]["lon"]))
+        route.append(remaining.pop(nxt))
+    return route
+
+def route_length_km(pois: list) -> float:
+    return sum(haversine_km(a["lat"], a["lon"], b["lat"], b["lon"]) for a, b in zip(pois, pois[1:]))
+
+def cluster_by_day(pois: list, days: int, iterations: int = 20) -> list:
+    """
+    Group POIs into `days` compact, similarly sized sets (capacity-balanced k-means), each in walking order.
+    Returns a list of POI lists, one per day (empty days are dropped).
+    """
+    pois = [p for p in pois if p.get("lat") is not None and p.get("lon") is not None]
+    if not pois or days <= 0:
+        return []
+
+    days = min(days, len(pois))
+    lat0 = sum(p["lat"] for p in pois) / len(pois)
+    points = [_project(p["lat"], p["lon"], lat0) for p in pois]
+    capacity = math.ceil(len(pois) / days)
+
+    def dist2(a, b):
+        return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2
+
+    # Farthest-point seeding from the best-rated POI keeps the result deterministic
+    first = max(range(len(pois)), key=lambda i: pois[i].get("rating") or 0)
+    centers = [points[first]]
+    while len(centers) < days:
+        centers.append(points[max(range(len(points)), key=lambda i: min(dist2(points[i], c) for c in centers))])
+
+    assignment = [0] * len(points)
+    for _ in range(iterations):
+        # Assign the most "decided" points first so capacity overflow lands on borderline points
+        order = sorted(range(len(points)), key=lambda i: min(dist2(points[i], c) for c in centers))
+        load = [0] * days
+        new_assignment = [0] * len(points)
+        for i in order:
+            ranked = sorted(range(days), key=lambda c: dist2(points[i], centers[c]))
+            cluster = next(c for c in ranked if load[c] < capacity)
+            new_assignment[i] = cluster
+            load[cluster] += 1
+
+        for c in range(days):
+            members = [points[i] for i in range(len(points)) if new_assignment[i] == c]
+            if members:
+                centers[c] = (sum(x for x, _ in members) / len(members), sum(y for _, y in members) / len(members))
+
+        if new_assignment == assignment:
+            break
+        assignment = new_assignment
+
+    groups = [[pois[i] for i in range(len(pois)) if assignment[i] == c] for c in range(days)]
+    return [order_by_nearest_neighbour(group) for group in groups if group]
+
+# WGS-84 ellipsoid, for the vectorized geodesic approximation below
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+
+def _central_angle(lat1, lon1, lat2, lon2):
+    """ Vectorized great-circle central angle (radians) between broadcastable arrays of radians. """
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def distance_matrix_km(coords, method: str = "great_circle"):
+    """
+    All-pairs distance matrix (km) for a sequence of (lat, lon) pairs, computed with NumPy broadcasting.
+    method="great_circle" uses a spherical Earth; method="geodesic" applies Lambert's ellipsoidal
+    correction on WGS-84, accurate to ~10 m for city-to-city distances.
+    """
+    points = np.radians(np.asarray(coords, dtype=float).reshape(-1, 2))
+    lat, lon = points[:, 0][:, None], points[:, 1][:, None]
+
+    if method == "great_circle":
+        return EARTH_RADIUS_KM * _central_angle(lat, lon, lat.T, lon.T)
+
+    if method != "geodesic":
+        raise ValueError('method must be "great_circle" or "geodesic"')
+
+    beta = np.arctan((1 - WGS84_F) * np.tan(points[:, 0]))[:, None]
+    sigma = _central_angle(beta, lon, beta.T, lon.T)
+    p, q = (beta + beta.T) / 2, (beta.T - beta) / 2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (sigma - np.sin(sigma)) * (np.sin(p) ** 2 * np.cos(q) ** 2) / np.cos(sigma / 2) ** 2
+        y = (sigma + np.sin(sigma)) * (np.cos(p) ** 2 * np.sin(q) ** 2) / np.sin(sigma / 2) ** 2
+        distance = WGS84_A_KM * (sigma - WGS84_F / 2 * (x + y))
+
+    return np.where(sigma > 0, distance, 0.0)
+
+def nearest_neighbour_order(matrix, start: int = 0) -> list:
+    """ Greedy visiting order over a distance matrix, starting at `start`. """
+    matrix = np.asarray(matrix, dtype=float)
+    n = len(matrix)
+    if n == 0:
+        return []
+
+    visited = np.zeros(n, dtype=bool)
+    order = [start]
+    visited[start] = True
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, matrix[order[-1]])
+        nxt = int(np.argmin(row))
+        order.append(nxt)
+        visited[nxt] = True
+    return order
@@ -1,7 +1,12 @@
 from fastmcp import FastMCP
-import os, requests
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+import os, json, re, math, contextvars, logging, unicodedata, requests, upstream
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
+from model_router import get_model
+from singleflight import coalesce
+from kv_cache import KVCache
+from prompt_builder import PromptTemplate
 import streamlit as st
 
 load_dotenv()
@@ -26,32 +31,50 @@ if not RAPID_API_HOST:
 
 mcp = FastMCP("hotel")
 
-# Initialize the LLM
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.5, api_key=OPENAI_API_KEY)
-    
-def find_destination_id(location: str) -> str:
-    """ Find the destination ID for a given location using the Booking.com API. """
-    url = "https://booking-com15.p.rapidapi.com/api/v1/hotels/searchDestination"
-    
-    headers = {
-        "x-rapidapi-host": RAPID_API_HOST,
-        "x-rapidapi-key": RAPID_API_KEY
-    }
-    
-    params = {
-        "query": location
-    }
-    
-    response = requests.get(url, headers=headers, params=params)
-    data = response.json()
+logger = logging.getLogger("hotels_mcp")
+
+# Initialize the summarization LLM (cheapest adequate tier, with fallbacks)
+llm = get_model("summarization", temperature=0.5, api_key=OPENAI_API_KEY)
     
-    if not data.get("data"):
-        raise ValueError("Destination not found")
+# Persistent location -> dest_id index shared across restarts; unknown places are cached briefly
+destination_index = KVCache("hotels.destination_id")
+DESTINATION_TTL = 30 * 24 * 3600
+UNKNOWN_DESTINATION_TTL = 6 * 3600
+
+# Search result pages are reused briefly, and served stale when Booking.com is out of budget or down
+hotel_pages = KVCache("hotels.pages")
+HOTEL_PAGE_TTL = 30 * 60
+
+# Common names that Booking.com does not resolve (or resolves to the wrong place) as typed
+DESTINATION_ALIASES = {
+    "nyc": "new york",
+    "new york city": "new york",
+    "la": "los angeles",
+    "sf": "san francisco",
+    "dc": "washington",
+    "rome italy": "rome",
+    "bombay": "mumbai",
+    "peking": "beijing",
+    "saigon": "ho chi minh city",
+}
 
-    return data["data"][0]["dest_id"]
+def normalize_location(location: str) -> str:
+    """ Normalize a location for index lookups: accents, case, punctuation and known aliases. """
+    text = unicodedata.normalize("NFKD", location).encode("ascii", "ignore").decode()
+    text = " ".join(re.sub(r"[^\w\s]", " ", text).casefold().split())
+    return DESTINATION_ALIASES.get(text, text)
 
-def get_destination_id(location: str, locale: str = "en-us"):
-    """ Get the destination ID for a given location using the Booking.com Locations API. """
+@coalesce("hotels.resolve_destination_id")
+def resolve_destination_id(location: str, locale: str = "en-us") -> str:
+    """ Resolve a location to a Booking.com dest_id, using the persistent index before the Locations API. """
+    key = f"{locale}:{normalize_location(location)}"
+    cached = destination_index.get(key)
+    
+    if cached is not None:
+        if cached.get("unknown"):
+            raise ValueError(f"Destination not found: {location}")
+        return cached["dest_id"]
+    
     url = "https://booking-com.p.rapidapi.com/v1/hotels/locations"
     
     headers = {
@@ -59,8 +82,32 @@ def get_destination_id(location: str, locale: str = "en-us"):
         "x-rapidapi-host": RAPID_API_HOST
     }
     
-    response = requests.get(url=url, headers=headers, params={"name": location, "locale": locale})
-    return response.json()[0]["dest_id"]
+    try:
+        response = upstream.get(url=url, headers=headers, params={"name": normalize_location(location).title(), "locale": locale})
+    except upstream.UpstreamUnavailable:
+        stale = destination_index.get(key, allow_stale=True)
+        if stale and not stale.get("unknown"):
+            return stale["dest_id"]
+        raise
+    
+    data = response.json()
+    
+    # Errors (quota, auth) come back as a dict and must not be cached as "unknown"
+    if not isinstance(data, list):
+        raise ValueError(f"Destination lookup failed: {data}")
+        
+    if not data:
+        destination_index.set(key, {"unknown": True}, ttl=UNKNOWN_DESTINATION_TTL)
+        raise ValueError(f"Destination not found: {location}")
+
+    entry = {"dest_id": data[0]["dest_id"], "dest_type": data[0].get("dest_type"), "name": data[0].get("name")}
+    destination_index.set(key, entry, ttl=DESTINATION_TTL)
+    
+    # Index the canonical name too, so other spellings that resolve to it skip the lookup later
+    if entry["name"]:
+        destination_index.set(f"{locale}:{normalize_location(entry['name'])}", entry, ttl=DESTINATION_TTL)
+        
+    return entry["dest_id"]
 
 def extract_hotel_data(api_response, limit=5):
     """Extract and simplify hotel data from Booking.com API response."""
@@ -68,7 +115,7 @@ def extract_hotel_data(api_response, limit=5):
     simplified = []
 
     for h in hotels_raw[:limit]:
-        gross_info = h.get("composite_price_breakdown", {}).get("gross_amount_hotel_currency", {})
+        gross_info = h.get("composite_price_breakdown", {}).get("gross_amount_per_night", {})
         
         price_info = gross_info.get("value")
         currency = gross_info.get("currency")
@@ -77,7 +124,7 @@ def extract_hotel_data(api_response, limit=5):
             "name": h.get("hotel_name") or h.get("hotel_name_trans"),
             "rating": h.get("review_score"),
             "review_word": h.get("review_score_word", ""),
-            "price": round(float(price_info), 2) if price_info else "N/A",
+            "price_per_night": round(float(price_info), 2) if price_info else "N/A",
             "currency": currency,
             "distance_to_center": h.get("distance_to_cc_formatted") or h.get("distance"),
             "free_cancellation": bool(h.get("is_free_cancellable", 0)),
@@ -87,73 +134,256 @@ def extract_hotel_data(api_response, limit=5):
 
     return simplified
 
-def generate_hotel_recommendation(location: str, hotels: list):
-    """ Generate a hotel recommendation overview using the LLM. """
-    hotel_text = ""
-    for h in hotels:
-        hotel_text += (
-            f"Hotel Name: {h['name']}\n"
-            f"Rating: {h['rating']}\n"
-            f"Price: {h['price']} {h['currency']}\n"
-            f"Distance to Center: {h['distance_to_center']}\n"
-            f"Free Cancellation: {h['free_cancellation']}\n"
-            f"Address: {h['address']}\n"
-            f"Hotel URL: {h['url']}\n"
-            f"Image URL: {h['image_url']}\n\n"
-        )
-        
-    prompt = f"""
-        Act as a professional travel planning assistant.
+def parse_distance_km(value) -> float:
+    """ Parse Booking.com distances ("1.2 km", "800 m", "0.45") into kilometers; NaN if unknown. """
+    if value is None:
+        return math.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    match = re.search(r"(\d+(?:\.\d+)?)\s*(km|m)?", str(value))
+    if not match:
+        return math.nan
+
+    number = float(match.group(1))
+    return number / 1000 if match.group(2) == "m" else number
+
+class HotelColumns:
+    """
+    Compact columnar store of hotel results: numeric columns as float arrays (NaN = unknown).
+    Prices are per night in the currency the search requested (filter_by_currency).
+    """
+
+    def __init__(self):
+        self.price = array("d")
+        self.rating = array("d")
+        self.distance_km = array("d")
+        self.name = []
+        self.currency = []
+        self.free_cancellation = []
+        self.address = []
+        self.url = []
+        self._seen = set()
+
+    def __len__(self):
+        return len(self.name)
 
-        The user asked for hotel options in: {location}.
+    def extend(self, api_response: dict):
+        """ Append hotels from one search page, skipping hotels already seen on another page. """
+        for h in api_response.get("result", []) or []:
+            hotel_id = h.get("hotel_id") or h.get("hotel_name")
+            if hotel_id in self._seen:
+                continue
+            self._seen.add(hotel_id)
 
-        Here is the raw structured hotel data:
+            # Per night and in the requested currency, so max_price compares like with like across hotels
+            gross_info = h.get("composite_price_breakdown", {}).get("gross_amount_per_night", {})
+            price = gross_info.get("value")
+            rating = h.get("review_score")
 
-        {hotel_text}
+            self.price.append(float(price) if price is not None else math.nan)
+            self.rating.append(float(rating) if rating is not None else math.nan)
+            self.distance_km.append(parse_distance_km(h.get("distance") or h.get("distance_to_cc_formatted")))
+            self.name.append(h.get("hotel_name") or h.get("hotel_name_trans"))
+            self.currency.append(gross_info.get("currency"))
+            self.free_cancellation.append(bool(h.get("is_free_cancellable", 0)))
+            self.address.append(h.get("address_trans") or "")
+            self.url.append(h.get("url") or "")
 
-        Write a clean, friendly, concise, well-organized overview:
-        - Start with a short summary
-        - Then present 3–5 hotels as bullet points or sections
-        - Highlight rating, price, cancellation, distance, and unique features
-        - Include a link for each hotel - only if found and relevant, otherwise omit it
-        - Avoid technical jargon
-        - Use clear formatting and emojis sparingly
+    def select(self, max_price: float = None, min_rating: float = None, max_distance_km: float = None,
+               sort_by: str = "price", top_k: int = 10) -> list:
+        """ Filter, sort and top-k locally; returns row indices. Unknown values never pass a filter. """
+        rows = range(len(self))
+
+        if max_price is not None:
+            rows = [i for i in rows if self.price[i] <= max_price]
+        if min_rating is not None:
+            rows = [i for i in rows if self.rating[i] >= min_rating]
+        if max_distance_km is not None:
+            rows = [i for i in rows if self.distance_km[i] <= max_distance_km]
+
+        # Missing values sort last in every order
+        keys = {
+            "price": lambda i: (math.isnan(self.price[i]), self.price[i]),
+            "rating": lambda i: (math.isnan(self.rating[i]), -self.rating[i]),
+            "distance": lambda i: (math.isnan(self.distance_km[i]), self.distance_km[i]),
+        }
+        if sort_by not in keys:
+            raise ValueError(f"sort_by must be one of {sorted(keys)}")
+
+        return sorted(rows, key=keys[sort_by])[:top_k]
+
+    def row(self, i: int) -> dict:
+        def clean(value):
+            return None if math.isnan(value) else round(value, 2)
+
+        return {
+            "name": self.name[i],
+            "price_per_night": clean(self.price[i]),
+            "currency": self.currency[i],
+            "rating": clean(self.rating[i]),
+            "distance_km": clean(self.distance_km[i]),
+            "free_cancellation": self.free_cancellation[i],
+            "address": self.address[i],
+            "url": self.url[i]
+        }
+
+HOTEL_RECOMMENDATION_PROMPT = PromptTemplate(
+    "hotel_recommendation",
     """
-    
+    Act as a professional travel planning assistant.
+
+    Below is a table of hotel options (one row per hotel, "-" means unknown). Write a clean,
+    friendly, concise, well-organized overview:
+    - Start with a short summary
+    - Then present 3–5 hotels as bullet points or sections
+    - Highlight rating, price, cancellation, distance, and unique features
+    - Avoid technical jargon
+    - Use clear formatting and emojis sparingly
+    """,
+    fields=["name", "rating", "review_word", "price_per_night", "currency", "distance_to_center", "free_cancellation", "address"],
+    max_tokens=1200
+)
+
+def generate_hotel_recommendation(location: str, hotels: list, raw=None):
+    """ Generate a hotel recommendation overview using the LLM; raw is the upstream data it summarizes. """
+    prompt = HOTEL_RECOMMENDATION_PROMPT.render(hotels, context=f"The user asked for hotel options in: {location}.",
+                                                raw=raw)
     response = llm.invoke(prompt)
     return response.content
     
 @mcp.tool()
+@upstream.with_budget
+@coalesce("hotels.search_hotels")
 def search_hotels(num_adults: int, num_children: int, checkin_date: str, checkout_date: str, location: str, children_ages: str = "5,0", units: str = "metric", destination_type: str = "city", order_by: str = "popularity", num_rooms: int = 1, currency_code: str = "USD", locale: str = "en-us", page_num: int = 0, categories_filter_ids: str = "class::2,class::4,free_cancellation::1"):
     """ Search for hotels using the Booking.com API and return a recommendation of hotels for a specific location. """
+    try:
+        destination_id = resolve_destination_id(location, locale)
+    except (ValueError, upstream.UpstreamUnavailable) as e:
+        return {"error": str(e)}
+    
+    queryString = {
+        "adults_number": num_adults,
+        "children_number": num_children,
+        "units": units,
+        "page_number": page_num,
+        "checkin_date": checkin_date,
+        "checkout_date": checkout_date,
+        "categories_filter_ids": categories_filter_ids,
+        "children_ages": children_ages,
+        "dest_type": destination_type,
+        "dest_id": destination_id,
+        "order_by": order_by,
+        "room_number": num_rooms,
+        "filter_by_currency": currency_code,
+        "locale": locale
+    }
+    try:
+        page = fetch_hotel_page(queryString)
+    except upstream.UpstreamUnavailable as e:
+        return {"error": str(e)}
+    
+    hotels = extract_hotel_data(page, limit=10)
+    if not hotels:
+        return {"location": location, "num_results": 0, "message": "No hotels found for these dates."}
+    
+    hotels = generate_hotel_recommendation(location, hotels, raw=page.get("result", [])[:10])
+    return hotels
+
+def fetch_hotel_page(query_string: dict, page_num: int = None) -> dict:
+    """ Fetch one page of Booking.com hotel search results. """
     url = "https://booking-com.p.rapidapi.com/v1/hotels/search"
-    destination_id = get_destination_id(location.title())
     
     headers = {
         "x-rapidapi-host": RAPID_API_HOST,
         "x-rapidapi-key": RAPID_API_KEY
     }
     
+    params = dict(query_string)
+    if page_num is not None:
+        params["page_number"] = page_num
+    
+    key = json.dumps(params, sort_keys=True, default=str)
+    cached = hotel_pages.get(key)
+    if cached is not None:
+        return cached
+    
+    try:
+        response = upstream.get(url, headers=headers, params=params)
+        # A body without "result" is an API error, not an empty page
+        data = upstream.json_body(response, require="result")
+    except upstream.UpstreamUnavailable:
+        stale = hotel_pages.get(key, allow_stale=True)
+        if stale is not None:
+            return stale
+        raise
+    
+    hotel_pages.set(key, data, ttl=HOTEL_PAGE_TTL)
+    return data
+
+@mcp.tool()
+@upstream.with_budget
+@coalesce("hotels.search_hotels_filtered")
+def search_hotels_filtered(num_adults: int, num_children: int, checkin_date: str, checkout_date: str, location: str, max_price: float = None, min_rating: float = None, max_distance_km: float = None, sort_by: str = "price", top_k: int = 10, pages: int = 3, children_ages: str = "5,0", num_rooms: int = 1, currency_code: str = "USD", locale: str = "en-us", categories_filter_ids: str = "class::2,class::4,free_cancellation::1"):
+    """ Search several result pages of hotels at once and return only the top matches, filtered by max_price (per night, in currency_code), minimum rating (0-10) and distance to center, sorted by "price", "rating" or "distance". Use this for "all hotels under X a night" style questions instead of repeated searches. """
+    try:
+        destination_id = resolve_destination_id(location, locale)
+    except (ValueError, upstream.UpstreamUnavailable) as e:
+        return {"error": str(e)}
+    
     queryString = {
         "adults_number": num_adults,
         "children_number": num_children,
-        "units": units,
-        "page_number": page_num,
+        "units": "metric",
         "checkin_date": checkin_date,
         "checkout_date": checkout_date,
         "categories_filter_ids": categories_filter_ids,
         "children_ages": children_ages,
-        "dest_type": destination_type,
+        "dest_type": "city",
         "dest_id": destination_id,
-        "order_by": order_by,
+        "order_by": "popularity",
         "room_number": num_rooms,
         "filter_by_currency": currency_code,
         "locale": locale
     }
-    response = requests.get(url, headers=headers, params=queryString)
-    hotels = extract_hotel_data(response.json(), limit=10)
-    hotels = generate_hotel_recommendation(location, hotels)
-    return hotels
+    
+    # Fetch all pages concurrently, each under this call's deadline; a page lost upstream only loses its own results
+    columns = HotelColumns()
+    pages = max(1, min(pages, 10))
+    fetched, errors = 0, []
+    with ThreadPoolExecutor(max_workers=pages) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, fetch_hotel_page, queryString, page) for page in range(pages)]
+        for page, future in enumerate(futures):
+            try:
+                columns.extend(future.result())
+                fetched += 1
+            except (upstream.UpstreamUnavailable, requests.RequestException) as e:
+                logger.warning("hotel search %s: page %d failed: %s", location, page, e)
+                errors.append(str(e))
+    
+    if not fetched:
+        return {"error": f"No hotel results page could be fetched: {errors[0]}"}
+            
+    rows = columns.select(max_price=max_price, min_rating=min_rating, max_distance_km=max_distance_km,
+                          sort_by=sort_by, top_k=top_k)
+    
+    result = {
+        "location": location,
+        "pages_fetched": fetched,
+        "hotels_scanned": len(columns),
+        "num_results": len(rows),
+        "hotels": [columns.row(i) for i in rows]
+    }
+    if errors:
+        result["pages_failed"] = len(errors)
+    return result
+
+@mcp.tool()
+@upstream.with_budget
+def prefetch_destination(location: str, locale: str = "en-us"):
+    """ Internal: warm the destination index for a location ahead of a hotel search. Not exposed to the agent. """
+    with upstream.priority(upstream.PREFETCH):
+        return {"location": location, "dest_id": resolve_destination_id(location, locale)}
 
 if __name__ == "__main__":
     mcp.run()
\ No newline at end of file
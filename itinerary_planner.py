@@ -0,0 +1,176 @@
+from geo_index import cluster_by_day, haversine_km
+
+# Categories treated as indoor when slotting attractions onto rainy days.
+INDOOR_KEYWORDS = ("museum", "gallery", "church", "cathedral", "basilica", "temple", "mosque", "theater", "theatre",
+                   "opera", "cinema", "aquarium", "mall", "shopping", "market hall", "library", "palace", "exhibit")
+
+# Rough entry cost per category (in the trip currency) when the data has none.
+CATEGORY_COSTS = (("museum", 20.0), ("gallery", 15.0), ("palace", 20.0), ("aquarium", 30.0), ("zoo", 25.0),
+                  ("theater", 40.0), ("theatre", 40.0), ("opera", 60.0), ("tour", 35.0))
+DEFAULT_PLACE_COST = 0.0
+
+DEFAULT_PLACES_PER_DAY = 4
+
+def is_indoor(poi: dict) -> bool:
+    names = " ".join(poi.get("categories") or []).casefold()
+    return any(keyword in names for keyword in INDOOR_KEYWORDS)
+
+def place_cost(poi: dict) -> float:
+    if poi.get("cost") is not None:
+        return float(poi["cost"])
+    names = " ".join(poi.get("categories") or []).casefold()
+    return next((cost for keyword, cost in CATEGORY_COSTS if keyword in names), DEFAULT_PLACE_COST)
+
+def place_score(poi: dict) -> float:
+    return float(poi.get("rating") or 7.0)
+
+def trip_nights(days: int) -> int:
+    """ Hotel nights of a trip of `days` days; the last day is spent travelling home. """
+    return max(0, int(days) - 1)
+
+def rain_risk(day_weather: dict) -> float:
+    """ 0..1 likelihood the day is wet, from whichever fields the forecast provides. """
+    if not day_weather:
+        return 0.0
+    risk = float(day_weather.get("precipitation_probability") or 0.0)
+    if (day_weather.get("precipitation_mm") or 0.0) >= 1.0:
+        risk = max(risk, 0.8)
+    if str(day_weather.get("condition", "")).casefold() in ("rain", "thunderstorm", "snow", "drizzle"):
+        risk = max(risk, 0.9)
+    return min(1.0, risk)
+
+def two_opt(route: list, dist, max_passes: int = 20) -> list:
+    """ Improve an open walking path with 2-opt segment reversals until no move shortens it. """
+    best = list(route)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(len(best) - 2):
+            for j in range(i + 2, len(best)):
+                a, b = best[i], best[i + 1]
+                c, d = best[j], best[j + 1] if j + 1 < len(best) else None
+                before = dist[a][b] + (dist[c][d] if d is not None else 0.0)
+                after = dist[a][c] + (dist[b][d] if d is not None else 0.0)
+                if after + 1e-9 < before:
+                    best[i + 1:j + 1] = reversed(best[i + 1:j + 1])
+                    improved = True
+        if not improved:
+            break
+    return best
+
+def order_day(pois: list, start: tuple = None) -> list:
+    """ Order one day's POIs: nearest-neighbour from the start (e.g. the hotel) refined by 2-opt. """
+    if len(pois) < 3 and start is None:
+        return list(pois)
+
+    points = ([{"lat": start[0], "lon": start[1]}] if start else []) + list(pois)
+    n = len(points)
+    dist = [[haversine_km(points[i]["lat"], points[i]["lon"], points[j]["lat"], points[j]["lon"]) for j in range(n)]
+            for i in range(n)]
+
+    route, remaining = [0], set(range(1, n))
+    while remaining:
+        nxt = min(remaining, key=lambda k: dist[route[-1]][k])
+        route.append(nxt)
+        remaining.remove(nxt)
+
+    # 2-opt never moves the first stop, so a given start point stays first
+    route = two_opt(route, dist)
+    offset = 1 if start else 0
+    return [points[k] for k in route[offset:]]
+
+def select_places(pois: list, days: int, places_per_day: int, activity_budget: float = None) -> tuple:
+    """ Pick the best POIs that fit the day slots and activity budget; returns (selected, dropped). """
+    unique = {}
+    for poi in pois:
+        if poi.get("lat") is None or poi.get("lon") is None:
+            continue
+        key = poi.get("id") or poi.get("name")
+        if key not in unique or place_score(poi) > place_score(unique[key]):
+            unique[key] = poi
+
+    ranked = sorted(unique.values(), key=lambda p: (-place_score(p), place_cost(p)))
+    selected, dropped, spent = [], [], 0.0
+    slots = days * places_per_day
+
+    for poi in ranked:
+        cost = place_cost(poi)
+        if len(selected) >= slots:
+            dropped.append(poi)
+        elif activity_budget is not None and spent + cost > activity_budget:
+            dropped.append(poi)
+        else:
+            selected.append(poi)
+            spent += cost
+    return selected, dropped
+
+def plan_itinerary(pois: list, days: int, weather: list = None, budget: float = None,
+                   hotel_nightly: float = 0.0, daily_expenses: float = 0.0,
+                   places_per_day: int = DEFAULT_PLACES_PER_DAY, start: tuple = None) -> dict:
+    """
+    Deterministically assign POIs to days and order them.
+
+    pois:    dicts with name, lat, lon and optional categories, rating, cost, id
+    weather: optional per-day dicts (date, condition, precipitation_mm, precipitation_probability, temp_min/max)
+    budget:  optional total trip budget; lodging and daily expenses are reserved first and
+             attractions only use what is left
+    start:   optional (lat, lon) every day starts from, e.g. the hotel
+    """
+    days = max(1, int(days))
+    weather = list(weather or [])
+    fixed_costs = hotel_nightly * trip_nights(days) + daily_expenses * days
+    activity_budget = None if budget is None else max(0.0, budget - fixed_costs)
+
+    selected, dropped = select_places(pois, days, places_per_day, activity_budget)
+    clusters = cluster_by_day(selected, days)
+    clusters += [[] for _ in range(days - len(clusters))]
+
+    # Weather-aware slotting: the most indoor clusters go to the wettest days
+    def indoor_share(cluster):
+        return sum(is_indoor(p) for p in cluster) / len(cluster) if cluster else 0.0
+
+    day_order = sorted(range(days), key=lambda d: -rain_risk(weather[d] if d < len(weather) else None))
+    cluster_order = sorted(range(len(clusters)), key=lambda c: -indoor_share(clusters[c]))
+    slotted = [None] * days
+    for d, c in zip(day_order, cluster_order):
+        slotted[d] = clusters[c]
+
+    plan_days = []
+    for d in range(days):
+        route = order_day(slotted[d], start)
+        legs = ([{"lat": start[0], "lon": start[1]}] if start and route else []) + route
+        walk_km = sum(haversine_km(a["lat"], a["lon"], b["lat"], b["lon"]) for a, b in zip(legs, legs[1:]))
+        day_weather = weather[d] if d < len(weather) else None
+
+        plan_days.append({
+            "day": d + 1,
+            "date": (day_weather or {}).get("date"),
+            "weather": day_weather,
+            "rain_risk": round(rain_risk(day_weather), 2),
+            "indoor_share": round(indoor_share(route), 2),
+            "walk_km": round(walk_km, 2),
+            "est_activity_cost": round(sum(place_cost(p) for p in route), 2),
+            "places": [{
+                "name": p.get("name"),
+                "categories": p.get("categories") or [],
+                "rating": p.get("rating"),
+                "indoor": is_indoor(p),
+                "est_cost": place_cost(p),
+                "lat": p["lat"],
+                "lon": p["lon"]
+            } for p in route]
+        })
+
+    activity_cost = sum(day["est_activity_cost"] for day in plan_days)
+    return {
+        "days": plan_days,
+        "budget": {
+            "total_budget": budget,
+            "lodging": round(hotel_nightly * trip_nights(days), 2),
+            "daily_expenses": round(daily_expenses * days, 2),
+            "activities": round(activity_cost, 2),
+            "estimated_total": round(fixed_costs + activity_cost, 2),
+            "remaining": None if budget is None else round(budget - fixed_costs - activity_cost, 2),
+            "over_budget": budget is not None and fixed_costs > budget
+        },
+        "unscheduled": [p.get("name") for p in dropped]
+    }
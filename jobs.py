@@ -0,0 +1,242 @@
+import asyncio, contextvars, hashlib, json, logging, threading, time
+import upstream
+from langchain_core.tools import ToolException
+from kv_cache import KVCache
+from singleflight import normalize
+
+logger = logging.getLogger("travel_planner_chatbot")
+
+# Jobs running at once on the backend loop; further jobs wait their turn
+JOB_CONCURRENCY = 2
+
+# Wall-clock budget of one run of a job, in seconds; unfinished steps stay resumable
+JOB_DEADLINE = 300.0
+
+# How long job records and their step results are kept for polling and resuming
+JOB_TTL = 6 * 3600
+
+# Wake-up interval of subscribers when no in-process change notification arrives
+POLL_INTERVAL = 0.5
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+class Step:
+    """ One unit of a job: an async fn(params, results) returning JSON-serializable data. """
+
+    def __init__(self, name: str, fn, requires=(), optional: bool = False):
+        self.name = name
+        self.fn = fn
+        self.requires = tuple(requires)
+        # An optional step may fail without failing the job; later steps then see None for it
+        self.optional = optional
+
+def job_id_for(kind: str, params: dict) -> str:
+    """ Same request, same job: a retry after a reload or failure finds the steps already completed. """
+    digest = hashlib.sha256(json.dumps(normalize(params), sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return f"{kind}-{digest}"
+
+def job_tool_output(record: dict, instructions: str) -> str:
+    """
+    A tool's answer from its job record: the result as JSON once done, otherwise a ToolException
+    telling the model the job failed or is still running. Tools using it set handle_tool_error, so
+    the model sees an error result (never memoized) and the turn goes on.
+    """
+    if record["status"] == DONE:
+        return json.dumps({"instructions": instructions, **record["result"]}, ensure_ascii=False)
+
+    kind = record["kind"]
+    completed = ", ".join(name for name, step in record["steps"].items() if step["status"] == DONE) or "none"
+    if record["status"] == FAILED:
+        raise ToolException(f"{kind} job {record['id']} failed: {record['error']} (completed steps: {completed}). "
+                            "Calling the tool again resumes it.")
+    raise ToolException(f"{kind} job {record['id']} is still running (completed steps: {completed}). Tell the "
+                        "traveler it will be ready shortly and to ask again; completed steps are kept.")
+
+class JobQueue:
+    """
+    Runs multi-step requests as background jobs on the async backend.
+
+    kinds maps a job kind to its ordered list of Steps; steps whose requirements are met run
+    concurrently. The job record (status, per-step status and result, final result) is written
+    to the shared KV cache after every step, so any rerun or process can poll it, and submitting
+    the same request again resumes from the completed steps instead of starting over.
+    submit schedules a coroutine on the backend loop (travel_planner_chatbot.submit_async_task).
+    """
+
+    def __init__(self, kinds: dict, submit, store: KVCache = None, concurrency: int = JOB_CONCURRENCY,
+                 deadline: float = JOB_DEADLINE):
+        self.kinds = kinds
+        self.store = store or KVCache("jobs")
+        self.deadline = deadline
+        self._submit = submit
+        self._concurrency = concurrency
+        self._semaphores = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self.stats = {"submitted": 0, "resumed": 0, "reused": 0, "steps_run": 0, "steps_reused": 0,
+                      "done": 0, "failed": 0}
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self._concurrency)
+        return self._semaphores[loop]
+
+    def _save(self, record: dict):
+        record["updated_at"] = time.time()
+        self.store.set(record["id"], record, ttl=JOB_TTL)
+        with self._changed:
+            self._changed.notify_all()
+
+    def get(self, job_id: str):
+        """ The job record, or None if unknown or expired. """
+        return self.store.get(job_id)
+
+    def submit(self, kind: str, params: dict, restart: bool = False) -> str:
+        """
+        Start (or resume) the job for this request and return its id without waiting.
+        A finished job is reused as is; a running one is joined; a failed or interrupted one resumes.
+        restart=True discards earlier step results.
+        """
+        if kind not in self.kinds:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        # Unset options must not make an otherwise identical request a different job
+        params = {key: value for key, value in params.items() if value is not None}
+        job_id = job_id_for(kind, params)
+        with self._lock:
+            record = None if restart else self.get(job_id)
+            if record is not None and record["status"] == DONE:
+                self.stats["reused"] += 1
+                return job_id
+
+            if self.active(job_id):
+                return job_id
+
+            if record is None:
+                record = {"id": job_id, "kind": kind, "params": params, "status": QUEUED, "steps": {},
+                          "result": None, "error": None, "attempts": 0, "created_at": time.time()}
+                self.stats["submitted"] += 1
+            else:
+                # Failed, or interrupted (e.g. the server restarted mid-run): keep the completed steps
+                record.update(status=QUEUED, error=None)
+                self.stats["resumed"] += 1
+            self._save(record)
+            # A fresh context: the job must not inherit the submitting turn's deadline or priority
+            self._futures[job_id] = contextvars.Context().run(self._submit, self._run(job_id))
+        return job_id
+
+    def active(self, job_id: str) -> bool:
+        """ True if the job is queued or running in this process (a stale "running" record may be interrupted). """
+        future = self._futures.get(job_id)
+        return future is not None and not future.done()
+
+    def cancel(self, job_id: str):
+        future = self._futures.get(job_id)
+        if future is not None and not future.done():
+            future.cancel()
+
+    async def _run_step(self, record: dict, step: Step, results: dict) -> bool:
+        started = time.time()
+        record["steps"][step.name] = {"status": RUNNING, "started_at": started}
+        self._save(record)
+        try:
+            result = await step.fn(record["params"], results)
+        except asyncio.CancelledError:
+            record["steps"][step.name] = {"status": FAILED, "error": "interrupted"}
+            self._save(record)
+            raise
+        except Exception as e:
+            logger.info("job %s: step %s failed: %s", record["id"], step.name, e)
+            record["steps"][step.name] = {"status": FAILED, "error": str(e),
+                                          "seconds": round(time.time() - started, 2)}
+            self._save(record)
+            return False
+
+        results[step.name] = result
+        record["steps"][step.name] = {"status": DONE, "result": result, "seconds": round(time.time() - started, 2)}
+        self.stats["steps_run"] += 1
+        self._save(record)
+        return True
+
+    async def _run_steps(self, record: dict, steps: list):
+        results = {name: step["result"] for name, step in record["steps"].items() if step["status"] == DONE}
+        self.stats["steps_reused"] += len(results)
+        settled = set(results)
+
+        pending = [step for step in steps if step.name not in results]
+        while pending:
+            ready = [step for step in pending if all(name in settled for name in step.requires)]
+            if not ready:
+                raise RuntimeError(f"steps {[step.name for step in pending]} have unmet requirements")
+
+            outcomes = await asyncio.gather(*(self._run_step(record, step, results) for step in ready))
+            failed = [step.name for step, ok in zip(ready, outcomes) if not ok and not step.optional]
+            if failed:
+                raise RuntimeError(f"step {', '.join(failed)} failed")
+
+            for step in ready:
+                results.setdefault(step.name, None)
+                settled.add(step.name)
+            pending = [step for step in pending if step not in ready]
+        return results[steps[-1].name]
+
+    async def _run(self, job_id: str):
+        async with self._semaphore():
+            record = self.get(job_id)
+            record.update(status=RUNNING, attempts=record.get("attempts", 0) + 1)
+            self._save(record)
+
+            try:
+                with upstream.deadline(time.time() + self.deadline):
+                    record["result"] = await asyncio.wait_for(self._run_steps(record, self.kinds[record["kind"]]),
+                                                              self.deadline)
+                record["status"] = DONE
+                self.stats["done"] += 1
+            except asyncio.TimeoutError:
+                record.update(status=FAILED, error=f"did not finish within {self.deadline:.0f}s; retry to resume")
+                self.stats["failed"] += 1
+            except asyncio.CancelledError:
+                record.update(status=FAILED, error="cancelled")
+                self._save(record)
+                raise
+            except Exception as e:
+                record.update(status=FAILED, error=str(e))
+                self.stats["failed"] += 1
+            self._save(record)
+            logger.info("job %s %s after attempt %d", job_id, record["status"], record["attempts"])
+
+    def subscribe(self, job_id: str, timeout: float = None):
+        """
+        Yield the job record each time it changes, until it is done or failed (or timeout passes).
+        Blocking: call from the UI or tool threads, never from the backend loop running the job.
+        """
+        until = None if timeout is None else time.monotonic() + timeout
+        seen = None
+        while True:
+            record = self.get(job_id)
+            if record is None:
+                return
+            if record["updated_at"] != seen:
+                seen = record["updated_at"]
+                yield record
+            if record["status"] in (DONE, FAILED):
+                return
+
+            left = None if until is None else until - time.monotonic()
+            if left is not None and left <= 0:
+                return
+            with self._changed:
+                self._changed.wait(POLL_INTERVAL if left is None else min(POLL_INTERVAL, left))
+
+    def wait(self, job_id: str, timeout: float = None):
+        """ Block until the job finishes or timeout passes; return its latest record. """
+        record = None
+        for record in self.subscribe(job_id, timeout):
+            pass
+        return record
+
+    def run(self, kind: str, params: dict, timeout: float = None):
+        """ Submit and wait; the returned record may still be running if timeout passed first. """
+        return self.wait(self.submit(kind, params), timeout)
@@ -0,0 +1,111 @@
+import json, os, sqlite3, threading, time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# One SQLite file shared by every cache namespace (and every MCP server process).
+CACHE_DB_PATH = os.getenv("TRAVEL_CACHE_DB", os.path.join(BASE_DIR, "travel_cache.db"))
+
+_CONNECTIONS = {}
+_CONNECTIONS_LOCK = threading.Lock()
+
+def _connect(path: str):
+    """ Return a process-wide connection and lock for a cache file, creating the schema once. """
+    with _CONNECTIONS_LOCK:
+        if path not in _CONNECTIONS:
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv_cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, expires_at REAL, PRIMARY KEY (namespace, key))"
+            )
+            conn.commit()
+            _CONNECTIONS[path] = (conn, threading.Lock())
+        return _CONNECTIONS[path]
+
+class KVCache:
+    """ Persistent JSON key/value cache with per-entry TTL, namespaced inside one SQLite file. """
+
+    def __init__(self, namespace: str, path: str = None):
+        self.namespace = namespace
+        self.path = path or CACHE_DB_PATH
+        self._conn, self._lock = _connect(self.path)
+
+    def get_entry(self, key: str):
+        """ Return (value, stored_at, expires_at) including expired entries, or None. """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at, expires_at FROM kv_cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def get(self, key: str, default=None, allow_stale: bool = False):
+        """ Return the cached value, or default if missing (or expired unless allow_stale). """
+        entry = self.get_entry(key)
+        if entry is None:
+            return default
+
+        value, _, expires_at = entry
+        if expires_at is not None and expires_at < time.time() and not allow_stale:
+            return default
+        return value
+
+    def set(self, key: str, value, ttl: float = None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv_cache (namespace, key, value, stored_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), now, now + ttl if ttl is not None else None)
+            )
+            self._conn.commit()
+
+    def incr(self, key: str, amount: float = 1, ttl: float = None):
+        """ Atomically add to a numeric entry (missing or expired counts as 0), across processes; returns the new value. """
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes SQLite's write lock up front, so concurrent processes cannot interleave
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM kv_cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+                ).fetchone()
+
+                live = row is not None and (row[1] is None or row[1] >= now)
+                value = (json.loads(row[0]) if live else 0) + amount
+                expires_at = row[1] if live else (now + ttl if ttl is not None else None)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO kv_cache (namespace, key, value, stored_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value), now, expires_at)
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return value
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv_cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+            self._conn.commit()
+
+    def items(self):
+        """ Return all (key, value) pairs of this namespace that have not expired. """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM kv_cache WHERE namespace = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                (self.namespace, time.time())
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM kv_cache WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at < ?",
+                (self.namespace, time.time())
+            )
+            self._conn.commit()
+        return cursor.rowcount
@@ -0,0 +1,250 @@
+import asyncio, logging, os, re, threading, time
+from typing import Any, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+logger = logging.getLogger("travel_planner_chatbot")
+
+# Set LLM_BACKEND=fake to run every model call against the deterministic local backend.
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+
+# Cheapest adequate model first; later entries are fallbacks. Override with LLM_MODELS_<TASK>="a,b".
+TASK_MODELS = {
+    "routing": ["gpt-4o-mini", "gpt-3.5-turbo"],      # tool-calling decisions, small talk, trivial math
+    "composition": ["gpt-4", "gpt-4o-mini"],          # final user-facing answers over tool results
+    "summarization": ["gpt-3.5-turbo", "gpt-4o-mini"] # MCP server overviews of upstream data
+}
+
+# Request-level deadline in seconds, covering every model in the fallback chain.
+TASK_DEADLINES = {
+    "routing": 30.0,
+    "composition": 60.0,
+    "summarization": 30.0
+}
+
+# USD per 1M tokens (input, output), used to report the cost of each call.
+MODEL_PRICING = {
+    "gpt-4": (30.0, 60.0),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-3.5-turbo": (0.5, 1.5),
+    "fake": (0.0, 0.0)
+}
+
+_USAGE = {}
+_USAGE_LOCK = threading.Lock()
+
+def task_models(task: str) -> List[str]:
+    override = os.getenv(f"LLM_MODELS_{task.upper()}")
+    if override:
+        return [name.strip() for name in override.split(",") if name.strip()]
+    return list(TASK_MODELS[task])
+
+def task_deadline(task: str) -> float:
+    return float(os.getenv(f"LLM_DEADLINE_{task.upper()}", TASK_DEADLINES[task]))
+
+def call_cost(model_name: str, input_tokens: int, output_tokens: int) -> float:
+    """ Estimated USD cost of one call; unknown models are priced as zero. """
+    price_in, price_out = MODEL_PRICING.get(model_name, (0.0, 0.0))
+    return (input_tokens * price_in + output_tokens * price_out) / 1_000_000
+
+def _record(task: str, model_name: str, latency: float, response=None, failed: bool = False):
+    usage = getattr(response, "usage_metadata", None) or {}
+    input_tokens, output_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    cost = call_cost(model_name, input_tokens, output_tokens)
+
+    with _USAGE_LOCK:
+        entry = _USAGE.setdefault((task, model_name), {
+            "calls": 0, "failures": 0, "latency_s": 0.0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0
+        })
+        entry["calls"] += 1
+        entry["failures"] += int(failed)
+        entry["latency_s"] += latency
+        entry["input_tokens"] += input_tokens
+        entry["output_tokens"] += output_tokens
+        entry["cost_usd"] += cost
+
+    if not failed:
+        logger.info("model router: task=%s model=%s %.2fs %d+%d tokens $%.5f",
+                    task, model_name, latency, input_tokens, output_tokens, cost)
+
+def usage_report() -> dict:
+    """ Return accumulated latency/token/cost totals keyed by "task/model". """
+    with _USAGE_LOCK:
+        return {f"{task}/{model}": dict(entry) for (task, model), entry in _USAGE.items()}
+
+def reset_usage():
+    with _USAGE_LOCK:
+        _USAGE.clear()
+
+def _served_by(response, default: str) -> str:
+    metadata = getattr(response, "response_metadata", None) or {}
+    name = metadata.get("model_name") or default
+    # OpenAI returns dated snapshots (gpt-4o-mini-2024-07-18); price them as the base model
+    return re.sub(r"-\d{4}-\d{2}-\d{2}$", "", name)
+
+class FakeChatModel(BaseChatModel):
+    """ Deterministic offline chat model for tests and benchmarks; supports tool calling. """
+
+    model_name: str = "fake"
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-travel"
+
+    def bind_tools(self, tools, tool_choice: Optional[str] = None, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def _respond(self, messages: List[BaseMessage], tools: Optional[list]) -> AIMessage:
+        last = messages[-1] if messages else HumanMessage(content="")
+        text = last.content if isinstance(last.content, str) else str(last.content)
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4 + 1
+
+        call = _fake_tool_call(text, tools) if tools and isinstance(last, HumanMessage) else None
+        if call:
+            content = ""
+        elif isinstance(last, ToolMessage):
+            content = f"Based on {last.name or 'the tool'}: {text[:200]}"
+        else:
+            content = f"Fake response to: {text[:200]}"
+
+        return AIMessage(
+            content=content,
+            tool_calls=[call] if call else [],
+            usage_metadata={"input_tokens": prompt_tokens, "output_tokens": len(content) // 4 + 1,
+                            "total_tokens": prompt_tokens + len(content) // 4 + 1},
+            response_metadata={"model_name": self.model_name}
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, tools=None, **kwargs) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, tools))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, tools=None, **kwargs) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, tools))])
+
+_WORD_RE = re.compile(r"[a-z]+")
+_PLACE_RE = re.compile(r"\b(?:in|to|for|at|from)\s+([A-Z][a-zA-Z]+(?:\s[A-Z][a-zA-Z]+)?)")
+
+def _fake_tool_call(text: str, tools: list) -> Optional[dict]:
+    """ Pick the tool whose name best overlaps the user text and fill its required arguments. """
+    words = set(_WORD_RE.findall(text.lower()))
+    best, best_score = None, 0
+
+    for spec in tools:
+        function = spec.get("function", {})
+        score = len(words & set(function.get("name", "").split("_")))
+        if score > best_score:
+            best, best_score = function, score
+
+    if not best:
+        return None
+
+    place = _PLACE_RE.search(text)
+    place = place.group(1) if place else "Paris"
+    parameters = best.get("parameters", {})
+    args = {}
+
+    for name in parameters.get("required", []):
+        kind = parameters.get("properties", {}).get(name, {}).get("type")
+        if kind == "integer":
+            args[name] = 1
+        elif kind == "number":
+            args[name] = 1.0
+        elif kind == "boolean":
+            args[name] = False
+        elif kind == "array":
+            args[name] = [place]
+        elif name.endswith("date"):
+            args[name] = "2026-12-01"
+        else:
+            args[name] = place
+
+    return {"name": best["name"], "args": args, "id": f"call_{best['name']}", "type": "tool_call"}
+
+def make_chat_model(model_name: str, temperature: float = 0.0, timeout: Optional[float] = None,
+                    api_key: Optional[str] = None) -> BaseChatModel:
+    """ Build a single chat model for the configured backend. """
+    if LLM_BACKEND == "fake":
+        return FakeChatModel(model_name=model_name, latency=float(os.getenv("FAKE_LLM_LATENCY", "0")))
+
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model=model_name, temperature=temperature, api_key=api_key or os.getenv("OPENAI_API_KEY"),
+                      timeout=timeout, max_retries=1)
+
+class ModelChain:
+    """ A task's models as a fallback chain with a request-level deadline and usage accounting. """
+
+    def __init__(self, task: str, models: List[BaseChatModel], runnables=None, deadline: Optional[float] = None):
+        self.task = task
+        self.models = models
+        self.model_name = getattr(models[0], "model_name", None) or "unknown"
+        self.deadline = deadline if deadline is not None else task_deadline(task)
+        # One runnable per model (tool-bound or not); the sync path walks them itself to split the deadline
+        self.runnables = runnables if runnables is not None else list(models)
+        self.runnable = self._chain(self.runnables)
+
+    @staticmethod
+    def _chain(runnables):
+        primary, *fallbacks = runnables
+        return primary.with_fallbacks(fallbacks) if fallbacks else primary
+
+    def bind_tools(self, tools, **kwargs) -> "ModelChain":
+        """ Bind tools on every model of the chain, keeping fallbacks and the deadline. """
+        bound = [model.bind_tools(tools, **kwargs) for model in self.models]
+        return ModelChain(self.task, self.models, runnables=bound, deadline=self.deadline)
+
+    def _invoke_within_deadline(self, input: Any, config=None, **kwargs):
+        """ Try each model in turn, giving it the time left before the chain's deadline as its timeout. """
+        until = time.monotonic() + self.deadline
+        error = None
+        for runnable in self.runnables:
+            left = until - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                return runnable.invoke(input, config=config, **{**kwargs, "timeout": left})
+            except Exception as e:
+                logger.info("model chain %s: %s failed (%s), trying the next model", self.task,
+                            getattr(runnable, "model_name", None) or type(runnable).__name__, type(e).__name__)
+                error = e
+        if error is None or time.monotonic() >= until:
+            raise TimeoutError(f"{self.task} models did not answer within {self.deadline:g}s") from error
+        raise error
+
+    def invoke(self, input: Any, config=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self._invoke_within_deadline(input, config=config, **kwargs)
+        except Exception:
+            _record(self.task, self.model_name, time.perf_counter() - started, failed=True)
+            raise
+        _record(self.task, _served_by(response, self.model_name), time.perf_counter() - started, response)
+        return response
+
+    async def ainvoke(self, input: Any, config=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(self.runnable.ainvoke(input, config=config, **kwargs), self.deadline)
+        except Exception:
+            _record(self.task, self.model_name, time.perf_counter() - started, failed=True)
+            raise
+        _record(self.task, _served_by(response, self.model_name), time.perf_counter() - started, response)
+        return response
+
+_CHAINS = {}
+
+def get_model(task: str, temperature: float = 0.0, api_key: Optional[str] = None) -> ModelChain:
+    """ Return the (cached) model chain for a task: "routing", "composition" or "summarization". """
+    key = (task, temperature)
+    if key not in _CHAINS:
+        deadline = task_deadline(task)
+        models = [make_chat_model(name, temperature, timeout=deadline, api_key=api_key) for name in task_models(task)]
+        _CHAINS[key] = ModelChain(task, models, deadline=deadline)
+    return _CHAINS[key]
@@ -1,7 +1,11 @@
 from fastmcp import FastMCP
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-import os, requests
+from model_router import get_model
+from singleflight import coalesce
+from kv_cache import KVCache
+from prompt_builder import PromptTemplate
+from geo_index import GeoIndex, cluster_by_day, route_length_km
+import os, re, time, upstream
 import streamlit as st
 
 load_dotenv()
@@ -26,11 +30,57 @@ if not FOURSQUARE_API_KEY:
 
 mcp = FastMCP("places")
 
-# Initialize the LLM
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.5, api_key=OPENAI_API_KEY)
+# Initialize the summarization LLM (cheapest adequate tier, with fallbacks)
+llm = get_model("summarization", temperature=0.5, api_key=OPENAI_API_KEY)
 
+# Foursquare categories: Arts & Entertainment (10000, incl. museums 10027, galleries, theatres),
+# Landmarks & Outdoors (16000: monuments, historic sites, parks) and Spiritual Centers (12098: churches, temples)
+TOURISM_CATEGORIES = "10000,16000,12098"
+
+# Foursquare returns at most 50 places per page; fetch the maximum so few calls fill an area
+UPSTREAM_PAGE_SIZE = 50
+
+# Pages followed per area; dense city centres hold more attractions than fit in one page
+AREA_MAX_PAGES = 3
+
+# An area still truncated after AREA_MAX_PAGES is answered from the index only this long (seconds)
+# before it is fetched again, rather than trusted as complete for the full POI_TTL
+PARTIAL_AREA_TTL = 3600
+
+GEOCODE_TTL = 30 * 24 * 3600
+POI_TTL = 7 * 24 * 3600
+
+# Geocodes and POIs are persisted; the spatial index is rebuilt from them on startup
+geocode_cache = KVCache("openweather.geocode")
+poi_cache = KVCache("places.pois")
+area_cache = KVCache("places.areas")
+places_index = GeoIndex()
+
+def load_places_index():
+    """ Rebuild the in-memory spatial index from persisted POIs and searched areas. """
+    for _, poi in poi_cache.items():
+        places_index.add(poi)
+    for _, area in area_cache.items():
+        # [lat, lon, radius_km] or [lat, lon, radius_km, expires_at] for a truncated area
+        places_index.mark_covered(*area)
+
+load_places_index()
+
+_LAT_LON_RE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$")
+
+@coalesce("places.geocode")
 def get_geographical_coordinates(location: str):
     """ Get the geographical coordinates (latitude and longitude) for a given location using the OpenWeatherMap Geocoding API. """
+    # "48.85,2.35" style input is already a coordinate
+    match = _LAT_LON_RE.match(location)
+    if match:
+        return float(match.group(1)), float(match.group(2))
+    
+    key = " ".join(location.split()).casefold()
+    cached = geocode_cache.get(key)
+    if cached:
+        return cached[0], cached[1]
+    
     url = "https://api.openweathermap.org/geo/1.0/direct"
     
     params = {
@@ -39,81 +89,194 @@ def get_geographical_coordinates(location: str):
         "appid": OPENWEATHER_API_KEY
     }
     
-    response = requests.get(url, params=params)
+    try:
+        response = upstream.get(url, hedge=True, params=params)
+    except upstream.UpstreamUnavailable:
+        stale = geocode_cache.get(key, allow_stale=True)
+        if stale:
+            return stale[0], stale[1]
+        raise
+    
     data = response.json()
     
     if not data:
         raise ValueError("Location not found")
     
+    geocode_cache.set(key, [data[0]["lat"], data[0]["lon"]], ttl=GEOCODE_TTL)
     return data[0]["lat"], data[0]["lon"]
 
+def to_poi(place: dict):
+    """ Convert a Foursquare place into the compact POI record kept in the spatial index. """
+    geocode = place.get("geocodes", {}).get("main", {})
+    
+    return {
+        "id": place.get("fsq_place_id") or place.get("fsq_id") or place.get("name"),
+        "name": place.get("name"),
+        "lat": place.get("latitude", geocode.get("latitude")),
+        "lon": place.get("longitude", geocode.get("longitude")),
+        "categories": [c.get("name") for c in place.get("categories", [])],
+        "address": place.get("location", {}).get("formatted_address"),
+        "rating": place.get("rating"),
+        "description": place.get("description")
+    }
 
-def simplify_places(places: list, limit: int = 5):
-    """ Extract relevant information from the places data fetched from the Foursquare API. """
-    simplified = []
+def simplify_places(matches: list):
+    """ Turn (distance_km, poi) pairs from the spatial index into compact results. """
+    return [{
+        "name": poi["name"],
+        "distance_m": round(distance * 1000),
+        "categories": poi["categories"],
+        "address": poi["address"],
+        "rating": poi["rating"],
+        "description": poi["description"],
+        "lat": poi["lat"],
+        "lon": poi["lon"]
+    } for distance, poi in matches]
 
-    for p in places[:limit]:
-        simplified.append({
-            "name": p.get("name"),
-            "distance_m": p.get("distance"),
-            "categories": [c.get("name") for c in p.get("categories", [])],
-            "address": p.get("location", {}).get("formatted_address"),
-            "rating": p.get("rating"),
-            "description": p.get("description"),
-        })
+@coalesce("places.ensure_area")
+def ensure_area(latitude: float, longitude: float, radius_km: float, sort: str = "POPULARITY"):
+    """ Make sure the spatial index holds the POIs around a point, fetching from Foursquare only on a miss. """
+    if places_index.covers(latitude, longitude, radius_km):
+        return
+    
+    url = "https://places-api.foursquare.com/places/search"
 
-    return simplified
+    headers = {
+        "accept": "application/json",
+        "X-Places-Api-Version": "2025-06-17",
+        "authorization": "Bearer " + str(FOURSQUARE_API_KEY)
+    }
+        
+    query_params = {
+        "limit": UPSTREAM_PAGE_SIZE,
+        "sort": sort,
+        "radius": min(100000, int(radius_km * 1000)),
+        "ll": str(latitude) + "," + str(longitude),
+        "categories": TOURISM_CATEGORIES
+    }
 
-def get_tourism_recommendations(location: str, places_data: list):
-    """ Generate tourism place recommendations using the LLM. """
+    complete = False
+    for _ in range(AREA_MAX_PAGES):
+        try:
+            response = upstream.get(url, headers=headers, params=query_params)
+            results = upstream.json_body(response, require="results")["results"]
+        except upstream.UpstreamUnavailable:
+            # Out of budget, provider down or an error response: answer from what the index already holds;
+            # the area stays uncovered
+            return
 
-    prompt = f"""
-        You are a professional travel assistant. The user is planning a trip and needs a 
-        clear, helpful list of top tourist places to visit.
+        for place in results:
+            poi = to_poi(place)
+            if poi["lat"] is not None and poi["lon"] is not None:
+                places_index.add(poi)
+                poi_cache.set(poi["id"], poi, ttl=POI_TTL)
 
-        Here is the raw places data:
-        {places_data}
+        # A short page, or no cursor to a next one, means the search returned every match
+        next_page = response.links.get("next", {}).get("url")
+        if len(results) < UPSTREAM_PAGE_SIZE or not next_page:
+            complete = True
+            break
+        url, query_params = next_page, None
 
-        Produce a concise list that:
-        - Starts with a short introduction about tourism in {location}
-        - Lists the top places to visit with brief descriptions
-        - Highlights unique features or must-see aspects of each place
-        - Suggests the best time to visit each place if relevant
-        - Stays friendly, clear, and non-technical
-        - Avoids repeating raw data
-        - Avoids unnecessary details
+    key = f"{latitude:.5f},{longitude:.5f},{radius_km}"
+    if complete:
+        places_index.mark_covered(latitude, longitude, radius_km)
+        area_cache.set(key, [latitude, longitude, radius_km], ttl=POI_TTL)
+    else:
+        expires_at = time.time() + PARTIAL_AREA_TTL
+        places_index.mark_covered(latitude, longitude, radius_km, expires_at)
+        area_cache.set(key, [latitude, longitude, radius_km, expires_at], ttl=PARTIAL_AREA_TTL)
 
-        Keep it short, helpful, and actionable for a traveler.
+TOURISM_RECOMMENDATION_PROMPT = PromptTemplate(
+    "tourism_recommendation",
     """
+    You are a professional travel assistant. The user is planning a trip and needs a
+    clear, helpful list of top tourist places to visit.
+
+    Using the places table below (best first, "-" means unknown), produce a concise list that:
+    - Starts with a short introduction about tourism in the destination
+    - Lists the top places to visit with brief descriptions
+    - Highlights unique features or must-see aspects of each place
+    - Suggests the best time to visit each place if relevant
+    - Stays friendly, clear, and non-technical
+    - Avoids repeating raw data
+    - Avoids unnecessary details
 
+    Keep it short, helpful, and actionable for a traveler.
+    """,
+    fields=["name", "categories", "rating", "distance_m", "description"],
+    max_tokens=1200
+)
+
+def get_tourism_recommendations(location: str, places_data: list, raw=None):
+    """ Generate tourism place recommendations using the LLM; raw is the indexed POIs (parsed from the API) the rows were made from. """
+    prompt = TOURISM_RECOMMENDATION_PROMPT.render(places_data, context=f"Destination: {location}", raw=raw)
     response = llm.invoke(prompt)
     return response.content
     
 @mcp.tool()
+@upstream.with_budget
+@coalesce("places.search_tourism_destinations")
 def search_tourism_destinations(location: str, radius: int = 1000, sort: str = "POPULARITY", limit: int = 10):
     """ Search for top tourism destinations using the Foursquare Places API and return recommendations. """
     latitude, longitude = get_geographical_coordinates(location)
-    url = "https://places-api.foursquare.com/places/search"
-
-    headers = {
-        "accept": "application/json",
-        "X-Places-Api-Version": "2025-06-17",
-        "authorization": "Bearer " + str(FOURSQUARE_API_KEY)
-    }
+    ensure_area(latitude, longitude, radius / 1000, sort)
+    
+    if sort.upper() == "DISTANCE":
+        matches = places_index.within(latitude, longitude, radius / 1000)[:limit]
+    else:
+        matches = places_index.top_rated(latitude, longitude, radius / 1000, limit)
         
-    query_params = {
-        "limit": limit,
-        "sort": sort,
-        "radius": radius,
-        "ll": str(latitude) + "," + str(longitude),
-        "categories": "16000,13065,13032"
+    tourism_places = simplify_places(matches)
+    tourism_suggestions = get_tourism_recommendations(location, tourism_places, raw=[poi for _, poi in matches])
+    return tourism_suggestions
+
+@mcp.tool()
+@upstream.with_budget
+def find_nearby_attractions(location: str, radius_km: float = 2.0, top_k: int = 10, category: str = None):
+    """ Return the top-rated attractions within radius_km of a location (city name or "lat,lon"), optionally filtered by category (e.g. "museum", "park"). Structured data, no summary; repeated queries in the same area are answered locally. """
+    latitude, longitude = get_geographical_coordinates(location)
+    ensure_area(latitude, longitude, radius_km)
+    matches = places_index.top_rated(latitude, longitude, radius_km, top_k, category)
+    return {"location": location, "radius_km": radius_km, "num_results": len(matches), "places": simplify_places(matches)}
+
+@mcp.tool()
+@upstream.with_budget
+def find_nearest_places(location: str, category: str, n: int = 5, max_km: float = 10.0):
+    """ Return the n places of a category (e.g. "museum", "church", "park") nearest to a location (city name or "lat,lon"). """
+    latitude, longitude = get_geographical_coordinates(location)
+    ensure_area(latitude, longitude, max_km)
+    matches = places_index.nearest(latitude, longitude, n, category, max_km=max_km)
+    return {"location": location, "category": category, "num_results": len(matches), "places": simplify_places(matches)}
+
+@mcp.tool()
+@upstream.with_budget
+def plan_walkable_days(location: str, days: int = 3, radius_km: float = 3.0, places_per_day: int = 4):
+    """ Group the best attractions around a location into walkable daily sets, each in walking order. """
+    latitude, longitude = get_geographical_coordinates(location)
+    ensure_area(latitude, longitude, radius_km)
+    
+    matches = places_index.top_rated(latitude, longitude, radius_km, days * places_per_day)
+    clusters = cluster_by_day([poi for _, poi in matches], days)
+    
+    return {
+        "location": location,
+        "days": [{
+            "day": i + 1,
+            "walk_km": round(route_length_km(cluster), 2),
+            "places": [{"name": p["name"], "categories": p["categories"], "rating": p["rating"],
+                        "lat": p["lat"], "lon": p["lon"]} for p in cluster]
+        } for i, cluster in enumerate(clusters)]
     }
 
-    response = requests.get(url, headers=headers, params=query_params)
-    tourism_places = response.json().get("results", [])
-    tourism_places = simplify_places(tourism_places, limit=limit)
-    tourism_suggestions = get_tourism_recommendations(location, tourism_places)
-    return tourism_suggestions
+@mcp.tool()
+@upstream.with_budget
+def prefetch_area(location: str, radius_km: float = 2.0):
+    """ Internal: warm the geocode cache and spatial index around a location at prefetch priority. Not exposed to the agent. """
+    with upstream.priority(upstream.PREFETCH):
+        latitude, longitude = get_geographical_coordinates(location)
+        ensure_area(latitude, longitude, radius_km)
+        return {"location": location, "indexed": len(places_index)}
 
 if __name__ == "__main__":
     mcp.run()
\ No newline at end of file
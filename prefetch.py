@@ -0,0 +1,134 @@
+import asyncio, logging, re, time
+from datetime import date
+
+logger = logging.getLogger("travel_planner_chatbot")
+
+# Upper bounds that keep speculative work from competing with interactive turns
+PREFETCH_CONCURRENCY = 2      # warmers running at once, across all threads
+PREFETCH_MAX_THREADS = 4      # threads with an active prefetch; beyond this we are under load and skip
+PREFETCH_TIMEOUT = 20.0       # seconds before a prefetch is abandoned
+MAX_DESTINATIONS = 2
+
+# Forecasts only reach this far ahead, so trips starting later skip weather warming
+FORECAST_HORIZON_DAYS = 5
+
+_DESTINATION_RE = re.compile(
+    r"\b(?:in|to|at|visit|visiting|around|near|from|for)\s+((?:[A-Z][\w'’.-]+)(?:\s+(?:de|del|la|le|[A-Z][\w'’.-]+)){0,3})"
+)
+_ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+
+_NOT_PLACES = {"i", "the", "a", "my", "me", "we", "us", "monday", "tuesday", "wednesday", "thursday", "friday",
+               "saturday", "sunday", "january", "february", "march", "april", "may", "june", "july", "august",
+               "september", "october", "november", "december", "christmas", "easter", "usd", "eur", "gbp"}
+
+def extract_entities(text: str, known_places=()) -> dict:
+    """
+    Cheap, model-free extraction of trip entities from a user message.
+    Destinations come from capitalized phrases after a preposition ("a week in New York") and from
+    places seen before in any casing; dates are ISO (YYYY-MM-DD).
+    """
+    destinations = []
+    for match in _DESTINATION_RE.finditer(text or ""):
+        words = match.group(1).rstrip(".").split()
+        while words and words[-1].casefold() in _NOT_PLACES:
+            words.pop()
+        if words and words[0].casefold() not in _NOT_PLACES:
+            destinations.append(" ".join(words))
+
+    lowered = " " + " ".join(re.sub(r"[^\w\s'’-]", " ", (text or "").casefold()).split()) + " "
+    for place in known_places:
+        if f" {place} " in lowered and place.casefold() not in (d.casefold() for d in destinations):
+            destinations.append(place)
+
+    dates = []
+    for year, month, day in _ISO_DATE_RE.findall(text or ""):
+        try:
+            dates.append(date(int(year), int(month), int(day)))
+        except ValueError:
+            continue
+
+    unique = list(dict.fromkeys(destinations))
+    return {"destinations": unique[:MAX_DESTINATIONS], "dates": sorted(dates)}
+
+def within_forecast_horizon(dates: list, today: date = None) -> bool:
+    """ True if the trip has no known dates or starts early enough for a forecast to exist. """
+    if not dates:
+        return True
+    today = today or date.today()
+    return (dates[0] - today).days <= FORECAST_HORIZON_DAYS
+
+class Prefetcher:
+    """
+    Fires low-priority cache-warming work for the entities in a user message while the model
+    is still deciding which tools to call.
+
+    warmers maps a name to an async callable taking (destination, entities); each warms one cache
+    (geocoding, weather, places, hotels). Work is bounded by a shared semaphore, a per-thread task
+    (a new message cancels the previous prefetch of that thread), a cap on concurrently
+    prefetching threads and an overall timeout. Failures are logged and otherwise ignored.
+    """
+
+    def __init__(self, warmers: dict, concurrency: int = PREFETCH_CONCURRENCY,
+                 max_threads: int = PREFETCH_MAX_THREADS, timeout: float = PREFETCH_TIMEOUT):
+        self.warmers = warmers
+        self.max_threads = max_threads
+        self.timeout = timeout
+        self._concurrency = concurrency
+        self._semaphores = {}
+        self._tasks = {}
+        self.stats = {"scheduled": 0, "skipped_load": 0, "cancelled": 0, "warmed": 0, "failed": 0}
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self._concurrency)
+        return self._semaphores[loop]
+
+    def schedule(self, thread_id: str, entities: dict):
+        """ Start warming for a thread (call from the event loop); returns the task or None if skipped. """
+        if not entities.get("destinations"):
+            return None
+
+        self.cancel(thread_id)
+        if len(self._tasks) >= self.max_threads:
+            self.stats["skipped_load"] += 1
+            logger.info("prefetch skipped under load (%d threads prefetching)", len(self._tasks))
+            return None
+
+        task = asyncio.ensure_future(self._run(entities))
+        self._tasks[thread_id] = task
+        task.add_done_callback(lambda t: self._tasks.pop(thread_id, None) if self._tasks.get(thread_id) is t else None)
+        self.stats["scheduled"] += 1
+        return task
+
+    def cancel(self, thread_id: str = None):
+        """ Cancel the prefetch of one thread, or of every thread when thread_id is None. """
+        if thread_id is None:
+            tasks, self._tasks = list(self._tasks.values()), {}
+        else:
+            tasks = [self._tasks.pop(thread_id, None)]
+        for task in tasks:
+            if task is not None and not task.done():
+                task.cancel()
+                self.stats["cancelled"] += 1
+
+    async def _warm(self, name: str, warmer, destination: str, entities: dict):
+        async with self._semaphore():
+            started = time.perf_counter()
+            try:
+                await warmer(destination, entities)
+                self.stats["warmed"] += 1
+                logger.info("prefetch %s(%s) warmed in %.2fs", name, destination, time.perf_counter() - started)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.info("prefetch %s(%s) failed: %s", name, destination, e)
+
+    async def _run(self, entities: dict):
+        jobs = [self._warm(name, warmer, destination, entities)
+                for destination in entities["destinations"] for name, warmer in self.warmers.items()]
+        try:
+            await asyncio.wait_for(asyncio.gather(*jobs), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            logger.info("prefetch timed out after %.0fs for %s", self.timeout, entities["destinations"])
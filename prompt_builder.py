@@ -0,0 +1,109 @@
+import logging, textwrap, threading
+
+logger = logging.getLogger("travel_planner_chatbot")
+
+# Encoding of the OpenAI chat models we route to; without tiktoken we fall back to ~4 chars per token
+TOKEN_ENCODING = "cl100k_base"
+
+DEFAULT_PROMPT_BUDGET = 1500
+MAX_CELL_CHARS = 160
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+_STATS = {}
+_STATS_LOCK = threading.Lock()
+
+def _get_encoder():
+    """ Load the tiktoken encoder once; False when tiktoken (or its encoding file) is unavailable. """
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                try:
+                    import tiktoken
+                    _encoder = tiktoken.get_encoding(TOKEN_ENCODING)
+                except Exception:
+                    _encoder = False
+    return _encoder
+
+def count_tokens(text: str) -> int:
+    """ Token count of a prompt fragment: exact with tiktoken, otherwise ~4 characters per token. """
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder:
+        return len(encoder.encode(text))
+    return max(1, len(text) // 4)
+
+def format_cell(value, max_chars: int = MAX_CELL_CHARS) -> str:
+    """ Render one value for a table cell: lists joined, floats trimmed, separators and newlines removed. """
+    if value is None or value == "":
+        return "-"
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    if isinstance(value, float):
+        return f"{value:g}"
+    if isinstance(value, (list, tuple)):
+        value = ", ".join(str(v) for v in value if v not in (None, ""))
+
+    text = " ".join(str(value).replace("|", "/").split())
+    return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
+def to_table(rows: list, fields: list, max_cell_chars: int = MAX_CELL_CHARS) -> str:
+    """ Serialize dict rows as a terse pipe-separated table, keeping only the given fields (in order). """
+    lines = [" | ".join(fields)]
+    for row in rows:
+        lines.append(" | ".join(format_cell(row.get(field), max_cell_chars) for field in fields))
+    return "\n".join(lines)
+
+def prompt_stats() -> dict:
+    """ Per-template totals: calls, prompt tokens before (source data as passed to render) and after (compact, budgeted), rows dropped. """
+    with _STATS_LOCK:
+        return {name: dict(stats) for name, stats in _STATS.items()}
+
+class PromptTemplate:
+    """
+    A prompt with a static instruction prefix followed by dynamic data.
+
+    The prefix is dedented and token-counted once and always comes first, so repeated calls share
+    an identical leading segment that provider-side prompt caching can reuse. The data is rendered
+    as a compact table and trimmed from the end (lowest priority rows) to fit the token budget.
+    """
+
+    def __init__(self, name: str, instructions: str, fields: list, max_tokens: int = DEFAULT_PROMPT_BUDGET,
+                 max_cell_chars: int = MAX_CELL_CHARS):
+        self.name = name
+        self.prefix = textwrap.dedent(instructions).strip()
+        self.prefix_tokens = count_tokens(self.prefix)
+        self.fields = list(fields)
+        self.max_tokens = max_tokens
+        self.max_cell_chars = max_cell_chars
+
+    def render(self, rows: list, context: str = "", raw=None) -> str:
+        """ Build the prompt for `rows` (dicts, most important first); `raw` is the data the rows were made from. """
+        head = self.prefix + ("\n\n" + context.strip() if context else "") + "\n\nData:\n"
+        budget = self.max_tokens - count_tokens(head)
+
+        kept = list(rows)
+        table = to_table(kept, self.fields, self.max_cell_chars)
+        while kept and count_tokens(table) > budget:
+            # Shrink proportionally to the overshoot rather than one row at a time
+            overshoot = count_tokens(table) / max(1, budget)
+            kept = kept[:min(len(kept) - 1, int(len(kept) / overshoot))]
+            table = to_table(kept, self.fields, self.max_cell_chars)
+
+        prompt = head + table
+        before = self.prefix_tokens + count_tokens(context) + count_tokens(str(raw if raw is not None else rows))
+        after = count_tokens(prompt)
+        dropped = len(rows) - len(kept)
+
+        with _STATS_LOCK:
+            stats = _STATS.setdefault(self.name, {"calls": 0, "tokens_before": 0, "tokens_after": 0, "rows_dropped": 0})
+            stats["calls"] += 1
+            stats["tokens_before"] += before
+            stats["tokens_after"] += after
+            stats["rows_dropped"] += dropped
+
+        logger.info("prompt %s: %d -> %d tokens (%d of %d rows kept)", self.name, before, after, len(kept), len(rows))
+        return prompt
@@ -0,0 +1,144 @@
+import asyncio, concurrent.futures, functools, logging, threading
+import upstream
+
+logger = logging.getLogger("singleflight")
+
+_REGISTRY = {}
+_REGISTRY_LOCK = threading.Lock()
+
+def normalize(value):
+    """ Normalize an argument so equivalent calls ("Paris ", "paris") share one key. """
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [normalize(v) for v in value]
+        return tuple(sorted(items, key=repr)) if isinstance(value, (set, frozenset)) else tuple(items)
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), normalize(v)) for k, v in value.items()))
+    return value
+
+def make_key(*args, **kwargs) -> tuple:
+    return normalize(args), normalize(kwargs)
+
+def _retry_after(error: BaseException, leader_level: int) -> bool:
+    """
+    A caller that joined a less urgent leader (e.g. an interactive call joining a prefetch) re-runs
+    the call at its own priority when the leader was refused upstream: the prefetch's smaller wait
+    and quota share must not fail a call that would have been admitted.
+    """
+    return isinstance(error, upstream.UpstreamUnavailable) and leader_level > upstream.current_priority()
+
+class SingleFlight:
+    """ Collapses concurrent identical calls into one execution whose result is shared. """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.executed = 0
+        self.collapsed = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._ainflight = {}
+
+    def _count(self, leader: bool):
+        self.calls += 1
+        if leader:
+            self.executed += 1
+        else:
+            self.collapsed += 1
+            logger.info("singleflight %s: collapsed call (%d of %d collapsed so far)", self.name, self.collapsed, self.calls)
+
+    def do(self, key, fn, *args, **kwargs):
+        """ Run fn once per key across threads; concurrent callers wait for the leader's result. """
+        with self._lock:
+            future, level = self._inflight.get(key, (None, None))
+            leader = future is None or future.done()
+            if leader:
+                future, level = concurrent.futures.Future(), upstream.current_priority()
+                self._inflight[key] = (future, level)
+            self._count(leader)
+
+        if not leader:
+            try:
+                return future.result()
+            except upstream.UpstreamUnavailable as e:
+                if not _retry_after(e, level):
+                    raise
+                logger.info("singleflight %s: leader refused upstream (%s), retrying at own priority", self.name, e)
+                return self.do(key, fn, *args, **kwargs)
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(key, (None,))[0] is future:
+                    del self._inflight[key]
+
+    async def ado(self, key, fn, *args, **kwargs):
+        """ Async variant: concurrent callers on the same loop await one shared task. """
+        loop_key = (id(asyncio.get_running_loop()), key)
+
+        with self._lock:
+            task, level = self._ainflight.get(loop_key, (None, None))
+            leader = task is None or task.done()
+            if leader:
+                task, level = asyncio.ensure_future(fn(*args, **kwargs)), upstream.current_priority()
+                self._ainflight[loop_key] = (task, level)
+                task.add_done_callback(functools.partial(self._forget, loop_key))
+            self._count(leader)
+
+        # Shield so one cancelled caller does not cancel the shared call for everyone else
+        try:
+            return await asyncio.shield(task)
+        except upstream.UpstreamUnavailable as e:
+            if leader or not _retry_after(e, level):
+                raise
+            logger.info("singleflight %s: leader refused upstream (%s), retrying at own priority", self.name, e)
+            return await self.ado(key, fn, *args, **kwargs)
+
+    def _forget(self, loop_key, task):
+        with self._lock:
+            if self._ainflight.get(loop_key, (None,))[0] is task:
+                del self._ainflight[loop_key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "executed": self.executed, "collapsed": self.collapsed,
+                    "in_flight": len(self._inflight) + len(self._ainflight)}
+
+def get_group(name: str) -> SingleFlight:
+    with _REGISTRY_LOCK:
+        if name not in _REGISTRY:
+            _REGISTRY[name] = SingleFlight(name)
+        return _REGISTRY[name]
+
+def metrics() -> dict:
+    """ Return call/executed/collapsed counters for every single-flight group in this process. """
+    with _REGISTRY_LOCK:
+        groups = list(_REGISTRY.values())
+    return {group.name: group.stats() for group in groups}
+
+def coalesce(name: str = None):
+    """ Decorator: concurrent calls with the same normalized arguments share one in-flight execution. """
+    def decorator(fn):
+        group = get_group(name or fn.__qualname__)
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                return await group.ado(make_key(*args, **kwargs), fn, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return group.do(make_key(*args, **kwargs), fn, *args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,115 @@
+import time
+
+# Only tokens produced by this graph node are shown to the user. Nested LLM calls made
+# inside tools (e.g. build_itinerary) run under the "tools" node and are filtered out.
+STREAM_NODE = "chat_node"
+
+# A frame is flushed to the UI once it is this old or this large, whichever comes first.
+FRAME_INTERVAL = 0.05
+FRAME_MAX_CHARS = 256
+
+def chunk_text(chunk) -> str:
+    """ Return the plain text carried by a message chunk ("" for tool-call only chunks). """
+    content = getattr(chunk, "content", "")
+
+    if isinstance(content, str):
+        return content
+
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+    return ""
+
+def is_ai_chunk(chunk) -> bool:
+    """ True for AIMessage / AIMessageChunk without importing langchain. """
+    return getattr(chunk, "type", None) in ("ai", "AIMessageChunk")
+
+class FrameCoalescer:
+    """ Buffers streamed tokens and releases them as frames bounded by time and size. """
+
+    def __init__(self, interval: float = FRAME_INTERVAL, max_chars: int = FRAME_MAX_CHARS, clock=time.monotonic):
+        self.interval = interval
+        self.max_chars = max_chars
+        self.clock = clock
+        self._parts = []
+        self._size = 0
+        self._started = None
+
+    def push(self, text: str):
+        """ Add text to the current frame and return the frame if it is due, else None. """
+        if not text:
+            return None
+
+        if self._started is None:
+            self._started = self.clock()
+
+        self._parts.append(text)
+        self._size += len(text)
+
+        if self._size >= self.max_chars or self.clock() - self._started >= self.interval:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """ Return whatever is buffered (or None) and start a new frame. """
+        if not self._parts:
+            return None
+
+        frame = "".join(self._parts)
+        self._parts, self._size, self._started = [], 0, None
+        return frame
+
+def _tool_calls_of(update) -> list:
+    """ Return the tool names requested by the AI message in a chat_node update. """
+    if not isinstance(update, dict):
+        return []
+
+    names = []
+    for message in update.get("messages", []) or []:
+        for call in getattr(message, "tool_calls", None) or []:
+            names.append(call.get("name") or "tool")
+    return names
+
+async def pump_chat_stream(stream, emit, node: str = STREAM_NODE,
+                           interval: float = FRAME_INTERVAL, max_chars: int = FRAME_MAX_CHARS):
+    """
+    Consume chatbot.astream(..., stream_mode=["messages", "updates"]) and emit coalesced events.
+
+    emit() receives:
+      ("text", str)            a coalesced frame of user-facing AI tokens
+      ("tools_started", list)  chat_node asked for these tools
+      ("tools_finished", list) the tools node returned for these tools
+    Status events are only emitted on state transitions, never per token.
+    """
+    coalescer = FrameCoalescer(interval=interval, max_chars=max_chars)
+    running = []
+
+    async for mode, payload in stream:
+        if mode == "messages":
+            chunk, metadata = payload
+
+            if (metadata or {}).get("langgraph_node") != node or not is_ai_chunk(chunk):
+                continue
+
+            frame = coalescer.push(chunk_text(chunk))
+            if frame:
+                emit(("text", frame))
+
+        elif mode == "updates" and isinstance(payload, dict):
+            for node_name, update in payload.items():
+                if node_name == node:
+                    requested = _tool_calls_of(update)
+                    if requested and requested != running:
+                        frame = coalescer.flush()
+                        if frame:
+                            emit(("text", frame))
+                        running = requested
+                        emit(("tools_started", list(running)))
+
+                elif node_name == "tools" and running:
+                    emit(("tools_finished", list(running)))
+                    running = []
+
+    frame = coalescer.flush()
+    if frame:
+        emit(("text", frame))
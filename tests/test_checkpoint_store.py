@@ -0,0 +1,70 @@
+""" Dedup checkpoint format: save/load round trip through the async saver, with message writes kept off the loop.
+
+Run with:  python -m pytest tests
+"""
+import asyncio, os, sqlite3, sys, threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import aiosqlite
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.base import empty_checkpoint
+
+from checkpoint_store import DedupSerializer, DedupSqliteSaver, MessageStore, is_dedup_type
+
+MESSAGES = [
+    HumanMessage("Plan three days in Lisbon"),
+    AIMessage(content="", tool_calls=[{"name": "build_itinerary", "args": {"destination": "Lisbon", "days": 3}, "id": "call_1"}]),
+    ToolMessage(content='{"plan": "' + "Alfama, Belém, Sintra. " * 40 + '"}', tool_call_id="call_1"),
+    AIMessage(content="Day 1: Alfama ..."),
+]
+
+def config(checkpoint_id=None):
+    return {"configurable": {"thread_id": "t1", "checkpoint_ns": "", **({"checkpoint_id": checkpoint_id} if checkpoint_id else {})}}
+
+async def save_and_load(path):
+    async with aiosqlite.connect(path) as conn:
+        saver = DedupSqliteSaver(conn=conn, serde=DedupSerializer(path))
+        checkpoint = empty_checkpoint()
+        checkpoint["channel_values"] = {"messages": MESSAGES, "deadline": 1.5}
+        checkpoint["channel_versions"] = {"messages": 1, "deadline": 1}
+        saved = await saver.aput(config(), checkpoint, {"step": 1}, {"messages": 1, "deadline": 1})
+        await saver.aput_writes(saved, [("messages", [MESSAGES[-1]])], task_id="task_1")
+        return await saver.aget_tuple(config(saved["configurable"]["checkpoint_id"]))
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / "checkpoints.db")
+    loaded = asyncio.run(save_and_load(path))
+
+    assert loaded.checkpoint["channel_values"]["messages"] == MESSAGES
+    assert loaded.checkpoint["channel_values"]["deadline"] == 1.5
+    assert loaded.pending_writes == [("task_1", "messages", [MESSAGES[-1]])]
+
+    # Stored once by content, referenced from the checkpoint and the write
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT count(*) FROM checkpoint_messages").fetchone()[0] == len(MESSAGES)
+    assert all(is_dedup_type(type_) for (type_,) in conn.execute("SELECT type FROM checkpoints UNION ALL SELECT type FROM writes"))
+    conn.close()
+
+    # A fresh serializer (new process, empty cache) reads the same checkpoint
+    fresh = asyncio.run(save_and_load(path))
+    assert fresh.checkpoint["channel_values"]["messages"] == MESSAGES
+
+def test_message_writes_stay_off_the_event_loop(tmp_path, monkeypatch):
+    loop_threads, write_threads = set(), []
+    put_many = MessageStore.put_many
+
+    def recording_put_many(self, entries):
+        write_threads.append(threading.get_ident())
+        return put_many(self, entries)
+
+    monkeypatch.setattr(MessageStore, "put_many", recording_put_many)
+
+    async def run():
+        loop_threads.add(threading.get_ident())
+        return await save_and_load(str(tmp_path / "checkpoints.db"))
+
+    asyncio.run(run())
+    assert write_threads
+    assert not loop_threads & set(write_threads)
@@ -0,0 +1,59 @@
+""" Currency conversion outages reach the model as error results and are never memoized.
+
+Run with:  python -m pytest tests
+"""
+import asyncio, os, sys
+from typing import Annotated, TypedDict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from langchain_core.messages import AIMessage
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+from langgraph.prebuilt import ToolNode
+
+import currency, upstream
+from kv_cache import KVCache
+from tool_memo import make_memo_tool_node, merge_tool_memo
+
+class State(TypedDict):
+    messages: Annotated[list, add_messages]
+    tool_memo: Annotated[dict, merge_tool_memo]
+
+def run_exchange(amount: float):
+    graph = StateGraph(State)
+    graph.add_node("tools", make_memo_tool_node(ToolNode([currency.exchange_currency])))
+    graph.add_edge(START, "tools")
+    graph.add_edge("tools", END)
+
+    call = {"name": "exchange_currency", "args": {"from_currency": "EUR", "to_currency": "USD", "amount": amount},
+            "id": "call_1"}
+    return asyncio.run(graph.compile().ainvoke({"messages": [AIMessage(content="", tool_calls=[call])], "tool_memo": {}}))
+
+def test_outage_without_cached_rate_is_not_memoized(monkeypatch, tmp_path):
+    def unavailable(url, **kwargs):
+        raise upstream.QuotaExceeded("rapidapi", "monthly quota used")
+
+    monkeypatch.setattr(currency.upstream, "get", unavailable)
+    monkeypatch.setattr(currency, "exchange_rates", KVCache("currency.rates", str(tmp_path / "cache.db")))
+
+    output = run_exchange(100.0)
+    message = output["messages"][-1]
+    assert message.status == "error"
+    assert "temporarily unavailable" in message.content
+    assert output["tool_memo"] == {}
+
+def test_outage_with_cached_rate_answers_from_it(monkeypatch, tmp_path):
+    def unavailable(url, **kwargs):
+        raise upstream.QuotaExceeded("rapidapi", "monthly quota used")
+
+    rates = KVCache("currency.rates", str(tmp_path / "cache.db"))
+    rates.set("EUR:USD", 1.1, ttl=-1)
+    monkeypatch.setattr(currency.upstream, "get", unavailable)
+    monkeypatch.setattr(currency, "exchange_rates", rates)
+
+    output = run_exchange(100.0)
+    message = output["messages"][-1]
+    assert message.status == "success"
+    assert float(message.content) == 110.0
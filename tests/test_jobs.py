@@ -0,0 +1,98 @@
+""" Job-backed tools inside the chat graph's tool node: unfinished jobs must not fail the turn or be memoized.
+
+Run with:  python -m pytest tests
+"""
+import asyncio, os, sys, threading
+from typing import Annotated, TypedDict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.tools import tool
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+from langgraph.prebuilt import ToolNode
+
+from jobs import JobQueue, Step, job_tool_output
+from kv_cache import KVCache
+from tool_memo import make_memo_tool_node, merge_tool_memo
+
+class State(TypedDict):
+    messages: Annotated[list, add_messages]
+    tool_memo: Annotated[dict, merge_tool_memo]
+
+@pytest.fixture
+def backend_loop():
+    """ A loop on its own thread, standing in for the chatbot's async backend. """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+def make_tools_graph(backend_loop, tmp_path, release: threading.Event):
+    async def slow_plan(params, results):
+        while not release.is_set():
+            await asyncio.sleep(0.02)
+        return {"plan": f"{params['days']} days in {params['destination']}"}
+
+    queue = JobQueue({"itinerary": [Step("plan", slow_plan)]},
+                     submit=lambda coro: asyncio.run_coroutine_threadsafe(coro, backend_loop),
+                     store=KVCache("jobs", str(tmp_path / "cache.db")))
+
+    @tool
+    def build_itinerary(destination: str, days: int = 3):
+        """ Builds an itinerary. """
+        record = queue.run("itinerary", {"destination": destination, "days": days}, timeout=0.2)
+        return job_tool_output(record, "narrate")
+
+    build_itinerary.handle_tool_error = True
+    graph = StateGraph(State)
+    graph.add_node("tools", make_memo_tool_node(ToolNode([build_itinerary])))
+    graph.add_edge(START, "tools")
+    graph.add_edge("tools", END)
+    return graph.compile()
+
+def call_state(call_id: str):
+    call = {"name": "build_itinerary", "args": {"destination": "Lisbon", "days": 3}, "id": call_id}
+    return {"messages": [AIMessage(content="", tool_calls=[call])], "tool_memo": {}}
+
+def test_running_job_is_an_error_result_and_not_memoized(backend_loop, tmp_path):
+    release = threading.Event()
+    graph = make_tools_graph(backend_loop, tmp_path, release)
+
+    output = asyncio.run(graph.ainvoke(call_state("call_1")))
+    message = output["messages"][-1]
+    assert message.status == "error"
+    assert "still running" in message.content
+    assert output["tool_memo"] == {}
+
+    # Once the job finishes, asking again answers from it and the answer is memoized
+    release.set()
+    output = asyncio.run(graph.ainvoke(call_state("call_2")))
+    message = output["messages"][-1]
+    assert message.status == "success"
+    assert "3 days in Lisbon" in message.content
+    assert len(output["tool_memo"]) == 1
+
+def test_job_outlives_the_submitting_turns_deadline(backend_loop, tmp_path):
+    import time, upstream
+
+    async def check_budget(params, results):
+        return {"time_left": upstream.time_left(), "priority": upstream.current_priority()}
+
+    queue = JobQueue({"cost": [Step("check", check_budget)]},
+                     submit=lambda coro: asyncio.run_coroutine_threadsafe(coro, backend_loop),
+                     store=KVCache("jobs", str(tmp_path / "cache.db")))
+
+    # Submitted from a turn whose deadline has already passed, at prefetch priority
+    with upstream.deadline(time.time() - 1), upstream.priority(upstream.PREFETCH):
+        job_id = queue.submit("cost", {"destination": "Rome"})
+    record = queue.wait(job_id, timeout=5)
+
+    assert record["status"] == "done"
+    assert 0 < record["result"]["time_left"] <= queue.deadline
+    assert record["result"]["priority"] == upstream.INTERACTIVE
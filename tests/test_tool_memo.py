@@ -0,0 +1,42 @@
+""" Tool memo: failed tool calls, including errors reported as data, must not be replayed to later turns.
+
+Run with:  python -m pytest tests
+"""
+import asyncio, os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+from tool_memo import is_error_result, make_memo_tool_node
+
+class FakeToolNode:
+    """ Answers every call with a fixed content, like a ToolNode running one tool. """
+
+    def __init__(self, content):
+        self.content = content
+
+    async def ainvoke(self, state, config):
+        calls = state["messages"][-1].tool_calls
+        return {"messages": [ToolMessage(content=self.content, name=c["name"], tool_call_id=c["id"]) for c in calls]}
+
+def run_tools(content):
+    call = {"name": "search_flights", "args": {"origin": "LHR", "destination": "CDG"}, "id": "call_1"}
+    state = {"messages": [AIMessage(content="", tool_calls=[call])], "tool_memo": {}}
+    return asyncio.run(make_memo_tool_node(FakeToolNode(content))(state, {}))
+
+def test_error_payload_is_not_memoized():
+    output = run_tools('{"error": "amadeus: HTTP 503"}')
+    assert output["messages"][0].content == '{"error": "amadeus: HTTP 503"}'
+    assert output["tool_memo"] == {}
+
+def test_successful_result_is_memoized():
+    output = run_tools('{"flights": [{"price": 120}]}')
+    assert len(output["tool_memo"]) == 1
+
+def test_is_error_result():
+    assert is_error_result(ToolMessage(content="boom", tool_call_id="1", status="error"))
+    assert is_error_result(ToolMessage(content=[{"type": "text", "text": '{"error": "down"}'}], tool_call_id="1"))
+    assert not is_error_result(ToolMessage(content='["error"]', tool_call_id="1"))
+    assert not is_error_result(ToolMessage(content="Paris is sunny", tool_call_id="1"))
@@ -0,0 +1,52 @@
+""" Per-turn tool selection: dates are not arithmetic, and follow-ups keep the tools of recent turns.
+
+Run with:  python -m pytest tests
+"""
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.tools import tool
+
+from tool_router import ToolRouter, recent_tool_names
+
+@tool
+def search_hotels_filtered(location: str, checkin_date: str, checkout_date: str, num_adults: int):
+    """ Search hotels in a location, filtered and sorted by price. """
+
+@tool
+def get_weather_forecast(location: str):
+    """ Daily weather forecast for a location. """
+
+@tool
+def multiply(a: float, b: float) -> float:
+    """ Return the product of two numbers. """
+
+@tool
+def duckduckgo_search(query: str):
+    """ Search the web. """
+
+router = ToolRouter(llm=None, tools=[search_hotels_filtered, get_weather_forecast, multiply, duckduckgo_search])
+
+def test_dates_do_not_pull_in_math_tools():
+    assert "multiply" not in router.select("weather in Lisbon from 2025-06-01 to 06/05/2025")
+    assert "multiply" in router.select("what is 12 * 4")
+    assert "multiply" in router.select("how much is 300 / 3")
+
+def test_follow_up_keeps_tools_called_in_recent_turns():
+    call = {"name": "search_hotels_filtered", "args": {"location": "Lisbon"}, "id": "call_1"}
+    messages = [
+        HumanMessage("Find me a hotel in Lisbon from June 1 to June 4"),
+        AIMessage(content="", tool_calls=[call]),
+        ToolMessage(content="[]", tool_call_id="call_1"),
+        AIMessage(content="Here are three options."),
+        HumanMessage("And for four adults?"),
+    ]
+    assert recent_tool_names(messages) == {"search_hotels_filtered"}
+    assert "search_hotels_filtered" in router.select("And for four adults?", recent_tool_names(messages))
+
+    # Two turns later the hotel search has dropped out of reach again
+    messages += [AIMessage(content="Sure."), HumanMessage("Thanks"), AIMessage(content="You're welcome."), HumanMessage("Bye")]
+    assert recent_tool_names(messages) == set()
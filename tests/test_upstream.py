@@ -0,0 +1,79 @@
+""" Upstream admission: the turn budget sent to MCP tools, and rate limits reported by SDK calls.
+
+Run with:  python -m pytest tests
+"""
+import inspect, os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pytest
+import upstream
+from kv_cache import KVCache
+
+@upstream.with_budget
+def lookup(location: str, limit: int = 5):
+    return {"location": location, "limit": limit, "time_left": upstream.time_left()}
+
+def test_budget_argument_is_part_of_the_tool_signature():
+    parameters = inspect.signature(lookup).parameters
+    assert list(parameters) == ["location", "limit", upstream.BUDGET_ARG]
+    assert parameters[upstream.BUDGET_ARG].default is None
+
+def test_budget_bounds_the_call_and_is_not_passed_on():
+    result = lookup("Lisbon", **{upstream.BUDGET_ARG: 2.5})
+    assert result["location"] == "Lisbon" and result["limit"] == 5
+    assert 0 < result["time_left"] <= 2.5
+    assert upstream.time_left() is None
+
+def test_call_without_budget_has_no_deadline():
+    assert lookup("Lisbon")["time_left"] is None
+
+def test_exhausted_budget_stops_upstream_requests():
+    @upstream.with_budget
+    def fetch():
+        return upstream.get("https://api.openweathermap.org/data/2.5/forecast")
+
+    with pytest.raises(upstream.DeadlineExceeded):
+        fetch(**{upstream.BUDGET_ARG: 0})
+
+# Stand-ins for the SDK errors, which upstream matches by class name and response status
+class GeocoderRateLimited(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__("too many requests")
+        self.retry_after = retry_after
+
+class ClientError(Exception):
+    def __init__(self, status_code, headers):
+        super().__init__(f"[{status_code}]")
+        self.response = type("Response", (), {"status_code": status_code, "headers": headers})()
+
+@pytest.fixture
+def scheduler(monkeypatch, tmp_path):
+    fresh = upstream.UpstreamScheduler(quota_cache=KVCache("upstream.quota", str(tmp_path / "cache.db")))
+    monkeypatch.setattr(upstream, "scheduler", fresh)
+    return fresh
+
+def raising(error):
+    def fn():
+        raise error
+    return fn
+
+@pytest.mark.parametrize("provider, error, backoff", [
+    ("nominatim", GeocoderRateLimited(retry_after=30), 30),
+    ("amadeus", ClientError(429, [("Retry-After", "12")]), 12),
+    ("amadeus", ClientError(429, {}), upstream.DEFAULT_RETRY_AFTER),
+])
+def test_sdk_rate_limit_backs_the_provider_off(scheduler, provider, error, backoff):
+    with pytest.raises(upstream.QuotaExceeded):
+        upstream.call(provider, raising(error))
+
+    assert scheduler.stats[provider]["http_429"] == 1
+    blocked_for = scheduler.buckets[provider].blocked_until - upstream.time.monotonic()
+    assert backoff - 1 < blocked_for <= backoff
+    assert scheduler.breakers[provider].consecutive == 0
+
+def test_sdk_client_error_is_not_a_rate_limit(scheduler):
+    with pytest.raises(ClientError):
+        upstream.call("amadeus", raising(ClientError(400, {})))
+    assert scheduler.stats["amadeus"]["http_429"] == 0
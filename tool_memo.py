@@ -0,0 +1,114 @@
+import json, logging, time
+from langchain_core.callbacks import adispatch_custom_event
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from singleflight import normalize
+from tool_results import content_text
+
+logger = logging.getLogger("travel_planner_chatbot")
+
+# How long a tool result stays fresh within a thread, in seconds. Tools not listed (live search,
+# local time) are never memoized. Values follow how quickly the upstream data changes.
+TOOL_MEMO_TTLS = {
+    "get_weather_forecast": 3 * 3600,
+    "get_weather_forecast_batch": 3 * 3600,
+    "search_hotels": 30 * 60,
+    "search_hotels_filtered": 30 * 60,
+    "search_flights": 10 * 60,
+    "get_cheapest_flight": 10 * 60,
+    "search_tourism_destinations": 24 * 3600,
+    "find_nearby_attractions": 24 * 3600,
+    "find_nearest_places": 24 * 3600,
+    "plan_walkable_days": 24 * 3600,
+    "build_itinerary": 3 * 3600,
+    "estimate_trip_cost": 3 * 3600,
+    "generate_packing_list": 3 * 3600,
+    "exchange_currency": 3600,
+    "calculate_distance": 7 * 24 * 3600,
+    "calculate_distance_matrix": 7 * 24 * 3600,
+    "get_difference_in_timezones": 7 * 24 * 3600,
+    "convert_units": 7 * 24 * 3600,
+    "convert_timezone": 7 * 24 * 3600,
+}
+
+# Newest entries kept per thread; bounds the checkpoint size of long conversations
+MAX_MEMO_ENTRIES = 32
+
+def memo_key(name: str, args: dict) -> str:
+    """ Key for a tool call: tool name plus normalized arguments ("Paris " and "paris" match). """
+    return name + ":" + json.dumps(normalize(args or {}), default=str)
+
+def merge_tool_memo(current: dict, update: dict) -> dict:
+    """ ChatState reducer: add new entries, drop expired ones and keep the newest MAX_MEMO_ENTRIES. """
+    merged = dict(current or {})
+    merged.update(update or {})
+
+    now = time.time()
+    fresh = [(key, entry) for key, entry in merged.items() if entry.get("expires_at", 0) > now]
+    fresh.sort(key=lambda item: item[1].get("stored_at", 0), reverse=True)
+    return dict(fresh[:MAX_MEMO_ENTRIES])
+
+def lookup(memo: dict, name: str, args: dict):
+    """ Return the fresh memo entry for this call, or None. """
+    entry = (memo or {}).get(memo_key(name, args))
+    if entry and entry.get("expires_at", 0) > time.time():
+        return entry
+    return None
+
+def is_error_result(message: ToolMessage) -> bool:
+    """ True for failed calls: error status, or a JSON object with an "error" key (tools that report failures as data). """
+    if getattr(message, "status", "success") == "error":
+        return True
+    try:
+        payload = json.loads(content_text(message.content))
+    except ValueError:
+        return False
+    return isinstance(payload, dict) and "error" in payload
+
+def make_memo_tool_node(tool_node, postprocess=None):
+    """
+    Wrap a ToolNode so calls already answered earlier in the thread are served from the
+    thread's tool_memo instead of re-running the tool. Misses run through tool_node as usual
+    and their successful results are memoized (failures, including {"error": ...} payloads, never
+    are); hits are reported as "tool_memo_hit" events.
+    postprocess (list of ToolMessages -> list) runs on fresh results before they are memoized.
+    """
+    async def tools(state: dict, config: RunnableConfig):
+        last = state["messages"][-1]
+        memo = state.get("tool_memo") or {}
+
+        hits, misses = {}, []
+        for call in last.tool_calls:
+            entry = lookup(memo, call["name"], call["args"])
+            if entry is None:
+                misses.append(call)
+                continue
+
+            hits[call["id"]] = ToolMessage(content=entry["content"], name=call["name"], tool_call_id=call["id"])
+            age = round(time.time() - entry["stored_at"], 1)
+            logger.info("tool memo hit: %s (age %.0fs)", call["name"], age)
+            await adispatch_custom_event("tool_memo_hit", {"tool": call["name"], "args": call["args"], "age_s": age},
+                                         config=config)
+
+        results, updates = {}, {}
+        if misses:
+            partial = AIMessage(content=last.content, id=last.id, tool_calls=misses)
+            output = await tool_node.ainvoke({**state, "messages": state["messages"][:-1] + [partial]}, config)
+            fresh = postprocess(output["messages"]) if postprocess else output["messages"]
+            now = time.time()
+
+            for message in fresh:
+                results[message.tool_call_id] = message
+                call = next(c for c in misses if c["id"] == message.tool_call_id)
+                ttl = TOOL_MEMO_TTLS.get(call["name"])
+                if ttl and not is_error_result(message):
+                    updates[memo_key(call["name"], call["args"])] = {
+                        "content": message.content, "stored_at": now, "expires_at": now + ttl
+                    }
+
+        # Preserve the order of the AI message's tool calls
+        messages = [hits.get(call["id"]) or results[call["id"]] for call in last.tool_calls if
+                    call["id"] in hits or call["id"] in results]
+        return {"messages": messages, "tool_memo": updates}
+
+    return tools
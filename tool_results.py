@@ -0,0 +1,178 @@
+import hashlib, json, logging, threading
+from langchain_core.messages import ToolMessage
+from kv_cache import KVCache
+from prompt_builder import count_tokens, format_cell
+
+logger = logging.getLogger("travel_planner_chatbot")
+
+# Tool outputs larger than this (in tokens) are stored out-of-line and replaced by a digest plus a handle
+COMPACT_THRESHOLD_TOKENS = 400
+
+# Tools whose output is the answer the model narrates get a higher threshold, so a typical itinerary,
+# cost breakdown or packing list still arrives whole instead of costing an extra expand round trip
+COMPACT_THRESHOLDS = {
+    "build_itinerary": 2500,
+    "estimate_trip_cost": 1500,
+    "generate_packing_list": 1500,
+}
+
+# Never compacted: expanding must return the payload itself
+NEVER_COMPACT = {"expand_tool_result"}
+
+DIGEST_MAX_TOKENS = 200
+DIGEST_LIST_ITEMS = 3
+DIGEST_CELL_CHARS = 80
+
+# Characters returned per expand_tool_result call, so one expansion cannot flood the context
+EXPAND_PAGE_CHARS = 6000
+
+# Blobs outlive the longest tool-memo TTL, so memoized digests can still be expanded
+BLOB_TTL = 8 * 24 * 3600
+
+HANDLE_PREFIX = "tr_"
+
+blobs = KVCache("tool_results")
+
+_STATS = {"compacted": 0, "tokens_before": 0, "tokens_after": 0, "expanded": 0, "expired": 0}
+_STATS_LOCK = threading.Lock()
+
+def content_text(content) -> str:
+    """ ToolMessage content as text (MCP tools may return a list of content blocks). """
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+    return str(content)
+
+def handle_for(text: str) -> str:
+    """ Content address of a payload: identical outputs share one blob. """
+    return HANDLE_PREFIX + hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+def _describe_item(item) -> str:
+    if isinstance(item, dict):
+        fields = [f"{key}={format_cell(value, DIGEST_CELL_CHARS)}" for key, value in item.items()
+                  if not isinstance(value, (dict, list)) or isinstance(value, list) and len(value) <= 3]
+        return "; ".join(fields)
+    return format_cell(item, DIGEST_CELL_CHARS)
+
+def _describe_list(name: str, items: list, indent: str = "") -> list:
+    lines = [f"{indent}{name}: {len(items)} items" + (", first:" if items else "")]
+    for item in items[:DIGEST_LIST_ITEMS]:
+        lines.append(f"{indent}  - {_describe_item(item)}")
+    return lines
+
+def _digest_json(value) -> list:
+    """ Outline of a JSON result: scalars verbatim, lists as counts plus their first items, nested dicts one level deep. """
+    if isinstance(value, list):
+        return _describe_list("result", value)
+    if not isinstance(value, dict):
+        return [format_cell(value, DIGEST_CELL_CHARS)]
+
+    lines = []
+    for key, item in value.items():
+        if isinstance(item, list):
+            lines.extend(_describe_list(key, item))
+        elif isinstance(item, dict):
+            lines.append(f"{key}:")
+            for sub_key, sub_item in item.items():
+                if isinstance(sub_item, list):
+                    lines.extend(_describe_list(sub_key, sub_item, indent="  "))
+                elif isinstance(sub_item, dict):
+                    lines.append(f"  {sub_key}: {{{', '.join(sub_item)}}}")
+                else:
+                    lines.append(f"  {sub_key}: {format_cell(sub_item, DIGEST_CELL_CHARS)}")
+        else:
+            lines.append(f"{key}: {format_cell(item, DIGEST_CELL_CHARS)}")
+    return lines
+
+def _digest_text(text: str) -> list:
+    """ Leading lines of a prose result, cut at a sentence or line boundary. """
+    head = text[:DIGEST_MAX_TOKENS * 4]
+    if len(head) < len(text):
+        cut = max(head.rfind("\n"), head.rfind(". "))
+        head = (head[:cut + 1] if cut > len(head) // 2 else head).rstrip() + " …"
+    return head.splitlines()
+
+def digest(text: str) -> str:
+    """ A compact, deterministic summary of a tool result that fits DIGEST_MAX_TOKENS. """
+    try:
+        lines = _digest_json(json.loads(text))
+    except ValueError:
+        lines = _digest_text(text)
+
+    kept, used = [], 0
+    for line in lines:
+        tokens = count_tokens(line) + 1
+        if used + tokens > DIGEST_MAX_TOKENS:
+            # Shorten the line that crosses the budget (by its chars-per-token ratio) rather than drop it
+            room = (DIGEST_MAX_TOKENS - used) * len(line) // tokens
+            if room > 40:
+                kept.append(line[:room].rstrip() + " …")
+            else:
+                kept.append("…")
+            break
+        used += tokens
+        kept.append(line)
+    return "\n".join(kept)
+
+def compact(name: str, content):
+    """ Return (content, handle): the digest plus a handle if the result was stored out-of-line, else unchanged. """
+    if name in NEVER_COMPACT:
+        return content, None
+
+    text = content_text(content)
+    tokens = count_tokens(text)
+    if tokens <= COMPACT_THRESHOLDS.get(name, COMPACT_THRESHOLD_TOKENS):
+        return content, None
+
+    handle = handle_for(text)
+    blobs.set(handle, {"tool": name, "content": text}, ttl=BLOB_TTL)
+
+    compacted = (f"{digest(text)}\n[Result of {name} shortened from {tokens} tokens. "
+                 f'Call expand_tool_result(handle="{handle}") if the answer needs details not shown here.]')
+    after = count_tokens(compacted)
+    with _STATS_LOCK:
+        _STATS["compacted"] += 1
+        _STATS["tokens_before"] += tokens
+        _STATS["tokens_after"] += after
+    logger.info("tool result %s: %d -> %d tokens (%s)", name, tokens, after, handle)
+    return compacted, handle
+
+def compact_messages(messages: list) -> list:
+    """ Post-tool stage: swap large, successful ToolMessages for their compact form. """
+    compacted = []
+    for message in messages:
+        if not isinstance(message, ToolMessage) or getattr(message, "status", "success") == "error":
+            compacted.append(message)
+            continue
+
+        content, handle = compact(message.name, message.content)
+        if handle is None:
+            compacted.append(message)
+        else:
+            compacted.append(message.model_copy(update={"content": content}))
+    return compacted
+
+def expand(handle: str, offset: int = 0) -> str:
+    """ The stored payload behind a handle, one page at a time. """
+    entry = blobs.get(handle.strip().strip('"'))
+    if entry is None:
+        with _STATS_LOCK:
+            _STATS["expired"] += 1
+        return f"No stored result for {handle} (unknown or expired). Call the original tool again."
+
+    with _STATS_LOCK:
+        _STATS["expanded"] += 1
+    text = entry["content"]
+    offset = max(0, int(offset or 0))
+    page = text[offset:offset + EXPAND_PAGE_CHARS]
+    end = offset + len(page)
+    if end < len(text):
+        page += (f"\n[{len(text) - end} more characters. "
+                 f'Call expand_tool_result(handle="{handle}", offset={end}) for the next page.]')
+    return page
+
+def stats() -> dict:
+    """ Totals since start: results compacted, tokens before and after, expansions and expired handles. """
+    with _STATS_LOCK:
+        return dict(_STATS)
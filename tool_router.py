@@ -0,0 +1,144 @@
+import json, logging, math, re
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+logger = logging.getLogger("travel_planner_chatbot")
+
+# Upper bound on tools bound per turn; keeps the schema prefix small even for broad queries.
+MAX_TOOLS_PER_TURN = 8
+
+# Tools called in this many most recent user turns (the current one included) stay bound, so a
+# follow-up such as "and for four people?" can repeat a call without naming its topic again.
+RECENT_TOOL_TURNS = 2
+
+# Cheap intent classifier: keywords in the user message that pull in a group of tools.
+INTENT_KEYWORDS = {
+    "flights": ({"flight", "flights", "fly", "flying", "airline", "airport", "plane", "depart", "departure"},
+                {"search_flights", "get_cheapest_flight"}),
+    "hotels": ({"hotel", "hotels", "stay", "room", "rooms", "accommodation", "hostel", "booking", "night", "nights"},
+               {"search_hotels", "search_hotels_filtered"}),
+    "weather": ({"weather", "forecast", "rain", "sunny", "temperature", "climate", "cold", "hot", "snow"},
+                {"get_weather_forecast", "get_weather_forecast_batch", "convert_fahrenheit_to_celsius"}),
+    "places": ({"places", "attractions", "attraction", "visit", "see", "sightseeing", "museum", "tourist", "things", "poi",
+                "nearby", "nearest", "near", "walk", "walking", "walkable"},
+               {"search_tourism_destinations", "find_nearby_attractions", "find_nearest_places", "plan_walkable_days"}),
+    "itinerary": ({"itinerary", "plan", "trip", "schedule", "vacation", "holiday"},
+                  {"build_itinerary"}),
+    "cost": ({"cost", "budget", "expensive", "cheap", "price", "afford"},
+             {"estimate_trip_cost"}),
+    "packing": ({"pack", "packing", "luggage", "bring", "suitcase"},
+                {"generate_packing_list"}),
+    "currency": ({"currency", "exchange", "convert", "usd", "eur", "gbp", "inr", "jpy", "dollars", "euros"},
+                 {"exchange_currency"}),
+    "time": ({"time", "timezone", "clock", "hour", "hours", "local"},
+             {"get_local_time", "convert_timezone", "get_difference_in_timezones"}),
+    "distance": ({"distance", "distances", "far", "km", "miles", "between", "route", "order", "cities"},
+                 {"calculate_distance", "calculate_distance_matrix"}),
+    "units": ({"kg", "lb", "lbs", "pounds", "fahrenheit", "celsius", "unit", "units"},
+              {"convert_units"}),
+    "math": ({"add", "plus", "sum", "subtract", "minus", "multiply", "times", "divide", "power", "root", "modulus",
+              "calculate"},
+             {"add", "subtract", "multiply", "divide", "power", "modulus", "root"}),
+}
+
+# Always available so the agent can still look something up when no intent matches,
+# and can open results that earlier turns shortened to a digest.
+FALLBACK_TOOLS = {"duckduckgo_search", "expand_tool_result"}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Arithmetic between numbers also pulls in the math tools. "-" and "/" count only with spaces around
+# them, so dates (2025-06-01, 06/01/2025) and ranges (3-5 days) do not.
+_EXPRESSION_RE = re.compile(r"\d(?:\s*[+*^%]\s*|\s+[-/]\s+)\d")
+
+def _tokens(text: str) -> set:
+    return set(_TOKEN_RE.findall(text.lower()))
+
+def estimate_tokens(text: str) -> int:
+    """ Rough token estimate (~4 characters per token) used for reporting only. """
+    return max(1, len(text) // 4)
+
+def last_user_text(messages) -> str:
+    """ Return the content of the most recent human message. """
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return message.content if isinstance(message.content, str) else str(message.content)
+    return ""
+
+def recent_tool_names(messages, turns: int = RECENT_TOOL_TURNS) -> set:
+    """ Return the names of the tools the model called in the last `turns` user turns. """
+    names = set()
+    for message in reversed(messages):
+        if isinstance(message, AIMessage):
+            names.update(call["name"] for call in message.tool_calls)
+        elif isinstance(message, HumanMessage):
+            turns -= 1
+            if turns <= 0:
+                break
+    return names
+
+class ToolRouter:
+    """ Selects a relevant subset of tools per turn and caches the model bound to each subset. """
+
+    def __init__(self, llm, tools, max_tools: int = MAX_TOOLS_PER_TURN):
+        self.llm = llm
+        self.tools = {t.name: t for t in tools}
+        self.max_tools = max_tools
+        self._bound = {}
+
+        # Schema size per tool, and an IDF-weighted vocabulary over tool descriptions
+        self.schema_tokens = {
+            name: estimate_tokens(json.dumps(convert_to_openai_tool(t))) for name, t in self.tools.items()
+        }
+        self._vocab = {name: _tokens(name.replace("_", " ") + " " + (t.description or "")) for name, t in self.tools.items()}
+        doc_freq = {}
+        for words in self._vocab.values():
+            for word in words:
+                doc_freq[word] = doc_freq.get(word, 0) + 1
+        self._idf = {word: math.log((1 + len(self._vocab)) / (1 + df)) for word, df in doc_freq.items()}
+
+    def select(self, text: str, recent=()) -> tuple:
+        """ Return the sorted tuple of tool names relevant to the user text, keeping the `recent` tools in reach. """
+        words = _tokens(text)
+        scores = {}
+
+        for intent, (keywords, names) in INTENT_KEYWORDS.items():
+            if words & keywords or (intent == "math" and _EXPRESSION_RE.search(text)):
+                for name in names:
+                    if name in self.tools:
+                        scores[name] = scores.get(name, 0.0) + 2.0
+
+        for name, vocab in self._vocab.items():
+            overlap = sum(self._idf[w] for w in words & vocab)
+            if overlap > 1.0:
+                scores[name] = scores.get(name, 0.0) + overlap
+
+        # Recent tools score below a keyword match, so they fill the slots the current text leaves free
+        for name in recent:
+            if name in self.tools:
+                scores[name] = scores.get(name, 0.0) + 1.0
+
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self.max_tools]
+        selected = set(ranked) | {name for name in FALLBACK_TOOLS if name in self.tools}
+        return tuple(sorted(selected))
+
+    def bind(self, names: tuple, llm=None):
+        """ Return the model bound to exactly these tools, building it once per (model, subset). """
+        llm = llm or self.llm
+        key = (getattr(llm, "task", None) or id(llm), names)
+        if key not in self._bound:
+            subset = [self.tools[name] for name in names]
+            self._bound[key] = llm.bind_tools(subset, tool_choice="auto") if subset else llm
+        return self._bound[key]
+
+    def route(self, messages, llm=None, names: tuple = None):
+        """ Pick tools for the current turn, log the schema tokens saved and return the bound model. """
+        names = names if names is not None else self.select(last_user_text(messages), recent_tool_names(messages))
+        total = sum(self.schema_tokens.values())
+        bound = sum(self.schema_tokens[name] for name in names)
+
+        logger.info(
+            "tool router: bound %d/%d tools (%s), ~%d schema tokens instead of ~%d (saved ~%d)",
+            len(names), len(self.tools), ", ".join(names), bound, total, total - bound
+        )
+        return self.bind(names, llm)
@@ -1,9 +1,9 @@
 from langgraph.graph import StateGraph, START, END
-from langchain_openai import ChatOpenAI
-import asyncio, threading, aiosqlite, os, logging, requests, pytz
+import asyncio, threading, aiosqlite, os, json, logging, pytz, time, functools, upstream
 from langgraph.graph.message import add_messages
-from langchain_core.messages import BaseMessage
-from langchain_core.tools import tool, BaseTool
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import tool, BaseTool, ToolException
 from langchain_community.tools import DuckDuckGoSearchRun
 from langchain_mcp_adapters.client import MultiServerMCPClient
 from langgraph.prebuilt import ToolNode, tools_condition
@@ -11,11 +11,26 @@ from typing import TypedDict, Annotated
 from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from dotenv import load_dotenv
 from typing import List
-from datetime import datetime
+from datetime import datetime, date, timedelta
+from collections import Counter
+import statistics
 import geopy.distance
 from geopy.geocoders import Nominatim
+from geopy.exc import GeopyError
 from timezonefinder import TimezoneFinder
 import streamlit as st
+from tool_router import ToolRouter, last_user_text, recent_tool_names
+from model_router import get_model
+from singleflight import coalesce
+from itinerary_planner import plan_itinerary, rain_risk, trip_nights
+from geo_index import distance_matrix_km, nearest_neighbour_order
+from kv_cache import KVCache
+from tool_memo import make_memo_tool_node, merge_tool_memo
+from tool_results import compact_messages, expand
+from checkpoint_store import DedupSerializer, DedupSqliteSaver
+from currency import exchange_currency, fetch_currency_conversion
+from jobs import JobQueue, Step, JOB_DEADLINE, job_tool_output
+from prefetch import Prefetcher, extract_entities, within_forecast_horizon
 
 load_dotenv()
 
@@ -61,6 +76,11 @@ SERVERS = {
     }
 }
 
+# stdio servers only inherit a minimal environment by default; pass ours through so API keys
+# and switches such as LLM_BACKEND / UPSTREAM_STUB_URL reach every server
+for server in SERVERS.values():
+    server["env"] = dict(os.environ)
+
 # Dedicated async loop thread for MCP client
 _ASYNC_LOOP = asyncio.new_event_loop()
 _ASYNC_THREAD = threading.Thread(target=_ASYNC_LOOP.run_forever, daemon=True)
@@ -78,8 +98,34 @@ def submit_async_task(coro):
     """Schedule coroutine, return concurrent.futures.Future for later inspection."""
     return _submit_async(coro)
 
-# Initialize LLM
-llm = ChatOpenAI(model="gpt-4", temperature=0, openai_api_key=OPENAI_API_KEY)
+# Initialize LLMs: a cheap tier for tool-calling decisions and a stronger tier for composing answers
+llm = get_model("composition", api_key=OPENAI_API_KEY)
+routing_llm = get_model("routing", api_key=OPENAI_API_KEY)
+
+# Wall-clock budget of one user turn; tool calls and the HTTP requests under them must finish within it
+TURN_DEADLINE = float(os.getenv("TURN_DEADLINE_S", "120"))
+
+# Upper bound for a single MCP tool call, with or without a turn deadline
+MCP_TOOL_TIMEOUT = 60.0
+
+ITINERARY_NARRATION = (
+    "Narrate this plan day by day for the traveler. Do not add, remove or reorder places; "
+    "mention weather adjustments and the budget summary. For flights or hotels, call the flight "
+    "and hotel tools separately."
+)
+
+COST_NARRATION = (
+    "Present this cost breakdown in its currency: destination, days, flight, hotel (per night, nights and total), "
+    "daily expenses and total. Say which figures come from real offers and which from the given budget."
+)
+
+PACKING_NARRATION = (
+    "Write a packing list of 10-20 items grouped into essentials, weather gear and activity gear. "
+    "Base weather gear only on this forecast and activity gear only on these activities."
+)
+
+# Time a tool leaves itself, within the turn deadline, to report on a job that is still running
+JOB_TOOL_MARGIN = 5.0
 
 # Define search tool as fallback
 search_tool = DuckDuckGoSearchRun(region="en-us")
@@ -96,27 +142,109 @@ def load_mcp_tools() -> List[BaseTool]:
         print("Warning: failed to load MCP tools:", e)
         return []
     
-mcp_tools = load_mcp_tools()
+async def acall_mcp_tool(name: str, **kwargs):
+    """Invoke an MCP tool from code on the backend loop and decode its JSON result."""
+    mcp_tool = next((t for t in mcp_tools if t.name == name), None)
+    if mcp_tool is None:
+        raise ValueError(f"MCP tool {name} is not available")
     
-@tool
-def exchange_currency(from_currency: str, to_currency: str, amount: float):
-    """Converts an amount from one currency to another."""
-    url = "https://currency-conversion-and-exchange-rates.p.rapidapi.com/convert"
+    result = await mcp_tool.ainvoke(kwargs)
+    if isinstance(result, list):
+        result = "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in result)
     
-    query_params = {
-        "from": from_currency,
-        "to": to_currency,
-        "amount": amount
-    }
+    try:
+        return json.loads(result)
+    except (TypeError, ValueError):
+        return result
+
+def mcp_call_budget() -> float:
+    """Seconds an MCP tool call may take: what is left of the turn deadline, capped at MCP_TOOL_TIMEOUT."""
+    left = upstream.time_left()
+    return MCP_TOOL_TIMEOUT if left is None else max(0.0, min(MCP_TOOL_TIMEOUT, left))
+
+def pass_turn_budget(tools: List[BaseTool]) -> List[BaseTool]:
+    """Send the remaining turn budget with every call to an MCP tool that takes one, hiding the argument from the model."""
+    for mcp_tool in tools:
+        schema = mcp_tool.args_schema if isinstance(mcp_tool.args_schema, dict) else {}
+        if getattr(mcp_tool, "coroutine", None) and schema.get("properties", {}).pop(upstream.BUDGET_ARG, None) is not None:
+            coroutine = mcp_tool.coroutine
+            
+            @functools.wraps(coroutine)
+            async def with_budget(*args, _coroutine=coroutine, **kwargs):
+                return await _coroutine(*args, **{**kwargs, upstream.BUDGET_ARG: mcp_call_budget()})
+            mcp_tool.coroutine = with_budget
+    return tools
+
+def coalesce_mcp_tools(tools: List[BaseTool]) -> List[BaseTool]:
+    """Share one in-flight MCP call between concurrent identical tool invocations."""
+    for mcp_tool in tools:
+        if getattr(mcp_tool, "coroutine", None):
+            mcp_tool.coroutine = coalesce(f"mcp.{mcp_tool.name}")(mcp_tool.coroutine)
+    return tools
+
+def with_deadline(name: str, coroutine):
+    """Bound an MCP tool coroutine by the turn deadline (or MCP_TOOL_TIMEOUT)."""
+    @functools.wraps(coroutine)
+    async def bounded(*args, **kwargs):
+        timeout = mcp_call_budget()
+        try:
+            return await asyncio.wait_for(coroutine(*args, **kwargs), timeout)
+        except asyncio.TimeoutError:
+            raise ToolException(f"{name} did not answer within {timeout:.0f}s; continue without it or try again later.")
+    return bounded
+
+def bound_mcp_tools(tools: List[BaseTool]) -> List[BaseTool]:
+    """Apply deadlines to MCP tools and report their failures to the model instead of failing the turn."""
+    for mcp_tool in tools:
+        if getattr(mcp_tool, "coroutine", None):
+            mcp_tool.coroutine = with_deadline(mcp_tool.name, mcp_tool.coroutine)
+            mcp_tool.handle_tool_error = True
+    return tools
+
+mcp_tools = bound_mcp_tools(coalesce_mcp_tools(pass_turn_budget(load_mcp_tools())))
+
+# MCP tools used only by the app itself (cache warming); never bound to the model
+INTERNAL_MCP_TOOLS = {"prefetch_destination", "prefetch_forecast", "prefetch_area"}
+
+# One Nominatim client and a persistent geocode cache shared by all location tools
+stub = upstream.stub_endpoint()
+if stub:
+    geolocator = Nominatim(user_agent="travel_planner", domain=f"{stub[0]}:{stub[1]}", scheme=stub[2])
+else:
+    geolocator = Nominatim(user_agent="travel_planner")
+
+geocode_cache = KVCache("nominatim.geocode")
+GEOCODE_TTL = 30 * 24 * 3600
+
+@coalesce("chatbot.geocode")
+def geocode_city(city: str):
+    """Return (latitude, longitude) for a city, or None. Cached persistently; concurrent lookups share one request."""
+    key = " ".join(city.split()).casefold()
+    cached = geocode_cache.get(key)
+    if cached:
+        return tuple(cached)
     
-    headers = {
-        "x-rapidapi-host": "currency-conversion-and-exchange-rates.p.rapidapi.com",
-        "x-rapidapi-key": os.getenv("RAPID_API_KEY")
-    }
+    try:
+        location = upstream.call("nominatim", geolocator.geocode, city,
+                                 timeout=upstream.request_timeout(upstream.DEFAULT_TIMEOUT[1]))
+    except (upstream.UpstreamUnavailable, GeopyError):
+        stale = geocode_cache.get(key, allow_stale=True)
+        return tuple(stale) if stale else None
+    
+    if not location:
+        return None
     
-    response = requests.get(url, headers=headers, params=query_params)
-    data = response.json()
-    return data['result']
+    coords = (location.latitude, location.longitude)
+    geocode_cache.set(key, list(coords), ttl=GEOCODE_TTL)
+    known_places.add(key)
+    return coords
+
+def prefetch_geocode(city: str):
+    with upstream.priority(upstream.PREFETCH):
+        return geocode_city(city)
+
+# Places geocoded before; lets prefetch recognise destinations written in lower case
+known_places = {key for key, _ in geocode_cache.items()}
 
 @tool
 def convert_timezone(time_str: str, from_tz: str, to_tz: str):
@@ -132,27 +260,46 @@ def convert_timezone(time_str: str, from_tz: str, to_tz: str):
 @tool
 def calculate_distance(city1: str, city2: str):
     """ Calculates the approximate distance between two cities in kilometers. """
-    geolocator = Nominatim(user_agent="travel_planner")
+    coords_1 = geocode_city(city1)
+    coords_2 = geocode_city(city2)
     
-    loc1 = geolocator.geocode(city1)
-    loc2 = geolocator.geocode(city2)
+    return geopy.distance.distance(coords_1, coords_2).km
+
+@tool
+def calculate_distance_matrix(cities: List[str], method: str = "great_circle", include_route: bool = True):
+    """ Calculates distances in kilometers between every pair of cities in one call (use this for multi-city trips instead of repeated calculate_distance calls). method is "great_circle" or "geodesic". With include_route, also returns a nearest-neighbour visiting order starting from the first city. """
+    names, seen = [], set()
+    for city in cities:
+        key = " ".join(city.split()).casefold()
+        if key not in seen:
+            seen.add(key)
+            names.append(city.strip())
+            
+    coords = [geocode_city(city) for city in names]
+    missing = [city for city, c in zip(names, coords) if c is None]
+    if missing:
+        return {"error": f"Location not found: {', '.join(missing)}"}
     
-    coords_1 = (loc1.latitude, loc1.longitude)
-    coords_2 = (loc2.latitude, loc2.longitude)
+    matrix = distance_matrix_km(coords, method=method)
+    result = {"cities": names, "unit": "km", "matrix": matrix.round(1).tolist()}
     
-    return geopy.distance.distance(coords_1, coords_2).km
+    if include_route:
+        order = nearest_neighbour_order(matrix)
+        result["route"] = [names[i] for i in order]
+        result["route_km"] = round(float(sum(matrix[a, b] for a, b in zip(order, order[1:]))), 1)
+        
+    return result
 
 @tool
 def get_local_time(city: str):
     """ Returns the current local time in a city. """
-    geolocator = Nominatim(user_agent="travel_planner")
-    location = geolocator.geocode(city)
+    location = geocode_city(city)
     
     if not location:
         return "Location not found"
     
     tf = TimezoneFinder()
-    timezone_str = tf.timezone_at(lng=location.longitude, lat=location.latitude)
+    timezone_str = tf.timezone_at(lng=location[1], lat=location[0])
     
     if not timezone_str:
         return "Timezone not found"
@@ -195,168 +342,272 @@ def convert_units(value: float, from_unit: str, to_unit: str):
 
     return f"Unsupported conversion {from_unit} → {to_unit}"
 
-@tool
-def build_itinerary(destination: str, days: int = 10, budget: float = 1000.0):
-    """ Builds a travel itinerary for a given destination, duration, and budget using all MCP tools. """
-
-    system_prompt = f"""
-            You are a Travel Orchestration Agent. Your job is to call MCP tools to gather 
-            *real* information and then build an itinerary. You must follow ALL rules strictly:
-
-            RULES
-
-            1. **DO NOT answer directly from your own knowledge.**
-            2. **DO NOT guess or invent flights, hotels, weather, or places.**
-            3. **DO NOT skip tools. ALL tools must be used in this exact order:**
-
-            STEP 1 → Call: `search_flights(destination="{destination}")`
-            STEP 2 → After receiving flights → Call: 
-                     `search_hotels(destination="{destination}", budget={budget})`
-            STEP 3 → After receiving hotels → Call: 
-                     `get_weather_forecast(location="{destination}")`
-            STEP 4 → After receiving weather → Call: 
-                     `search_tourism_destinations(location="{destination}")`
-
-            4. Only after all 4 tool calls are complete, generate the final itinerary.
-
-            OUTPUT FORMAT
-
-            After collecting tool results, summarize everything using this structure:
-
-            • **Destination:** {destination}  
-            • **Trip Duration:** {days} days  
-            • **Estimated Budget:** ${budget}
-
-            ### Flights (from tool)
-            - Show 2–3 recommended real flights.
-
-            ### Hotels (from tool)
-            - Show recommended stays within budget.
-
-            ### Weather Forecast (from tool)
-            - Provide a 3–5 day summary.
-
-            ### Places to Visit (from tool)
-            - List 5–7 must-visit attractions.
+# Background jobs: itinerary, cost and packing requests gather their data in checkpointed steps,
+# so a reload or retry of the same request resumes from the steps already completed
+async def _job_tool(name: str, **kwargs) -> dict:
+    result = await acall_mcp_tool(name, **kwargs)
+    if not isinstance(result, dict):
+        raise RuntimeError(str(result))
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result
+
+# Currency of the cost estimate and of the hotel prices requested for it; budgets are given in it too
+TRIP_CURRENCY = "USD"
+
+def _hotel_prices(hotels) -> list:
+    return [h["price_per_night"] for h in hotels or [] if isinstance(h.get("price_per_night"), (int, float))]
+
+def _hotel_nightly(hotels):
+    """Median nightly price of the hotel offers, or None."""
+    prices = _hotel_prices(hotels)
+    return round(statistics.median(prices), 2) if prices else None
+
+async def _in_trip_currency(amount: float, currency: str):
+    """The amount in TRIP_CURRENCY, or None when no exchange rate is available."""
+    if not currency or currency.upper() == TRIP_CURRENCY:
+        return amount
+    try:
+        return await asyncio.to_thread(fetch_currency_conversion, currency, TRIP_CURRENCY, amount)
+    except upstream.UpstreamUnavailable:
+        return None
+
+async def _job_places(params: dict, results: dict):
+    data = await _job_tool("find_nearby_attractions", location=params["destination"], radius_km=5.0,
+                           top_k=max(20, params["days"] * 6))
+    return data.get("places", [])
+
+async def _job_weather(params: dict, results: dict):
+    data = await _job_tool("get_weather_forecast", location=params["destination"], num_days=min(params["days"], 5))
+    return data.get("days", [])
+
+async def _job_hotels(params: dict, results: dict):
+    nights = trip_nights(params["days"])
+    if not params.get("checkin_date") or not nights:
+        return None
+    checkout = date.fromisoformat(params["checkin_date"]) + timedelta(days=nights)
+    data = await _job_tool("search_hotels_filtered", num_adults=params.get("adults", 1), num_children=0,
+                           checkin_date=params["checkin_date"], checkout_date=checkout.isoformat(),
+                           location=params["destination"], sort_by="price", top_k=5, currency_code=TRIP_CURRENCY)
+    return data.get("hotels", [])
+
+async def _job_flight(params: dict, results: dict):
+    if not params.get("origin"):
+        return None
+    data = await _job_tool("get_cheapest_flight", origin=params["origin"], destination=params["destination"])
+    return data if data.get("total_price") else None
+
+async def _job_plan(params: dict, results: dict):
+    days = params["days"]
+    nightly = _hotel_nightly(results.get("hotels")) or params.get("hotel_nightly", 0.0)
+    plan = plan_itinerary(results["places"], days, weather=results.get("weather") or [], budget=params.get("budget"),
+                          hotel_nightly=nightly, daily_expenses=params.get("daily_expenses", 0.0))
+
+    # Coordinates only matter to the planner; keep them out of the prompt
+    for day in plan["days"]:
+        for place in day["places"]:
+            place.pop("lat", None)
+            place.pop("lon", None)
+
+    return {"destination": params["destination"], "plan": plan,
+            "hotels": (results.get("hotels") or [])[:3], "flight": results.get("flight")}
+
+async def _job_estimate(params: dict, results: dict):
+    days, nights, flight = params["days"], trip_nights(params["days"]), results.get("flight")
+
+    # Every figure in TRIP_CURRENCY; an offer that cannot be converted falls back to the given budget
+    flight_cost, flight_source = params["flight_cost"], "given"
+    if flight:
+        offer = f"{flight['total_price']} {flight['currency_code']}"
+        converted = await _in_trip_currency(float(flight["total_price"]), flight["currency_code"])
+        if converted is None:
+            flight_source = f"given (cheapest offer of {offer} could not be converted)"
+        else:
+            flight_cost = round(converted, 2)
+            flight_source = f"cheapest offer ({flight['from']} → {flight['to']}, {offer})"
+
+    nightly = _hotel_nightly(results.get("hotels"))
+    hotel_nightly = nightly if nightly is not None else params["hotel_budget"]
+    hotel_total = round(hotel_nightly * nights, 2)
+    daily_total = round(params["daily_expenses"] * days, 2)
+    offers = len(_hotel_prices(results.get("hotels")))
+
+    return {
+        "destination": params["destination"],
+        "currency": TRIP_CURRENCY,
+        "days": days,
+        "nights": nights,
+        "flight_cost": flight_cost,
+        "flight_source": flight_source,
+        "hotel_nightly": hotel_nightly,
+        "hotel_source": f"median of the {offers} cheapest offers" if nightly is not None else "given budget",
+        "hotel_total": hotel_total,
+        "daily_expenses_total": daily_total,
+        "total": round(flight_cost + hotel_total + daily_total, 2),
+    }
 
-            ### Day-by-Day Plan
-            Create a {days}-day itinerary that includes:
-            - One major attraction per day  
-            - Hotel suggestion  
-            - Weather adjustment  
-            - Optional local tips or food suggestions (optional, NOT fabricated)
-    """
+async def _job_packing(params: dict, results: dict):
+    weather, places = results.get("weather") or [], results.get("places") or []
+    categories = Counter(c for place in places for c in place.get("categories") or [])
+
+    summary = None
+    if weather:
+        summary = {
+            "min_temp_c": min(day["temp_min"] for day in weather),
+            "max_temp_c": max(day["temp_max"] for day in weather),
+            "wet_days": sum(1 for day in weather if rain_risk(day) >= 0.5),
+            "conditions": sorted({str(day.get("condition")) for day in weather if day.get("condition")}),
+        }
+
+    return {"destination": params["destination"], "days": params["days"], "trip_type": params["trip_type"],
+            "weather": summary, "activities": [name for name, _ in categories.most_common(8)],
+            "top_places": [place["name"] for place in places[:8]]}
+
+job_queue = JobQueue({
+    "itinerary": [Step("places", _job_places), Step("weather", _job_weather, optional=True),
+                  Step("hotels", _job_hotels, optional=True), Step("flight", _job_flight, optional=True),
+                  Step("plan", _job_plan, requires=("places", "weather", "hotels", "flight"))],
+    "cost": [Step("hotels", _job_hotels, optional=True), Step("flight", _job_flight, optional=True),
+             Step("estimate", _job_estimate, requires=("hotels", "flight"))],
+    "packing": [Step("weather", _job_weather), Step("places", _job_places, optional=True),
+                Step("packing", _job_packing, requires=("weather", "places"))],
+}, submit=submit_async_task)
+
+def run_job_tool(kind: str, params: dict, instructions: str) -> str:
+    """Run a tool's request as a background job and wait for it within the turn; a slow job keeps running.
+    Unfinished jobs raise ToolException, so the answer is neither memoized nor mistaken for a result."""
+    left = upstream.time_left()
+    record = job_queue.run(kind, params, timeout=JOB_DEADLINE if left is None else max(1.0, left - JOB_TOOL_MARGIN))
+    return job_tool_output(record, instructions)
 
-    response = llm_with_tools.invoke(system_prompt)
-    return response
+@tool
+def build_itinerary(destination: str, days: int = 10, budget: float = 1000.0,
+                    hotel_nightly: float = 0.0, daily_expenses: float = 0.0,
+                    origin: str = None, checkin_date: str = None):
+    """ Builds a day-by-day itinerary for a destination, duration, and budget. Real attractions are assigned to days and ordered for walking by a deterministic planner; narrate the returned plan without changing it. With checkin_date (YYYY-MM-DD) real hotel options are included, with origin the cheapest flight. """
+    return run_job_tool("itinerary", {"destination": destination, "days": days, "budget": budget,
+                                      "hotel_nightly": hotel_nightly, "daily_expenses": daily_expenses,
+                                      "origin": origin, "checkin_date": checkin_date},
+                        ITINERARY_NARRATION)
 
 @tool
 def estimate_trip_cost(destination: str, days: int = 10, flight_cost: float = 500.0,
-                       hotel_budget: float = 100.0, daily_expenses: float = 50.0):
-    """
-    Estimate total trip cost using MCP tools to fetch real hotel data,
-    weather (optional context), and tourism spots (optional context).
-    The purpose is to avoid hallucinating costs and always use tool data when available.
-    """
-
-    system_prompt = f"""
-            You are a Travel Budget Estimation Agent. Your job is to call MCP tools to gather
-            *real* information before generating any cost estimation. Follow these rules:
-
-            RULES
-            1. **DO NOT guess or estimate hotel prices or attractions on your own.**
-            2. **DO NOT skip tools. Use tools in this strict order:**
-
-            STEP 1 → Call: `search_hotels(destination="{destination}", budget={hotel_budget})`
-            STEP 2 → Call: `get_weather_forecast(location="{destination}")` (context only)
-            STEP 3 → Call: `search_tourism_destinations(location="{destination}")` (context only)
-
-            3. After all tool calls are complete, calculate:
-               • Flight cost: ${flight_cost}
-               • Hotel cost: (use real hotel prices returned by the tool)
-               • Daily expenses: {days} × ${daily_expenses}
-               • Total cost = flight + hotel_total + daily_expenses_total
-
-            OUTPUT FORMAT
-            After gathering tool results, output:
-            • Destination
-            • Days
-            • Flight Cost
-            • Hotel Cost (use average of recommended stays)
-            • Daily Expenses
-            • Total Estimate
-    """
-
-    response = llm_with_tools.invoke(system_prompt)
-    return response
+                       hotel_budget: float = 100.0, daily_expenses: float = 50.0,
+                       origin: str = None, checkin_date: str = None, adults: int = 1):
+    """ Estimates the total trip cost (flight + hotel for days-1 nights + daily expenses) in USD; flight_cost, hotel_budget (per night) and daily_expenses are in USD. With origin, the cheapest real flight replaces flight_cost; with checkin_date (YYYY-MM-DD), the median price of the cheapest real hotels replaces hotel_budget. Present the returned breakdown as is. """
+    return run_job_tool("cost", {"destination": destination, "days": days, "flight_cost": flight_cost,
+                                 "hotel_budget": hotel_budget, "daily_expenses": daily_expenses,
+                                 "origin": origin, "checkin_date": checkin_date, "adults": adults},
+                        COST_NARRATION)
 
 @tool
 def generate_packing_list(destination: str, days: int = 7, trip_type: str = "general"):
-    """Generate a packing list using MCP tools (weather + places) before producing the final list."""
-
-    system_prompt = f"""
-            You are a Travel Packing List Orchestration Agent. You MUST follow these rules exactly.
-
-            RULES
-
-            1. **DO NOT answer from your own knowledge.**
-            2. **DO NOT guess weather or activities.**
-            3. **ALL tool calls must happen in this exact order:**
+    """ Returns the forecast weather and the main activities at a destination, from which you write a packing list. """
+    return run_job_tool("packing", {"destination": destination, "days": days, "trip_type": trip_type},
+                        PACKING_NARRATION)
 
-            STEP 1 → Call: `get_weather_forecast(location="{destination}")`
-            STEP 2 → Call: `search_tourism_destinations(city="{destination}")`
+# Unfinished or failed jobs reach the model as error results instead of failing the turn
+for job_tool in (build_itinerary, estimate_trip_cost, generate_packing_list):
+    job_tool.handle_tool_error = True
 
-            4. After collecting BOTH tool results, generate a final packing list.
-
-            PACKING LIST REQUIREMENTS
-
-            • Include general essentials (chargers, passport, toiletries).  
-            • Add weather-dependent items (e.g., jacket, umbrella).  
-            • Add activity-dependent items (e.g., hiking shoes, swimwear).  
-            • Do NOT invent weather or places — rely ONLY on tool results.  
-
-            OUTPUT FORMAT
-
-            • **Destination:** {destination}  
-            • **Trip Duration:** {days} days  
-            • **Trip Type:** {trip_type}
-
-            ### Weather Insights (from tool)
-
-            ### Activity Insights (from tool)
-
-            ### Packing List
-            - 10–20 well-categorized items  
-            - Include essentials + weather gear + activity gear  
-            - No hallucinated weather or activities
-    """
-
-    response = llm_with_tools.invoke(system_prompt)
-    return response
-
-# Aggregate tools and bind to LLM
-tools = [search_tool, build_itinerary, calculate_distance, get_difference_in_timezones,exchange_currency, convert_timezone, convert_units, estimate_trip_cost, generate_packing_list, get_local_time, *mcp_tools]
-llm_with_tools = llm.bind_tools(tools, tool_choice="auto") if tools else llm
+@tool
+def expand_tool_result(handle: str, offset: int = 0):
+    """ Returns the full data of an earlier tool result that was shortened to a digest, given its handle (tr_...). Use only when the answer needs details missing from the digest; long results come in pages, continue with the offset it gives. """
+    return expand(handle, offset)
+
+# Aggregate tools
+tools = [search_tool, build_itinerary, calculate_distance, calculate_distance_matrix, get_difference_in_timezones,exchange_currency, convert_timezone, convert_units, estimate_trip_cost, generate_packing_list, get_local_time, expand_tool_result, *(t for t in mcp_tools if t.name not in INTERNAL_MCP_TOOLS)]
+
+# Per-turn tool selection for the chat node
+tool_router = ToolRouter(routing_llm, tools)
+
+# Turns that only need these tools (or none) never leave the cheap routing tier
+TRIVIAL_TOOLS = {"duckduckgo_search", "expand_tool_result", "convert_units", "convert_timezone", "get_local_time",
+                 "get_difference_in_timezones", "exchange_currency", "calculate_distance", "calculate_distance_matrix",
+                 "add", "subtract", "multiply", "divide", "power", "modulus", "root"}
+
+def select_model_tier(messages, tool_names: tuple):
+    """ Use the routing tier to decide tool calls and the composition tier to write answers over tool results. """
+    if set(tool_names) <= TRIVIAL_TOOLS:
+        return routing_llm
+    if messages and isinstance(messages[-1], ToolMessage):
+        return llm
+    return routing_llm
+
+async def _warm_mcp(name: str, **kwargs):
+    mcp_tool = next((t for t in mcp_tools if t.name == name), None)
+    if mcp_tool is not None:
+        await mcp_tool.ainvoke(kwargs)
+
+async def _warm_weather(destination: str, entities: dict):
+    if within_forecast_horizon(entities["dates"]):
+        await _warm_mcp("prefetch_forecast", location=destination)
+
+# Caches warmed speculatively while chat_node decides which tools to call
+prefetcher = Prefetcher({
+    "geocode": lambda destination, entities: asyncio.to_thread(prefetch_geocode, destination),
+    "weather": _warm_weather,
+    "places": lambda destination, entities: _warm_mcp("prefetch_area", location=destination),
+    "hotels": lambda destination, entities: _warm_mcp("prefetch_destination", location=destination),
+})
 
 # Define chat state schema
 class ChatState(TypedDict):
     messages: Annotated[list[BaseMessage], add_messages]
+    # Per-thread memo of recent tool results, so follow-up turns reuse them instead of re-fetching
+    tool_memo: Annotated[dict, merge_tool_memo]
+    # Epoch seconds by which the current turn must finish; set when a user message arrives
+    deadline: float
    
-async def chat_node(state: ChatState):
+async def chat_node(state: ChatState, config: RunnableConfig):
     """Chat node that processes messages and generates a response using the LLM with tools."""
     messages = state["messages"]
-    response = await llm_with_tools.ainvoke(messages)
-    return {"messages": [response]}
+    update = {}
+    
+    # A new user message: start the turn's deadline and warm caches for the destination it mentions
+    if messages and isinstance(messages[-1], HumanMessage):
+        update["deadline"] = time.time() + TURN_DEADLINE
+        # geocode_city adds to known_places from worker threads; iterate a snapshot (copied atomically)
+        entities = extract_entities(last_user_text(messages), frozenset(known_places))
+        if entities["destinations"]:
+            prefetcher.schedule(config["configurable"].get("thread_id", "default"), entities)
+    
+    if tools:
+        tool_names = tool_router.select(last_user_text(messages), recent_tool_names(messages))
+        model = tool_router.route(messages, llm=select_model_tier(messages, tool_names), names=tool_names)
+    else:
+        model = routing_llm
+        
+    response = await model.ainvoke(messages, config=config)
+    
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        logger.info("chat_node prompt tokens: %s", usage.get("input_tokens"))
+        
+    return {"messages": [response], **update}
+
+async def tools_node(state: ChatState, config: RunnableConfig):
+    """Run the requested tools under the turn's deadline, answering repeats from the thread's tool memo.
+    Large results are stored out-of-line and reach the model (and checkpoints) as a digest plus a handle."""
+    with upstream.deadline(state.get("deadline") or time.time() + TURN_DEADLINE):
+        return await memo_tools(state, config)
 
 # Define the tool node
 tool_node = ToolNode(tools) if tools else None
+memo_tools = make_memo_tool_node(tool_node, postprocess=compact_messages) if tool_node else None
 
 # Define a checkpointer for saving chat history
-checkpoint_db_path = "travel_planner_chatbot.db"
+checkpoint_db_path = os.getenv("CHECKPOINT_DB_PATH", "travel_planner_chatbot.db")
+
+# "dedup" stores each message once and checkpoints as compressed references (see checkpoint_store.py);
+# "plain" is LangGraph's default format. Switching back needs `python checkpoint_store.py migrate --revert`.
+CHECKPOINT_FORMAT = os.getenv("CHECKPOINT_FORMAT", "dedup")
 
 async def _init_checkpointer():
     connection = await aiosqlite.connect(checkpoint_db_path)
-    return AsyncSqliteSaver(conn=connection)
+    if CHECKPOINT_FORMAT == "plain":
+        return AsyncSqliteSaver(conn=connection)
+    return DedupSqliteSaver(conn=connection, serde=DedupSerializer(checkpoint_db_path))
 
 checkpointer = run_async(_init_checkpointer())
 
@@ -366,7 +617,7 @@ graph.add_node("chat_node", chat_node)
 graph.add_edge(START, "chat_node")
 
 if tool_node:
-    graph.add_node("tools", tool_node)
+    graph.add_node("tools", tools_node)
     graph.add_conditional_edges("chat_node", tools_condition) # If LLM invokes a tool, go to tool_node
     graph.add_edge("tools", "chat_node")  # After tool execution, return to chat_node
 else:
@@ -0,0 +1,510 @@
+import concurrent.futures, contextlib, contextvars, functools, heapq, inspect, itertools, logging, os, threading, time, requests
+from collections import defaultdict, deque
+from urllib.parse import urlsplit
+from kv_cache import KVCache
+
+logger = logging.getLogger("upstream")
+
+# When set (e.g. http://127.0.0.1:8765), every upstream HTTP call is sent to this local stub
+# instead of the real provider. Used by the offline benchmarks in benchmarks/.
+UPSTREAM_STUB_URL = os.getenv("UPSTREAM_STUB_URL")
+
+# Provider of each upstream host; quotas and rate limits are tracked per provider
+PROVIDER_HOSTS = {
+    "api.amadeus.com": "amadeus",
+    "test.api.amadeus.com": "amadeus",
+    "sky-scrapper.p.rapidapi.com": "sky_scrapper",
+    "booking-com.p.rapidapi.com": "booking",
+    "currency-conversion-and-exchange-rates.p.rapidapi.com": "currency",
+    "places-api.foursquare.com": "foursquare",
+    "api.openweathermap.org": "openweather",
+    "nominatim.openstreetmap.org": "nominatim",
+}
+
+# Requests per second, burst size and monthly quota (None = unmetered) per provider, from the plans in use.
+# Monthly quotas can be overridden with UPSTREAM_QUOTA_<PROVIDER>, e.g. UPSTREAM_QUOTA_BOOKING=10000.
+PROVIDER_LIMITS = {
+    "amadeus": {"rate": 10.0, "burst": 10, "monthly": 2000},
+    "sky_scrapper": {"rate": 5.0, "burst": 5, "monthly": 500},
+    "booking": {"rate": 5.0, "burst": 5, "monthly": 500},
+    "currency": {"rate": 1.0, "burst": 2, "monthly": 1000},
+    "foursquare": {"rate": 50.0, "burst": 50, "monthly": 10000},
+    "openweather": {"rate": 1.0, "burst": 60, "monthly": 1000000},
+    "nominatim": {"rate": 1.0, "burst": 1, "monthly": None},
+}
+for _name, _limits in PROVIDER_LIMITS.items():
+    if os.getenv(f"UPSTREAM_QUOTA_{_name.upper()}"):
+        _limits["monthly"] = int(os.environ[f"UPSTREAM_QUOTA_{_name.upper()}"])
+
+# Priority levels; lower values are served first
+INTERACTIVE, PREFETCH = 0, 1
+
+# How long a request may queue for a rate-limit token before giving up
+MAX_WAIT = {INTERACTIVE: 10.0, PREFETCH: 2.0}
+
+# Prefetching may only use this share of a monthly quota; the rest is kept for interactive turns
+PREFETCH_QUOTA_SHARE = 0.8
+
+# Back-off after a 429 without a usable Retry-After header
+DEFAULT_RETRY_AFTER = 5.0
+
+QUOTA_TTL = 40 * 24 * 3600
+
+# (connect, read) timeout of every upstream GET; an active deadline shortens it further
+DEFAULT_TIMEOUT = (3.05, 10.0)
+
+# Circuit breaker: open after this many consecutive failures, probe again after the cool-down
+BREAKER_FAILURES = 5
+BREAKER_RESET = 30.0
+
+# Hedged GETs: send a backup request once the primary is slower than the provider's recent p95
+HEDGE_MIN_DELAY = 0.05
+HEDGE_DEFAULT_DELAY = 1.0
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+# Tool argument carrying the chat process's remaining turn budget to the MCP servers; deadlines are
+# contextvars and do not cross the stdio boundary on their own
+BUDGET_ARG = "budget_s"
+
+_priority = contextvars.ContextVar("upstream_priority", default=INTERACTIVE)
+_deadline = contextvars.ContextVar("upstream_deadline", default=None)
+
+class UpstreamUnavailable(RuntimeError):
+    """ A provider could not be used for this call; callers fall back to cached data where they have it. """
+
+    def __init__(self, provider: str, reason: str):
+        super().__init__(f"{provider}: {reason}")
+        self.provider = provider
+        self.reason = reason
+
+class QuotaExceeded(UpstreamUnavailable):
+    """ Raised instead of calling a provider whose rate limit or monthly quota is exhausted. """
+
+class CircuitOpen(UpstreamUnavailable):
+    """ Raised instead of calling a provider that keeps failing, until its cool-down has passed. """
+
+class DeadlineExceeded(UpstreamUnavailable):
+    """ Raised when the turn's deadline leaves no time for the call. """
+
+@contextlib.contextmanager
+def priority(level: int):
+    """ Run upstream calls made in this context (and threads started via asyncio.to_thread) at `level`. """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority() -> int:
+    """ Priority level of upstream calls made in this context. """
+    return _priority.get()
+
+@contextlib.contextmanager
+def deadline(at: float):
+    """ Bound upstream calls in this context to finish by `at` (epoch seconds); nested deadlines only tighten. """
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def time_left():
+    """ Seconds left before the active deadline, or None without one. """
+    at = _deadline.get()
+    return None if at is None else at - time.time()
+
+def with_budget(fn):
+    """ Let an MCP tool take the caller's remaining turn budget (BUDGET_ARG, in seconds) and bound its upstream calls by it. """
+    signature = inspect.signature(fn)
+    budget = inspect.Parameter(BUDGET_ARG, inspect.Parameter.KEYWORD_ONLY, default=None, annotation=float)
+
+    @functools.wraps(fn)
+    def bounded(*args, **kwargs):
+        seconds = kwargs.pop(BUDGET_ARG, None)
+        if seconds is None:
+            return fn(*args, **kwargs)
+        with deadline(time.time() + float(seconds)):
+            return fn(*args, **kwargs)
+
+    bounded.__signature__ = signature.replace(parameters=[*signature.parameters.values(), budget])
+    bounded.__annotations__ = {**fn.__annotations__, BUDGET_ARG: float}
+    return bounded
+
+def provider_for(url: str):
+    return PROVIDER_HOSTS.get(urlsplit(url).hostname or "")
+
+class TokenBucket:
+    """ Thread-safe token bucket whose waiters are served in priority order, then arrival order. """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, level: int = INTERACTIVE, max_wait: float = 10.0) -> bool:
+        """ Take one token, waiting up to max_wait seconds behind higher-priority waiters; False on timeout. """
+        deadline = time.monotonic() + max_wait
+        entry = (level, next(self._seq))
+
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    head = self._waiters[0] == entry
+                    if head and self.tokens >= 1 and now >= self.blocked_until:
+                        self.tokens -= 1
+                        return True
+                    if now >= deadline:
+                        return False
+
+                    # The head sleeps until its token is due; everyone else until the head leaves
+                    wait = deadline - now
+                    if head:
+                        wait = min(wait, max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0.001))
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def penalize(self, seconds: float):
+        """ Hand out no tokens for `seconds` (after the provider answered 429). """
+        with self._cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+            self._cond.notify_all()
+
+class CircuitBreaker:
+    """ Closed -> open after repeated failures -> half-open (one probe) after a cool-down -> closed on success. """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_after: float = BREAKER_RESET):
+        self.failures = failures
+        self.reset_after = reset_after
+        self.consecutive = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_after else "open"
+
+    def allow(self):
+        """ "closed" or "probe" if a call may go out, None if the circuit is open. """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return "closed"
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return "probe"
+            return None
+
+    def release(self):
+        """ End a probe that never produced an outcome (refused locally or failed unexpectedly). """
+        with self._lock:
+            self._probing = False
+
+    def success(self):
+        with self._lock:
+            self.consecutive, self.opened_at, self._probing = 0, None, False
+
+    def failure(self):
+        with self._lock:
+            self.consecutive += 1
+            if self._probing or self.consecutive >= self.failures:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+class UpstreamScheduler:
+    """
+    Central admission control for upstream providers: a priority token bucket per provider and
+    monthly quota accounting persisted in the shared KV cache (so every MCP server process and
+    restart sees the same counts). When a budget is exhausted the call is refused with
+    QuotaExceeded, and callers fall back to cached data.
+    """
+
+    def __init__(self, limits: dict = None, quota_cache: KVCache = None):
+        self.limits = limits or PROVIDER_LIMITS
+        self.buckets = {name: TokenBucket(l["rate"], l["burst"]) for name, l in self.limits.items()}
+        self.quota = quota_cache or KVCache("upstream.quota")
+        self.stats = defaultdict(lambda: defaultdict(int))
+        self.breakers = defaultdict(CircuitBreaker)
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def _month_key(self, provider: str) -> str:
+        return f"{provider}:{time.strftime('%Y-%m', time.gmtime())}"
+
+    def used(self, provider: str) -> int:
+        return int(self.quota.get(self._month_key(provider), 0))
+
+    def remaining(self, provider: str):
+        monthly = self.limits.get(provider, {}).get("monthly")
+        return None if monthly is None else max(0, monthly - self.used(provider))
+
+    @contextlib.contextmanager
+    def slot(self, provider: str, level: int = None, max_wait: float = None):
+        """ Admit one request to `provider` at the current priority, or raise an UpstreamUnavailable. """
+        left = time_left()
+        if left is not None and left <= 0:
+            raise DeadlineExceeded(provider or "upstream", "turn deadline passed")
+
+        if provider not in self.limits:
+            yield
+            return
+
+        breaker = self.breakers[provider]
+        admission = breaker.allow()
+        if admission is None:
+            self.stats[provider]["refused_circuit"] += 1
+            raise CircuitOpen(provider, "circuit open after repeated failures")
+
+        try:
+            yield from self._admit(provider, level, max_wait, left)
+        finally:
+            if admission == "probe":
+                breaker.release()
+
+    def _admit(self, provider: str, level: int, max_wait: float, left: float):
+        level = _priority.get() if level is None else level
+        max_wait = MAX_WAIT.get(level, MAX_WAIT[INTERACTIVE]) if max_wait is None else max_wait
+        if left is not None:
+            max_wait = min(max_wait, left)
+        stats = self.stats[provider]
+        monthly = self.limits[provider].get("monthly")
+        share = 1.0 if level == INTERACTIVE else PREFETCH_QUOTA_SHARE
+
+        # Cheap check first so an exhausted provider does not make callers queue for a token
+        if monthly is not None and self.used(provider) >= monthly * share:
+            stats["refused_quota"] += 1
+            raise QuotaExceeded(provider, "monthly quota exhausted")
+
+        if not self.buckets[provider].acquire(level, max_wait):
+            stats["refused_rate"] += 1
+            raise QuotaExceeded(provider, "rate limit")
+
+        # Count atomically and give the unit back if another caller (or process) took the last one meanwhile
+        used = self.quota.incr(self._month_key(provider), 1, ttl=QUOTA_TTL)
+        if monthly is not None and used > monthly * share:
+            self.quota.incr(self._month_key(provider), -1, ttl=QUOTA_TTL)
+            stats["refused_quota"] += 1
+            raise QuotaExceeded(provider, "monthly quota exhausted")
+
+        stats["admitted" if level == INTERACTIVE else "admitted_prefetch"] += 1
+        yield
+
+    def rate_limited(self, provider: str, retry_after: float = None):
+        """ Record a 429 from the provider and stop sending to it for a while. """
+        self.stats[provider]["http_429"] += 1
+        if provider in self.buckets:
+            self.buckets[provider].penalize(retry_after or DEFAULT_RETRY_AFTER)
+        logger.warning("upstream %s returned 429; backing off %.1fs", provider, retry_after or DEFAULT_RETRY_AFTER)
+
+    def record(self, provider: str, ok: bool, latency: float = None):
+        """ Feed the provider's circuit breaker and latency window with the outcome of one call. """
+        if provider is None:
+            return
+        if ok:
+            self.breakers[provider].success()
+            if latency is not None:
+                self.latencies[provider].append(latency)
+        else:
+            self.stats[provider]["failures"] += 1
+            self.breakers[provider].failure()
+
+    def hedge_delay(self, provider: str) -> float:
+        """ p95 of recent successful latencies: past this, a backup request is likely to win. """
+        samples = sorted(self.latencies[provider])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, samples[int(0.95 * (len(samples) - 1))])
+
+    def report(self) -> dict:
+        return {provider: {**stats, "used_this_month": self.used(provider), "remaining": self.remaining(provider),
+                           "circuit": self.breakers[provider].state}
+                for provider, stats in self.stats.items()}
+
+scheduler = UpstreamScheduler()
+
+def resolve_url(url: str) -> str:
+    """ Map a provider URL to the stub as /<host>/<path> when a stub is configured. """
+    if not UPSTREAM_STUB_URL:
+        return url
+
+    parts = urlsplit(url)
+    return f"{UPSTREAM_STUB_URL.rstrip('/')}/{parts.netloc}{parts.path}"
+
+def stub_endpoint():
+    """ Return (host, port, scheme) of the stub for SDKs that take a host instead of a URL, else None. """
+    if not UPSTREAM_STUB_URL:
+        return None
+
+    parts = urlsplit(UPSTREAM_STUB_URL)
+    return parts.hostname, parts.port or (443 if parts.scheme == "https" else 80), parts.scheme
+
+def _retry_after(response) -> float:
+    # requests and urllib expose a mapping; the Amadeus SDK may hand over a list of (name, value) pairs
+    headers = getattr(response, "headers", None) or {}
+    if not hasattr(headers, "get"):
+        headers = dict(headers)
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def request_timeout(timeout=None):
+    """ The timeout for one HTTP request: the given or default one, cut to the time left before the deadline. """
+    timeout = timeout or DEFAULT_TIMEOUT
+    left = time_left()
+    if left is None:
+        return timeout
+
+    left = max(0.001, left)
+    if isinstance(timeout, tuple):
+        return min(timeout[0], left), min(timeout[1], left)
+    return min(timeout, left)
+
+# SDK errors (geopy, Amadeus) meaning the provider is slow, unreachable or failing; matched by exact
+# class name so this module does not import the SDKs (their base classes also cover client errors)
+SDK_FAILURES = {"GeocoderTimedOut", "GeocoderUnavailable", "GeocoderServiceError", "NetworkError", "ServerError"}
+
+# SDK errors meaning the provider rate-limited us; Amadeus instead raises a ClientError whose response has status 429
+SDK_RATE_LIMITS = {"GeocoderRateLimited"}
+
+def _is_rate_limited(error: BaseException) -> bool:
+    if type(error).__name__ in SDK_RATE_LIMITS:
+        return True
+    return getattr(getattr(error, "response", None), "status_code", None) == 429
+
+def _is_failure(error: BaseException) -> bool:
+    """ Timeouts, connection errors and 5xx count against a provider's breaker; client errors (4xx) and the rest do not. """
+    if isinstance(error, (requests.Timeout, requests.ConnectionError, TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in SDK_FAILURES:
+        return True
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and status >= 500
+
+def _cut_by_deadline(requested, effective, error: BaseException) -> bool:
+    """ True if a requests timeout fired only because the turn's deadline shortened it. """
+    requested = requested or DEFAULT_TIMEOUT
+    if not isinstance(requested, tuple):
+        return effective < requested
+    part = 0 if isinstance(error, requests.ConnectTimeout) else 1
+    return effective[part] < requested[part]
+
+def _send(provider: str, url: str, kwargs: dict, level: int = None, max_wait: float = None) -> requests.Response:
+    # Bound once so a slow (e.g. losing hedge) request reports to the scheduler that admitted it
+    admitted_by = scheduler
+    with admitted_by.slot(provider, level, max_wait):
+        started = time.monotonic()
+        timeout = request_timeout(kwargs.get("timeout"))
+        try:
+            response = requests.get(resolve_url(url), **{**kwargs, "timeout": timeout})
+        except (requests.Timeout, requests.ConnectionError) as e:
+            name = provider or urlsplit(url).hostname
+            # The turn ran out of time, not the provider: keep it out of the breaker
+            if isinstance(e, requests.Timeout) and _cut_by_deadline(kwargs.get("timeout"), timeout, e):
+                raise DeadlineExceeded(name, "turn deadline reached during the request") from e
+            admitted_by.record(provider, False)
+            raise UpstreamUnavailable(name, f"{type(e).__name__}: {e}") from e
+        admitted_by.record(provider, response.status_code < 500, time.monotonic() - started)
+
+    if response.status_code == 429 and provider:
+        admitted_by.rate_limited(provider, _retry_after(response))
+        raise QuotaExceeded(provider, "HTTP 429")
+    return response
+
+_hedge_pool = concurrent.futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="upstream-hedge")
+
+def _hedged(provider: str, url: str, kwargs: dict) -> requests.Response:
+    """ Send the request; if it is still pending after the p95 delay, race a backup and keep the first answer. """
+    delay = scheduler.hedge_delay(provider)
+    primary = _hedge_pool.submit(contextvars.copy_context().run, _send, provider, url, kwargs)
+    try:
+        return primary.result(timeout=delay)
+    except concurrent.futures.TimeoutError:
+        pass
+
+    # The backup must not queue: it only helps if it can go out right now
+    backup = _hedge_pool.submit(contextvars.copy_context().run, _send, provider, url, kwargs, None, 0.0)
+    scheduler.stats[provider]["hedged"] += 1
+
+    pending = {primary, backup}
+    error = None
+    while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is backup:
+                    scheduler.stats[provider]["hedge_won"] += 1
+                return future.result()
+            # A backup refused for lack of tokens is not the interesting error; keep the primary's
+            if error is None or future is primary:
+                error = future.exception()
+    raise error
+
+def get(url: str, hedge: bool = False, **kwargs) -> requests.Response:
+    """
+    GET an upstream provider URL (requests.get semantics), admitted by the scheduler and bounded by
+    DEFAULT_TIMEOUT and the active deadline. hedge=True (idempotent lookups only) sends a backup request
+    when the first is slower than the provider's p95. Raises an UpstreamUnavailable on 429, timeouts,
+    connection errors, an open circuit or a passed deadline.
+    """
+    provider = provider_for(url)
+    if hedge and provider is not None:
+        return _hedged(provider, url, kwargs)
+    return _send(provider, url, kwargs)
+
+def json_body(response: requests.Response, require: str = None):
+    """
+    The JSON body of a successful provider response. Error statuses, non-JSON bodies and (for a dict
+    body) a missing `require` key raise UpstreamUnavailable, so callers fall back to cached data
+    instead of caching an error body as an empty result.
+    """
+    name = provider_for(response.url or "") or urlsplit(response.url or "").hostname or "upstream"
+    if not response.ok:
+        raise UpstreamUnavailable(name, f"HTTP {response.status_code}")
+    try:
+        data = response.json()
+    except ValueError as e:
+        raise UpstreamUnavailable(name, "response is not JSON") from e
+    if require is not None and (not isinstance(data, dict) or require not in data):
+        raise UpstreamUnavailable(name, f"response without {require!r}")
+    return data
+
+def call(provider: str, fn, *args, **kwargs):
+    """ Run an SDK call (Amadeus, geopy) that does its own HTTP under the provider's scheduler slot and breaker. """
+    with scheduler.slot(provider):
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            # SDK timeouts cut by request_timeout() once the deadline has passed say nothing about the provider
+            left = time_left()
+            if left is not None and left <= 0.01:
+                raise DeadlineExceeded(provider, "turn deadline reached during the request") from e
+            # A 429 means the provider is up but wants us to back off, same as in _send
+            if _is_rate_limited(e):
+                scheduler.record(provider, True)
+                scheduler.rate_limited(provider, getattr(e, "retry_after", None) or _retry_after(getattr(e, "response", None)))
+                raise QuotaExceeded(provider, f"{type(e).__name__}: rate limited") from e
+            scheduler.record(provider, not _is_failure(e))
+            raise
+        scheduler.record(provider, True, time.monotonic() - started)
+    return result
@@ -1,7 +1,13 @@
 from fastmcp import FastMCP
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-import os, requests
+from model_router import get_model
+from singleflight import coalesce
+from kv_cache import KVCache
+from forecast import ForecastSeries
+from prompt_builder import PromptTemplate
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import os, contextvars, time, upstream
 import streamlit as st
 
 load_dotenv()
@@ -21,8 +27,22 @@ if not OPENWEATHER_API_KEY:
 
 mcp = FastMCP("weather")
 
-# Initialize the LLM
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.5, api_key=OPENAI_API_KEY)
+# Initialize the summarization LLM (cheapest adequate tier, with fallbacks)
+llm = get_model("summarization", temperature=0.5, api_key=OPENAI_API_KEY)
+
+# Upper bound on concurrent upstream fetches for one batch call
+BATCH_MAX_WORKERS = 8
+
+# Column order of the compact table returned by get_weather_forecast_batch
+BATCH_COLUMNS = ["location", "date", "condition", "temp_min", "temp_max", "precipitation_mm",
+                 "precipitation_probability", "wind_max_ms"]
+
+# OpenWeather issues a new 5-day/3-hour forecast every 3 hours; cache one per coordinate and issue slot
+FORECAST_ISSUE_INTERVAL = 3 * 3600
+GEOCODE_TTL = 30 * 24 * 3600
+
+geocode_cache = KVCache("openweather.geocode")
+forecast_cache = KVCache("openweather.forecast")
 
 @mcp.tool()
 def convert_fahrenheit_to_celsius(fahrenheit: float) -> float:
@@ -30,8 +50,14 @@ def convert_fahrenheit_to_celsius(fahrenheit: float) -> float:
     celsius = (fahrenheit - 32) * 5.0/9.0
     return round(celsius, 2)
 
+@coalesce("weather.geocode")
 def get_geographical_coordinates(location: str):
     """ Get the geographical coordinates (latitude and longitude) for a given location using the OpenWeatherMap Geocoding API. """
+    key = " ".join(location.split()).casefold()
+    cached = geocode_cache.get(key)
+    if cached:
+        return cached[0], cached[1]
+    
     url = "https://api.openweathermap.org/geo/1.0/direct"
     
     params = {
@@ -40,23 +66,67 @@ def get_geographical_coordinates(location: str):
         "appid": OPENWEATHER_API_KEY
     }
     
-    response = requests.get(url, params=params)
+    try:
+        response = upstream.get(url, hedge=True, params=params)
+    except upstream.UpstreamUnavailable:
+        stale = geocode_cache.get(key, allow_stale=True)
+        if stale:
+            return stale[0], stale[1]
+        raise
+    
     data = response.json()
     
     if not data:
         raise ValueError("Location not found")
     
+    geocode_cache.set(key, [data[0]["lat"], data[0]["lon"]], ttl=GEOCODE_TTL)
     return data[0]["lat"], data[0]["lon"]
 
-def get_weather_overview(forecast_data):
-    """Generate a concise, travel-oriented weather overview using the LLM."""
+@coalesce("weather.fetch_forecast")
+def fetch_forecast(latitude: float, longitude: float) -> ForecastSeries:
+    """ Fetch the 5-day/3-hour forecast for a coordinate, cached per forecast issue slot. """
+    slot = int(time.time() // FORECAST_ISSUE_INTERVAL)
+    key = f"{latitude:.2f},{longitude:.2f}:{slot}"
+    
+    cached = forecast_cache.get(key)
+    if cached:
+        return ForecastSeries.from_dict(cached)
+    
+    url = "https://api.openweathermap.org/data/2.5/forecast"
+    
+    query_params = {
+        "lat": latitude,
+        "lon": longitude,
+        "units": "metric",
+        "appid": OPENWEATHER_API_KEY
+    }
+    
+    try:
+        response = upstream.get(url=url, hedge=True, params=query_params)
+        # An error body (bad key, 429, unknown place) has no "list"; it must not be cached as an empty forecast
+        payload = upstream.json_body(response, require="list")
+        if not payload["list"]:
+            raise upstream.UpstreamUnavailable("openweather", "empty forecast")
+    except upstream.UpstreamUnavailable:
+        # Out of budget, provider down or an error response: serve the newest forecast we still hold for this coordinate
+        for older in range(slot - 1, slot - 9, -1):
+            stale = forecast_cache.get(f"{latitude:.2f},{longitude:.2f}:{older}", allow_stale=True)
+            if stale:
+                return ForecastSeries.from_dict(stale)
+        raise
+    
+    series = ForecastSeries.from_openweather(payload)
+    forecast_cache.set(key, series.to_dict(), ttl=FORECAST_ISSUE_INTERVAL)
+    return series
 
-    prompt = f"""
-    You are a professional travel assistant. The user is planning a trip and needs a 
+WEATHER_OVERVIEW_PROMPT = PromptTemplate(
+    "weather_overview",
+    """
+    You are a professional travel assistant. The user is planning a trip and needs a
     clear, helpful, traveler-focused weather overview.
 
-    Here is the raw multi-day forecast data:
-    {forecast_data}
+    The daily forecast is given as a table below (temperatures in Celsius, precipitation in mm,
+    precipitation probability 0-1, wind in m/s, humidity in %).
 
     Produce a concise summary that:
     - Starts with the overall trend (warm/cool, rainy/sunny, stable/changing)
@@ -71,30 +141,81 @@ def get_weather_overview(forecast_data):
     - Avoids repeating raw data
     - Avoids unnecessary details
 
-    Always convert temperature values to Celsius before giving recommendations using the convert_fahrenheit_to_celsius tool.
     Keep it short, helpful, and actionable for a traveler.
-    """
+    """,
+    fields=["date", "condition", "temp_min", "temp_max", "precipitation_mm", "precipitation_probability",
+            "wind_max_ms", "humidity"],
+    max_tokens=800
+)
 
+def get_weather_overview(forecast_data, raw=None):
+    """Generate a concise, travel-oriented weather overview using the LLM; raw is the parsed 3-hourly entries it summarizes."""
+    prompt = WEATHER_OVERVIEW_PROMPT.render(forecast_data, raw=raw)
     response = llm.invoke(prompt)
     return response.content if hasattr(response, "content") else str(response)
+
 @mcp.tool()
-def get_weather_forecast(location: str, num_days: int = 5):
-    """ """
-    url = "https://api.openweathermap.org/data/2.5/forecast"
-    
+@upstream.with_budget
+@coalesce("weather.get_weather_forecast")
+def get_weather_forecast(location: str, num_days: int = 5, narrate: bool = False):
+    """ Daily weather forecast (up to 5 days) for a location: min/max temperature in Celsius, precipitation, rain probability, max wind and dominant condition per day. Set narrate=True to also get a short traveler-oriented overview. """
     # Get the latitude and longitude for the location
     latitude, longitude = get_geographical_coordinates(location)
+    series = fetch_forecast(latitude, longitude)
+    daily = series.daily(num_days)
     
-    query_params = {
-        "lat": latitude,
-        "lon": longitude,
-        "appid": OPENWEATHER_API_KEY
+    result = {
+        "location": location,
+        "units": "metric",
+        "issued_at": series.issued_at,
+        "days": daily
     }
     
-    response = requests.get(url=url, params=query_params)
-    weather_forecast = response.json()["list"][:num_days]  # Get the first num_days forecast entries
-    weather_overview = get_weather_overview(weather_forecast)
-    return weather_overview
+    if narrate:
+        result["overview"] = get_weather_overview(daily, raw=series.entries({day["date"] for day in daily}))
+        
+    return result
+
+@mcp.tool()
+@upstream.with_budget
+def get_weather_forecast_batch(locations: List[str], date_windows: Dict[str, List[str]] = None, num_days: int = 5):
+    """ Daily forecasts for several locations in one call (use for multi-city trips). date_windows optionally maps a location to [start_date, end_date] (YYYY-MM-DD) to keep only the days you will be there. Returns one compact table: one row per location and day. """
+    date_windows = date_windows or {}
+    unique = list(dict.fromkeys(location.strip() for location in locations if location.strip()))
+    
+    def forecast_for(location: str):
+        latitude, longitude = get_geographical_coordinates(location)
+        window = date_windows.get(location) or [None, None]
+        start_date, end_date = (list(window) + [None, None])[:2]
+        days = fetch_forecast(latitude, longitude).daily(start_date=start_date, end_date=end_date)
+        return days if start_date or end_date else days[:num_days]
+    
+    rows, errors = [], {}
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_MAX_WORKERS, len(unique)))) as pool:
+        futures = {location: pool.submit(contextvars.copy_context().run, forecast_for, location) for location in unique}
+        
+        for location, future in futures.items():
+            try:
+                days = future.result()
+            except Exception as e:
+                errors[location] = str(e)
+                continue
+                
+            for day in days:
+                rows.append([location] + [day[column] for column in BATCH_COLUMNS[1:]])
+    
+    result = {"units": "metric", "columns": BATCH_COLUMNS, "rows": rows}
+    if errors:
+        result["errors"] = errors
+    return result
+
+@mcp.tool()
+@upstream.with_budget
+def prefetch_forecast(location: str):
+    """ Internal: warm the geocode and forecast caches at prefetch priority. Not exposed to the agent. """
+    with upstream.priority(upstream.PREFETCH):
+        latitude, longitude = get_geographical_coordinates(location)
+        return {"location": location, "samples": len(fetch_forecast(latitude, longitude))}
 
 if __name__ == "__main__":
     mcp.run()
\ No newline at end of file